@@ -0,0 +1,88 @@
+'''
+    About: Measures the cold start import cost of a lambda function.
+           Imports the lambda module on a new python process with -X importtime,
+           reports the slowest imported modules and fails (exit code 1) when the
+           module-level import cost is over the budget.
+
+    Usage: python benchmarks/cold_start.py [--lambda-dir DIR] [--budget-ms MS] [--top N]
+'''
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+
+DEFAULT_LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', 'lambdas',
+                                  'csv_to_parquet')
+DEFAULT_BUDGET_MS = 300
+
+
+def main():
+    setup_logging()
+    args = parse_args()
+
+    import_times = measure_import_times(args.lambda_dir, args.module)
+    total_ms = import_times[args.module]
+
+    logging.info(f'Slowest {args.top} imports (cumulative):')
+    slowest = sorted(import_times.items(),
+                     key=lambda item: item[1],
+                     reverse=True)[:args.top]
+    for module_name, cumulative_ms in slowest:
+        logging.info(f'{cumulative_ms:10.1f} ms  {module_name}')
+
+    logging.info(
+        f'Import of {args.module} took {total_ms:.1f} ms. Budget: {args.budget_ms} ms.'
+    )
+    if total_ms > args.budget_ms:
+        logging.error('Cold start import budget exceeded.')
+        sys.exit(1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Measures the import time of a lambda module.')
+    parser.add_argument('--lambda-dir', default=DEFAULT_LAMBDA_DIR)
+    parser.add_argument('--module', default='main')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument('--top', type=int, default=15)
+    return parser.parse_args()
+
+
+# returns the cumulative import time, in ms, of every module imported by the
+# lambda module. Parses the "import time:" lines written by -X importtime.
+def measure_import_times(lambda_dir, module_name):
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+        cwd=lambda_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'))
+    if completed.returncode != 0:
+        logging.error(completed.stderr)
+        raise RuntimeError(f'Failed to import {module_name}.')
+
+    import_times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative_us, imported_module = line.split('|')
+        if not cumulative_us.strip().isdigit():
+            continue  # header line
+        import_times[imported_module.strip()] = int(cumulative_us) / 1000
+    return import_times
+
+
+def setup_logging():
+    root = logging.getLogger()
+    if root.handlers:
+        for h in root.handlers:
+            root.removeHandler(h)
+    logging.basicConfig(format='[%(asctime)s][%(levelname)s]   %(message)s',
+                        level='INFO')
+
+
+if __name__ == '__main__':
+    main()
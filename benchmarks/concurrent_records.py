@@ -0,0 +1,135 @@
+'''
+    About: Speedup of loading the records of an event concurrently.
+           An event of --records files (copies of a test-data dataset, scaled
+           to more rows, each one of its own table) is loaded by the handler with each MAX_WORKERS of
+           --workers, on cloud mode with the local fakes of fakes.py. Every
+           s3, glue and sns request waits --latency-ms, as a request to aws
+           does, since the time the workers overlap is mostly spent waiting
+           for those requests. Each run is a new python process.
+
+           Reports the wall time of each run and its speedup over the first
+           one.
+
+    Usage: python benchmarks/concurrent_records.py [--dataset NAME] [--records N]
+                                                   [--scale N] [--workers N ...]
+                                                   [--latency-ms MS]
+'''
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import throughput
+
+
+def main():
+    throughput.setup_logging()
+    args = parse_args()
+    if args.run_workers:
+        print(json.dumps(run_workers(args)))
+        return
+
+    work_dir = tempfile.mkdtemp(prefix='csv_to_parquet_')
+    try:
+        dataset = throughput.find_datasets([args.dataset])[0]
+        csv_path = os.path.join(work_dir, f'{args.dataset}.x{args.scale}.csv')
+        throughput.write_scaled_csv(dataset['csv_path'], csv_path, args.scale)
+        logging.info(
+            f'Loading {args.records} files of {os.path.getsize(csv_path) / 1024**2:.1f} MB with {args.latency_ms} ms per aws request.'
+        )
+
+        first_seconds = None
+        for workers in args.workers:
+            command = [
+                sys.executable, __file__, '--run-workers',
+                str(workers), '--dataset', args.dataset, '--records',
+                str(args.records), '--latency-ms',
+                str(args.latency_ms), '--csv-path', csv_path
+            ]
+            output = subprocess.run(command,
+                                    check=True,
+                                    stdout=subprocess.PIPE).stdout
+            result = json.loads(output.decode().strip().splitlines()[-1])
+            first_seconds = first_seconds or result['seconds']
+            logging.info(
+                f'MAX_WORKERS={workers}: {result["seconds"]:.2f}s, {result["rows"] / result["seconds"]:,.0f} rows/s, speedup {first_seconds / result["seconds"]:.2f}x'
+            )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the concurrent load of the event records.')
+    parser.add_argument('--dataset', default='insurance')
+    parser.add_argument('--records', type=int, default=16)
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4, 8])
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--run-workers', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--csv-path', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+# loads the event with MAX_WORKERS=args.run_workers. Runs on its own process.
+def run_workers(args):
+    os.environ.update({
+        'EXECUTION_MODE': 'cloud',
+        'TARGET_S3_BUCKET': throughput.ANALYTICS_BUCKET,
+        'TARGET_GLUE_DATABASE': throughput.GLUE_DATABASE,
+        'SNS_TOPIC_NAME': 'benchmark',
+        'MAX_WORKERS': str(args.run_workers),
+        'NOTIFICATION_WINDOW_SECONDS': '0',
+        'STAGE_METRICS': 'false',
+        'LOG_LEVEL': 'WARNING'
+    })
+    sys.path.insert(0, throughput.LAMBDA_DIR)
+    import fakes
+    import main as csv_to_parquet
+
+    dataset = throughput.find_datasets([args.dataset])[0]
+    s3_root = tempfile.mkdtemp(prefix='local_s3_')
+    try:
+        local_s3 = fakes.LocalS3(s3_root)
+        object_keys = []
+        for record in range(args.records):
+            # a table per file, so the files do not overwrite the partitions
+            # of each other
+            object_key = f'csv_to_analytics/{args.dataset}_{record}/{args.dataset}.csv'
+            local_s3.put_file(throughput.RAW_BUCKET, object_key, args.csv_path,
+                              dataset['metadata'])
+            object_keys.append(object_key)
+        clients = fakes.install(csv_to_parquet, local_s3)
+        slow_clients = {
+            service_name: fakes.SlowClient(client, args.latency_ms / 1000)
+            for service_name, client in clients.items()
+        }
+        csv_to_parquet.boto3 = fakes.FakeBoto3(slow_clients)
+        event = fakes.build_event(local_s3, throughput.RAW_BUCKET,
+                                  object_keys)
+        context = type(
+            'Context', (), {
+                'invoked_function_arn':
+                'arn:aws:lambda:us-east-1:000000000000:function:csv_to_parquet'
+            })
+
+        start_time = time.perf_counter()
+        results = csv_to_parquet.handler(event, context)
+        seconds = time.perf_counter() - start_time
+        return {
+            'workers': args.run_workers,
+            'rows': sum(result.get('loaded_rows', 0) for result in results),
+            'seconds': seconds
+        }
+    finally:
+        shutil.rmtree(s3_root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
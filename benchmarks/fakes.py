@@ -0,0 +1,300 @@
+'''
+    About: Local fakes of the AWS services used by the csv_to_parquet lambda.
+           Buckets are directories under a local root, so the lambda can run
+           its cloud code path (handler with EXECUTION_MODE=cloud) without
+           AWS: s3 objects are read from and parquet files are written to the
+           root directory, sns messages and glue tables are kept in memory.
+
+    Usage: local_s3 = LocalS3(root_dir)
+           local_s3.put_file(bucket, key, csv_path, metadata)
+           install(main, local_s3)
+'''
+
+import io
+import os
+import hashlib
+import inspect
+import time
+import uuid
+
+import pyarrow.fs as pa_fs
+
+
+# s3 buckets stored as directories of a local root directory
+class LocalS3:
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.metadata = {}
+        os.makedirs(root_dir, exist_ok=True)
+
+    def path(self, bucket, key=''):
+        return os.path.join(self.root_dir, bucket, *key.split('/'))
+
+    # maps an s3://bucket/key path to its local path
+    def local_path(self, s3_path):
+        bucket, _, key = s3_path.replace('s3://', '', 1).partition('/')
+        return self.path(bucket, key)
+
+    # adds a local file as an s3 object. The file is linked, not copied.
+    def put_file(self, bucket, key, file_path, metadata=None):
+        object_path = self.path(bucket, key)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        if os.path.lexists(object_path):
+            os.remove(object_path)
+        os.symlink(os.path.abspath(file_path), object_path)
+        self.metadata[(bucket, key)] = dict(metadata or {})
+        return self.head(bucket, key)
+
+    def head(self, bucket, key):
+        object_path = self.path(bucket, key)
+        stat = os.stat(object_path)
+        etag = hashlib.md5(f'{object_path}:{stat.st_size}:{stat.st_mtime_ns}'.
+                           encode()).hexdigest()
+        return {
+            'ContentLength': stat.st_size,
+            'ETag': f'"{etag}"',
+            'Metadata': dict(self.metadata.get((bucket, key), {}))
+        }
+
+
+class FakeS3Client:
+
+    def __init__(self, local_s3):
+        self.local_s3 = local_s3
+        self.calls = []
+        # bodies of the streamed GETs, to check that they are closed
+        self.bodies = []
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.calls.append(('head_object', Key))
+        return self.local_s3.head(Bucket, Key)
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self.calls.append(('get_object', Key, Range))
+        response = self.local_s3.head(Bucket, Key)
+        if not Range:
+            # the body is streamed from the file, as boto3 streams it from
+            # the connection
+            response['Body'] = open(self.local_s3.path(Bucket, Key), 'rb')
+            self.bodies.append(response['Body'])
+            return response
+        with open(self.local_s3.path(Bucket, Key), 'rb') as object_file:
+            start, end = Range.replace('bytes=', '').split('-')
+            object_file.seek(int(start))
+            body = object_file.read(int(end) - int(start) + 1)
+        response.update({'Body': io.BytesIO(body), 'ContentLength': len(body)})
+        return response
+
+
+class FakeSnsClient:
+
+    def __init__(self):
+        self.messages = []
+        # number of publish and publish_batch requests
+        self.requests = 0
+
+    def publish(self, TopicArn, Message, Subject=None, **kwargs):
+        self.requests += 1
+        self.messages.append({
+            'TopicArn': TopicArn,
+            'Subject': Subject,
+            'Message': Message
+        })
+        return {'MessageId': uuid.uuid4().hex}
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        if len(PublishBatchRequestEntries) > 10:
+            raise ValueError('TooManyEntriesInBatchRequest')
+        self.requests += 1
+        successful = []
+        for entry in PublishBatchRequestEntries:
+            self.messages.append({
+                'TopicArn': TopicArn,
+                'Subject': entry.get('Subject'),
+                'Message': entry['Message']
+            })
+            successful.append({
+                'Id': entry['Id'],
+                'MessageId': uuid.uuid4().hex
+            })
+        return {'Successful': successful, 'Failed': []}
+
+
+# boto3 module and session returning the fake clients
+class FakeBoto3:
+
+    def __init__(self, clients):
+        self.clients = clients
+
+    def Session(self, *args, **kwargs):
+        return self
+
+    def client(self, service_name, *args, **kwargs):
+        return self.clients[service_name]
+
+
+class FakeGlueExceptions:
+
+    class AlreadyExistsException(Exception):
+        pass
+
+    class EntityNotFoundException(Exception):
+        pass
+
+    class ConcurrentModificationException(Exception):
+        pass
+
+
+# glue client keeping the tables and partitions of the catalog in memory
+class FakeGlueClient:
+
+    exceptions = FakeGlueExceptions
+
+    def __init__(self):
+        self.tables = {}
+        self.partitions = {}
+        # version of each table, increased by every update
+        self.versions = {}
+        self.calls = []
+
+    def get_table(self, DatabaseName, Name, **kwargs):
+        self.calls.append(('get_table', Name))
+        table = dict(self._get_table(DatabaseName, Name))
+        table['VersionId'] = str(self.versions[(DatabaseName, Name)])
+        return {'Table': table}
+
+    def _get_table(self, database, table_name):
+        if (database, table_name) not in self.tables:
+            raise self.exceptions.EntityNotFoundException(table_name)
+        return self.tables[(database, table_name)]
+
+    def create_table(self, DatabaseName, TableInput, **kwargs):
+        self.calls.append(('create_table', TableInput['Name']))
+        table_key = (DatabaseName, TableInput['Name'])
+        if table_key in self.tables:
+            raise self.exceptions.AlreadyExistsException(TableInput['Name'])
+        self.tables[table_key] = TableInput
+        self.partitions[table_key] = {}
+        self.versions[table_key] = 1
+        return {}
+
+    def update_table(self, DatabaseName, TableInput, VersionId=None, **kwargs):
+        self.calls.append(('update_table', TableInput['Name']))
+        table_key = (DatabaseName, TableInput['Name'])
+        self._get_table(DatabaseName, TableInput['Name'])
+        if VersionId is not None and VersionId != str(
+                self.versions[table_key]):
+            raise self.exceptions.ConcurrentModificationException(
+                TableInput['Name'])
+        self.tables[table_key] = TableInput
+        self.versions[table_key] += 1
+        return {}
+
+    def delete_table(self, DatabaseName, Name, **kwargs):
+        self.calls.append(('delete_table', Name))
+        self._get_table(DatabaseName, Name)
+        del self.tables[(DatabaseName, Name)]
+        del self.partitions[(DatabaseName, Name)]
+        del self.versions[(DatabaseName, Name)]
+        return {}
+
+    def batch_create_partition(self, DatabaseName, TableName,
+                               PartitionInputList, **kwargs):
+        self.calls.append(
+            ('batch_create_partition', TableName, len(PartitionInputList)))
+        if len(PartitionInputList) > 100:
+            raise ValueError('At most 100 partitions can be created at once.')
+        partitions = self.partitions[(DatabaseName, TableName)]
+        errors = []
+        for partition_input in PartitionInputList:
+            values = tuple(partition_input['Values'])
+            if values in partitions:
+                errors.append({
+                    'PartitionValues': list(values),
+                    'ErrorDetail': {
+                        'ErrorCode': 'AlreadyExistsException',
+                        'ErrorMessage': 'Partition already exists.'
+                    }
+                })
+            else:
+                partitions[values] = partition_input
+        return {'Errors': errors}
+
+
+# pyarrow.fs whose s3 filesystem is the local s3. Every other attribute is
+# the real pyarrow.fs one.
+class LocalS3ArrowFs:
+
+    def __init__(self, local_s3):
+        self.local_s3 = local_s3
+        self.FileSystem = self
+
+    def __getattr__(self, attribute):
+        return getattr(pa_fs, attribute)
+
+    def from_uri(self, uri):
+        if not uri.startswith('s3://'):
+            return pa_fs.FileSystem.from_uri(uri)
+        filesystem = pa_fs.SubTreeFileSystem(self.local_s3.root_dir,
+                                             pa_fs.LocalFileSystem())
+        return filesystem, uri.replace('s3://', '', 1)
+
+
+# client whose every request waits latency_seconds before calling the wrapped
+# client, as a request to the aws api does
+class SlowClient:
+
+    def __init__(self, client, latency_seconds):
+        self.client = client
+        self.latency_seconds = latency_seconds
+
+    def __getattr__(self, attribute):
+        value = getattr(self.client, attribute)
+        if not inspect.ismethod(value):
+            return value
+
+        def request(*args, **kwargs):
+            time.sleep(self.latency_seconds)
+            return value(*args, **kwargs)
+
+        return request
+
+
+# replaces the aws libraries of the lambda module by the local fakes.
+# Returns the fake clients.
+def install(main, local_s3):
+    clients = {
+        's3': FakeS3Client(local_s3),
+        'sns': FakeSnsClient(),
+        'glue': FakeGlueClient(),
+    }
+    main.boto3 = FakeBoto3(clients)
+    main.pa_fs = LocalS3ArrowFs(local_s3)
+    main.ARROW_FILESYSTEMS.clear()
+    main.BOTO3_SESSION = None
+    main.BOTO3_CLIENTS.clear()
+    main.BOTO3_CLIENTS_STATS.clear()
+    main.GLUE_CATALOG = None
+    main.NOTIFIER = None
+    return clients
+
+
+# builds the s3 event of the given objects, as sent by the raw bucket
+def build_event(local_s3, bucket, keys):
+    records = []
+    for key in keys:
+        head = local_s3.head(bucket, key)
+        records.append({
+            's3': {
+                'bucket': {
+                    'name': bucket
+                },
+                'object': {
+                    'key': key,
+                    'eTag': head['ETag'].strip('"'),
+                    'size': head['ContentLength']
+                }
+            }
+        })
+    return {'Records': records}
@@ -0,0 +1,112 @@
+'''
+    About: Cost of a redelivered event with the manifest of loaded files.
+           An event of --records files (copies of a test-data dataset, each
+           one of its own table) is loaded by the handler, on cloud mode with
+           the local fakes of fakes.py and a json manifest, and then the same
+           event is delivered again. Every s3, glue and sns request waits
+           --latency-ms, as a request to aws does.
+
+           Reports the wall time of the first delivery and of the replay, the
+           requests sent by each one and the size of the largest manifest
+           record, which must stay below the 400 KB limit of a dynamodb item.
+
+    Usage: python benchmarks/manifest_replay.py [--dataset NAME] [--records N]
+                                                [--latency-ms MS]
+'''
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import throughput
+
+DYNAMODB_ITEM_LIMIT_BYTES = 400 * 1024
+
+
+def main():
+    throughput.setup_logging()
+    args = parse_args()
+    os.environ.update({
+        'EXECUTION_MODE': 'cloud',
+        'TARGET_S3_BUCKET': throughput.ANALYTICS_BUCKET,
+        'TARGET_GLUE_DATABASE': throughput.GLUE_DATABASE,
+        'SNS_TOPIC_NAME': 'benchmark',
+        'NOTIFICATION_WINDOW_SECONDS': '0',
+        'STAGE_METRICS': 'false',
+        'LOG_LEVEL': 'WARNING'
+    })
+    sys.path.insert(0, throughput.LAMBDA_DIR)
+    import fakes
+    import main as csv_to_parquet
+
+    dataset = throughput.find_datasets([args.dataset])[0]
+    work_dir = tempfile.mkdtemp(prefix='csv_to_parquet_')
+    try:
+        local_s3 = fakes.LocalS3(os.path.join(work_dir, 's3'))
+        object_keys = []
+        for record in range(args.records):
+            object_key = f'csv_to_analytics/{args.dataset}_{record}/{args.dataset}.csv'
+            local_s3.put_file(throughput.RAW_BUCKET, object_key,
+                              dataset['csv_path'], dataset['metadata'])
+            object_keys.append(object_key)
+        clients = fakes.install(csv_to_parquet, local_s3)
+        csv_to_parquet.boto3 = fakes.FakeBoto3({
+            service_name: fakes.SlowClient(client, args.latency_ms / 1000)
+            for service_name, client in clients.items()
+        })
+        csv_to_parquet.MANIFEST_BACKEND = 'json'
+        csv_to_parquet.MANIFEST_PATH = os.path.join(work_dir, 'manifest.json')
+        event = fakes.build_event(local_s3, throughput.RAW_BUCKET,
+                                  object_keys)
+        context = type(
+            'Context', (), {
+                'invoked_function_arn':
+                'arn:aws:lambda:us-east-1:000000000000:function:csv_to_parquet'
+            })
+
+        for delivery in ('first delivery', 'replay'):
+            requests = _count_requests(clients)
+            start_time = time.perf_counter()
+            results = csv_to_parquet.handler(event, context)
+            seconds = time.perf_counter() - start_time
+            # the handler sets the log level of the lambda (LOG_LEVEL)
+            throughput.setup_logging()
+            statuses = sorted({result['status'] for result in results})
+            logging.info(
+                f'{delivery}: {seconds:.2f}s, {_count_requests(clients) - requests} requests, statuses {statuses}'
+            )
+
+        with open(csv_to_parquet.MANIFEST_PATH) as manifest_file:
+            record_sizes = [
+                len(json.dumps(record).encode())
+                for record in json.load(manifest_file).values()
+            ]
+        logging.info(
+            f'Largest manifest record: {max(record_sizes)} bytes ({max(record_sizes) / DYNAMODB_ITEM_LIMIT_BYTES:.2%} of a dynamodb item).'
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the replay of an event already loaded.')
+    parser.add_argument('--dataset', default='insurance')
+    parser.add_argument('--records', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    return parser.parse_args()
+
+
+# requests sent so far to the fake s3, glue and sns clients
+def _count_requests(clients):
+    return len(clients['s3'].calls) + len(
+        clients['glue'].calls) + clients['sns'].requests
+
+
+if __name__ == '__main__':
+    main()
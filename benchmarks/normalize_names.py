@@ -0,0 +1,73 @@
+'''
+    About: Micro-benchmark of the column name normalization of the csv_to_parquet lambda.
+           Normalizes a wide synthetic header, first with an empty cache (new
+           header) and then repeatedly (same header received by every file).
+
+    Usage: python benchmarks/normalize_names.py [--columns N] [--repeat N]
+'''
+
+import argparse
+import logging
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(__file__), '..', 'lambdas', 'csv_to_parquet'))
+
+import main  # noqa: E402
+
+
+def main_benchmark():
+    setup_logging()
+    args = parse_args()
+    columns = build_header(args.columns)
+
+    main._normalize_name.cache_clear()
+    cold_seconds = timeit.timeit(lambda: main.normalize_names(columns),
+                                 number=1)
+    warm_seconds = timeit.timeit(lambda: main.normalize_names(columns),
+                                 number=args.repeat) / args.repeat
+
+    logging.info(f'Columns: {args.columns}')
+    logging.info(f'New header: {cold_seconds * 1000:.2f} ms')
+    logging.info(f'Cached header: {warm_seconds * 1000:.2f} ms')
+    logging.info(f'Cache: {main._normalize_name.cache_info()}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the column name normalization.')
+    parser.add_argument('--columns', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    return parser.parse_args()
+
+
+# builds unique CamelCase, spaced, dotted and dashed column names
+def build_header(number_of_columns):
+    random.seed(0)
+    separators = ['', ' ', '.', '-', '_']
+    columns = []
+    for index in range(number_of_columns):
+        words = [
+            ''.join(random.choice(string.ascii_lowercase)
+                    for _ in range(5)).capitalize() for _ in range(3)
+        ]
+        columns.append(random.choice(separators).join(words) + str(index))
+    return columns
+
+
+def setup_logging():
+    root = logging.getLogger()
+    if root.handlers:
+        for h in root.handlers:
+            root.removeHandler(h)
+    logging.basicConfig(format='[%(asctime)s][%(levelname)s]   %(message)s',
+                        level='INFO')
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,148 @@
+'''
+    About: Micro-benchmark of the string column steps of the csv_to_parquet lambda.
+           Builds a wide dataframe of object string columns with missing
+           values, as read by the pandas csv reader, and converts it to the
+           arrow table written to parquet with:
+             legacy: str_columns_to_upper and replace_nan_values as they were
+                     before normalize_str_columns replaced them.
+             fused: normalize_str_columns.
+           Each variant runs on its own python process. Reports the wall time
+           and the peak memory allocated on top of the input (python objects,
+           numpy arrays and the arrow memory pool), also as the number of
+           copies of the string data it amounts to.
+
+    Usage: python benchmarks/string_columns.py [--rows N] [--columns N]
+                                               [--null-ratio R] [--repeat N]
+'''
+
+import argparse
+import json
+import logging
+import os
+import random
+import string
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(__file__), '..', 'lambdas', 'csv_to_parquet'))
+
+import main  # noqa: E402
+
+VARIANTS = ('legacy', 'fused')
+
+
+def main_benchmark():
+    setup_logging()
+    args = parse_args()
+    if args.run_variant:
+        print(json.dumps(run_variant(args.run_variant, args)))
+        return
+
+    logging.info(
+        f'Rows: {args.rows}, string columns: {args.columns}, null ratio: {args.null_ratio}'
+    )
+    options = [
+        f'--{name.replace("_", "-")}={getattr(args, name)}'
+        for name in ('rows', 'columns', 'null_ratio', 'repeat')
+    ]
+    for variant in VARIANTS:
+        output = subprocess.run(
+            [sys.executable, __file__, '--run-variant', variant, *options],
+            check=True,
+            stdout=subprocess.PIPE).stdout
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        logging.info(
+            f'{variant}: {result["seconds"] * 1000:.0f} ms, peak {result["peak_mb"]:.1f} MB on top of {result["input_mb"]:.1f} MB of strings ({result["peak_mb"] / result["input_mb"]:.2f} copies)'
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the string column steps.')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--columns', type=int, default=50)
+    parser.add_argument('--null-ratio', type=float, default=0.1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--run-variant', choices=VARIANTS, default=None)
+    return parser.parse_args()
+
+
+# The first run measures the memory, the fastest of the following runs is
+# the wall time, since tracing allocations slows the python code down.
+def run_variant(variant, args):
+    dataframe = build_dataframe(args.rows, args.columns, args.null_ratio)
+    input_bytes = int(dataframe.memory_usage(deep=True).sum())
+    steps = legacy_steps if variant == 'legacy' else fused_steps
+
+    copy = dataframe.copy()
+    tracemalloc.start()
+    table = steps(copy)
+    # arrow buffers are allocated on its own memory pool, not traced
+    peak_bytes = tracemalloc.get_traced_memory()[1] + main.pa.default_memory_pool(
+    ).max_memory()
+    tracemalloc.stop()
+    del copy, table
+
+    seconds = []
+    for _ in range(args.repeat):
+        copy = dataframe.copy()
+        start_time = time.perf_counter()
+        steps(copy)
+        seconds.append(time.perf_counter() - start_time)
+
+    return {
+        'variant': variant,
+        'seconds': min(seconds),
+        'input_mb': input_bytes / 1024**2,
+        'peak_mb': peak_bytes / 1024**2
+    }
+
+
+def legacy_steps(dataframe):
+    df_objects = dataframe.select_dtypes(include='object')
+    for column in df_objects.columns:
+        dataframe.loc[:, column] = main._df_column_to_upper(
+            df_objects[column])
+    df_objects = dataframe.select_dtypes(include='object')
+    df_objects = df_objects.replace({main.np.nan: None})
+    dataframe[df_objects.columns] = df_objects
+    return main.dataframe_to_table(dataframe, {})
+
+
+def fused_steps(dataframe):
+    dataframe = main.normalize_str_columns(dataframe, {})
+    return main.dataframe_to_table(dataframe, {})
+
+
+# builds object columns of random lower case words, with null_ratio of them
+# missing
+def build_dataframe(rows, columns, null_ratio):
+    random.seed(0)
+    words = [
+        ''.join(random.choice(string.ascii_lowercase)
+                for _ in range(random.randint(3, 12))) for _ in range(1000)
+    ]
+    data = {}
+    for column_index in range(columns):
+        data[f'column_{column_index}'] = [
+            main.np.nan if random.random() < null_ratio else
+            random.choice(words) for _ in range(rows)
+        ]
+    return main.pd.DataFrame(data, dtype=object)
+
+
+def setup_logging():
+    root = logging.getLogger()
+    if root.handlers:
+        for h in root.handlers:
+            root.removeHandler(h)
+    logging.basicConfig(format='[%(asctime)s][%(levelname)s]   %(message)s',
+                        level='INFO')
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,306 @@
+'''
+    About: Throughput benchmark of the csv_to_parquet lambda over the test-data datasets.
+           Each dataset is also scaled to more rows (--scales) and to more
+           columns (--wide-factor). Every dataset variant is loaded by the
+           handler, on cloud mode with s3, sns and glue replaced by the local
+           fakes of fakes.py, once per engine and output compression.
+           Each run is a new python process, so its peak memory is not
+           affected by the runs before it.
+
+           Reports rows/s, MB/s (of csv input), peak memory, output size and
+           the wall time of each stage, and saves the results as json. With
+           --baseline, the results are compared to a previous run and the
+           benchmark fails (exit code 1) when a run is slower than the
+           tolerance allows.
+
+    Usage: python benchmarks/throughput.py [--datasets NAME ...] [--scales N ...]
+                                           [--engines ENGINE ...] [--codecs CODEC ...]
+                                           [--output FILE] [--baseline FILE]
+'''
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(BENCHMARKS_DIR, '..', 'lambdas', 'csv_to_parquet')
+TEST_DATA_DIR = os.path.join(BENCHMARKS_DIR, '..', 'test-data')
+RAW_BUCKET = 'raw'
+ANALYTICS_BUCKET = 'analytics'
+GLUE_DATABASE = 'benchmark_db'
+
+
+def main():
+    setup_logging()
+    args = parse_args()
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='csv_to_parquet_')
+    results = []
+    try:
+        for variant in prepare_variants(args, work_dir):
+            for engine in args.engines:
+                for codec in args.codecs:
+                    case = dict(variant, engine=engine, codec=codec)
+                    result = run_case_process(case)
+                    log_result(result)
+                    results.append(result)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {'python': sys.version, 'results': results}
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    logging.info(f'Results saved on {args.output}')
+
+    if args.baseline and not compare_to_baseline(results, args.baseline,
+                                                 args.tolerance):
+        sys.exit(1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the csv_to_parquet lambda.')
+    parser.add_argument('--datasets', nargs='+', default=None)
+    parser.add_argument('--scales', nargs='+', type=int, default=[1, 10, 100])
+    parser.add_argument('--wide-factor', type=int, default=10)
+    parser.add_argument('--engines', nargs='+', default=['pandas', 'pyarrow'])
+    parser.add_argument('--codecs',
+                        nargs='+',
+                        default=['snappy', 'gzip', 'zstd'])
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--work-dir')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+# returns the csv file and metadata of each dataset of test-data
+def find_datasets(dataset_names=None):
+    datasets = []
+    for dataset_dir in sorted(glob.glob(os.path.join(TEST_DATA_DIR, '*/'))):
+        name = os.path.basename(os.path.normpath(dataset_dir))
+        if dataset_names and name not in dataset_names:
+            continue
+        csv_files = sorted(
+            glob.glob(os.path.join(dataset_dir, '*_data', '*.csv')))
+        if not csv_files:
+            logging.warning(f'Skipping dataset {name}: no csv file found.')
+            continue
+        metadata = {}
+        metadata_path = os.path.join(dataset_dir, 'metadata.json')
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as metadata_file:
+                metadata = json.load(metadata_file)
+        datasets.append({
+            'dataset': name,
+            'csv_path': csv_files[0],
+            'metadata': metadata
+        })
+    return datasets
+
+
+# writes the scaled and wide variants of each dataset to work_dir
+def prepare_variants(args, work_dir):
+    variants = []
+    for dataset in find_datasets(args.datasets):
+        for scale in args.scales:
+            csv_path = dataset['csv_path']
+            if scale > 1:
+                csv_path = os.path.join(work_dir,
+                                        f'{dataset["dataset"]}.x{scale}.csv')
+                write_scaled_csv(dataset['csv_path'], csv_path, scale)
+            variants.append(
+                dict(dataset, variant=f'x{scale}', csv_path=csv_path))
+        if args.wide_factor > 1:
+            csv_path = os.path.join(
+                work_dir, f'{dataset["dataset"]}.wide{args.wide_factor}.csv')
+            write_wide_csv(dataset['csv_path'], csv_path, args.wide_factor)
+            variants.append(
+                dict(dataset,
+                     variant=f'wide{args.wide_factor}',
+                     csv_path=csv_path))
+    return variants
+
+
+# repeats the rows of the csv file scale times. Some files of test-data use
+# \r as line terminator, so the lines are split by any line terminator.
+def write_scaled_csv(source_path, target_path, scale):
+    with open(source_path, 'rb') as source_file:
+        header, *rows = source_file.read().splitlines(keepends=True)
+    line_terminator = header[len(header.rstrip(b'\r\n')):]
+    rows = b''.join(rows)
+    if rows and not rows.endswith(line_terminator):
+        rows += line_terminator
+    with open(target_path, 'wb') as target_file:
+        target_file.write(header)
+        for _ in range(scale):
+            target_file.write(rows)
+
+
+# repeats the columns of the csv file factor times. The copies are suffixed,
+# so the original columns keep matching the metadata of the dataset.
+def write_wide_csv(source_path, target_path, factor):
+    import pandas as pd
+    df = pd.read_csv(source_path, dtype=str, keep_default_na=False)
+    copies = [df] + [
+        df.add_suffix(f'_copy{copy_index}') for copy_index in range(1, factor)
+    ]
+    pd.concat(copies, axis=1).to_csv(target_path, index=False)
+
+
+def run_case_process(case):
+    completed = subprocess.run(
+        [sys.executable, __file__, '--run-case',
+         json.dumps(case)],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'))
+    if completed.returncode != 0:
+        raise RuntimeError(f'Benchmark run failed: {case}')
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+# loads a single dataset variant with the handler and measures it. Runs on
+# its own process (see run_case_process).
+def run_case(case):
+    os.environ.update({
+        'EXECUTION_MODE': 'cloud',
+        'TARGET_S3_BUCKET': ANALYTICS_BUCKET,
+        'TARGET_GLUE_DATABASE': GLUE_DATABASE,
+        'SNS_TOPIC_NAME': 'benchmark',
+        'LOG_LEVEL': 'WARNING'
+    })
+    sys.path.insert(0, LAMBDA_DIR)
+    sys.path.insert(0, BENCHMARKS_DIR)
+    import fakes
+    import main as csv_to_parquet
+
+    s3_root = tempfile.mkdtemp(prefix='local_s3_')
+    try:
+        local_s3 = fakes.LocalS3(s3_root)
+        object_key = f'csv_to_analytics/{case["dataset"]}/{os.path.basename(case["csv_path"])}'
+        local_s3.put_file(
+            RAW_BUCKET, object_key, case['csv_path'],
+            dict(
+                case['metadata'], **{
+                    'engine': case['engine'],
+                    'output-compression': case['codec']
+                }))
+        fakes.install(csv_to_parquet, local_s3)
+        event = fakes.build_event(local_s3, RAW_BUCKET, [object_key])
+        context = type(
+            'Context', (), {
+                'invoked_function_arn':
+                'arn:aws:lambda:us-east-1:000000000000:function:csv_to_parquet'
+            })
+
+        input_bytes = os.path.getsize(case['csv_path'])
+        start_rss_mb = get_peak_rss_mb()
+        stdout = io.StringIO()
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(stdout):
+            results = csv_to_parquet.handler(event, context)
+        seconds = time.perf_counter() - start_time
+
+        output_bytes = sum(
+            os.path.getsize(os.path.join(directory, file_name))
+            for directory, _, file_names in os.walk(
+                local_s3.path(ANALYTICS_BUCKET)) for file_name in file_names)
+        rows = sum(result.get('loaded_rows', 0) for result in results)
+        return {
+            'case': case_id(case),
+            'dataset': case['dataset'],
+            'variant': case['variant'],
+            'engine': case['engine'],
+            'codec': case['codec'],
+            'rows': rows,
+            'input_mb': round(input_bytes / 1024 / 1024, 3),
+            'output_mb': round(output_bytes / 1024 / 1024, 3),
+            'seconds': round(seconds, 3),
+            'rows_per_s': round(rows / seconds, 1),
+            'mb_per_s': round(input_bytes / 1024 / 1024 / seconds, 3),
+            'start_rss_mb': round(start_rss_mb, 1),
+            'peak_rss_mb': round(get_peak_rss_mb(), 1),
+            'stages_ms': read_stage_times(stdout.getvalue())
+        }
+    finally:
+        shutil.rmtree(s3_root, ignore_errors=True)
+
+
+def case_id(case):
+    return f'{case["dataset"]}/{case["variant"]}/{case["engine"]}/{case["codec"]}'
+
+
+def get_peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# returns the wall time of each stage from the EMF lines written by the handler
+def read_stage_times(stdout):
+    stage_times = {}
+    for line in stdout.splitlines():
+        if not line.startswith('{'):
+            continue
+        for stage_name, stage in json.loads(line).get('stages', {}).items():
+            stage_times[stage_name] = stage_times.get(stage_name,
+                                                      0) + stage['wall_ms']
+    return stage_times
+
+
+def log_result(result):
+    logging.info(
+        f'{result["case"]:55} {result["rows"]:>10} rows {result["rows_per_s"]:>12,.0f} rows/s '
+        f'{result["mb_per_s"]:>8.2f} MB/s {result["peak_rss_mb"]:>8.1f} MB peak {result["output_mb"]:>8.2f} MB out'
+    )
+
+
+# logs the runs that are slower than the baseline by more than the tolerance.
+# Returns False if any run regressed.
+def compare_to_baseline(results, baseline_path, tolerance):
+    with open(baseline_path) as baseline_file:
+        baseline = {
+            result['case']: result
+            for result in json.load(baseline_file)['results']
+        }
+
+    passed = True
+    for result in results:
+        previous = baseline.get(result['case'])
+        if previous is None:
+            continue
+        ratio = result['rows_per_s'] / previous['rows_per_s']
+        if ratio < 1 - tolerance:
+            logging.error(
+                f'{result["case"]} regressed: {result["rows_per_s"]:,.0f} rows/s, baseline {previous["rows_per_s"]:,.0f} rows/s.'
+            )
+            passed = False
+    return passed
+
+
+def setup_logging():
+    root = logging.getLogger()
+    if root.handlers:
+        for h in root.handlers:
+            root.removeHandler(h)
+    logging.basicConfig(format='[%(asctime)s][%(levelname)s]   %(message)s',
+                        level='INFO')
+
+
+if __name__ == '__main__':
+    main()
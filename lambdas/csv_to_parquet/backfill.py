@@ -0,0 +1,281 @@
+'''
+    About: Backfill of a table from local csv files, without the lambda.
+           Every csv file of a directory (or matching a glob) is loaded with
+           the metadata of a metadata.json file, as the lambda does on cloud
+           mode: the same readers, transformations and parquet writer. Files
+           are loaded concurrently on a process pool sized to the cores, and
+           appended to a partitioned parquet dataset on a local directory or
+           on s3 (or an s3 compatible endpoint, with --endpoint-url).
+           Glue is not updated, the table and partitions are registered by the
+           next file loaded by the lambda or by MSCK REPAIR TABLE.
+
+           Loaded files are recorded on a json manifest (see manifest.py), so
+           running the same backfill again only loads the files that failed
+           or were not loaded yet. The files written for a failed file are
+           deleted, so it is not loaded twice.
+
+    Usage: python backfill.py SOURCE --metadata METADATA_JSON --output PATH
+                              [--table NAME] [--workers N] [--manifest FILE]
+                              [--endpoint-url URL]
+'''
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from urllib.parse import urlparse
+
+import main
+from compressed_input import is_supported_input
+from dataset_writer import drop_columns
+from manifest import JsonManifest, build_manifest_id
+
+# arrow threads of each worker process are set once per process
+WORKER_CONFIGURED = False
+
+
+def run():
+    main.setup_logging()
+    args = parse_args()
+    with open(args.metadata) as metadata_file:
+        metadata = {
+            key: value if isinstance(value, str) else json.dumps(value)
+            for key, value in json.load(metadata_file).items()
+        }
+    dest_path = get_dest_path(args.output)
+    table_name = args.table or get_table_name(dest_path)
+    manifest = JsonManifest(args.manifest or f'{table_name}.backfill.json')
+
+    csv_paths = find_csv_files(args.source)
+    pending_paths = [
+        csv_path for csv_path in csv_paths
+        if manifest.get(get_manifest_id(csv_path)) is None
+    ]
+    logging.info(
+        f'Found {len(csv_paths)} files, {len(csv_paths) - len(pending_paths)} of them already loaded. Loading {len(pending_paths)} files into {dest_path} with {args.workers} workers.'
+    )
+
+    failed_results = load_files(pending_paths, metadata, table_name,
+                                dest_path, args, manifest)
+    if failed_results:
+        logging.error(
+            f'{len(failed_results)} of {len(pending_paths)} files failed to load. Run the backfill again to retry them: {failed_results}'
+        )
+        sys.exit(1)
+    logging.info('Backfill finished.')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Loads local csv files into a parquet dataset.')
+    parser.add_argument('source',
+                        help='directory of the csv files, or a glob of them')
+    parser.add_argument('--metadata', required=True)
+    parser.add_argument('--output',
+                        required=True,
+                        help='local directory or s3:// path of the dataset')
+    parser.add_argument('--table', default=None)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--manifest',
+                        default=None,
+                        help='defaults to <table>.backfill.json')
+    parser.add_argument('--endpoint-url', default=None)
+    return parser.parse_args()
+
+
+def get_dest_path(output):
+    if output.startswith('s3://'):
+        return output.rstrip('/') + '/'
+    return os.path.abspath(output) + '/'
+
+
+# the last directory of the dataset, which is named after the table
+# (databases/DATABASE/tbl_NAME), or tbl_ and the directory name otherwise
+def get_table_name(dest_path):
+    dest_dir = os.path.basename(dest_path.rstrip('/'))
+    if dest_dir.startswith('tbl_'):
+        return dest_dir
+    return f'tbl_{dest_dir}'
+
+
+def find_csv_files(source):
+    if os.path.isdir(source):
+        source = os.path.join(source, '**', '*')
+    return sorted(
+        os.path.abspath(path) for path in glob.glob(source, recursive=True)
+        if os.path.isfile(path) and is_supported_input(path))
+
+
+# a file changed since it was loaded has a new id, so it is loaded again
+def get_manifest_id(csv_path):
+    file_stat = os.stat(csv_path)
+    return build_manifest_id(csv_path, file_stat.st_mtime_ns,
+                             file_stat.st_size)
+
+
+# Loads the files on the process pool, recording each loaded file on the
+# manifest as soon as it finishes. Returns the results of the failed files.
+def load_files(csv_paths, metadata, table_name, dest_path, args, manifest):
+    start_time = time.monotonic()
+    loaded_rows = 0
+    failed_results = []
+    with ProcessPoolExecutor(max_workers=max(args.workers, 1)) as executor:
+        futures = {
+            executor.submit(load_file, csv_path, metadata, table_name,
+                            dest_path, args.workers, args.endpoint_url):
+            csv_path
+            for csv_path in csv_paths
+        }
+        for done_files, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            if result['status'] == 'FAILED':
+                failed_results.append(result)
+            else:
+                loaded_rows += result['loaded_rows']
+                manifest.put(
+                    get_manifest_id(futures[future]), {
+                        'object_path': futures[future],
+                        'loaded_rows': result['loaded_rows'],
+                        'output_files': result['output_files'],
+                        'loaded_at': datetime.utcnow().isoformat()
+                    })
+            log_progress(done_files, len(csv_paths), loaded_rows,
+                         time.monotonic() - start_time, result)
+    return failed_results
+
+
+def log_progress(done_files, total_files, loaded_rows, elapsed_seconds,
+                 result):
+    eta_seconds = elapsed_seconds / done_files * (total_files - done_files)
+    logging.info(
+        f'[{done_files}/{total_files}] {result["status"]} {result["object_path"]} in {result["seconds"]:.1f}s. {loaded_rows} rows loaded at {loaded_rows / max(elapsed_seconds, 1e-9):.0f} rows/s, {eta_seconds:.0f}s left.'
+    )
+
+
+# Runs on a worker process. Errors are returned as the result of the file,
+# since they may not be picklable.
+def load_file(csv_path, metadata, table_name, dest_path, workers,
+              endpoint_url):
+    _configure_worker(dest_path, workers, endpoint_url)
+    start_time = time.monotonic()
+    result = {'object_path': csv_path}
+    output_files = []
+    try:
+        result['loaded_rows'] = _load_file(csv_path, dict(metadata),
+                                           table_name, dest_path, output_files)
+        result['status'] = 'SUCCESS' if result['loaded_rows'] else 'EMPTY'
+        result['output_files'] = output_files
+    except Exception as err:
+        logging.exception(f'Failed to load {csv_path}.')
+        _delete_files(output_files)
+        result['status'] = 'FAILED'
+        result['error'] = repr(err)
+    result['seconds'] = time.monotonic() - start_time
+    return result
+
+
+# the same steps as process_s3_object of main.py, reading the local file
+def _load_file(csv_path, s3_object_meta, table_name, dest_path, output_files):
+    partition_cols = main.get_partition_cols(source_file_path=csv_path,
+                                             s3_object_meta=s3_object_meta)
+    partition_cols = list(partition_cols or [])
+    chunk_size = main.get_chunk_size(source_file_path=csv_path,
+                                     s3_object_meta=s3_object_meta)
+    engine = main.get_engine(source_file_path=csv_path,
+                             s3_object_meta=s3_object_meta)
+
+    loaded_rows = 0
+    with main.use_local_copy(csv_path, csv_path):
+        for table in _read_tables(csv_path, s3_object_meta, engine,
+                                  chunk_size):
+            if table.num_rows == 0:
+                continue
+            writer_profile = main.get_writer_profile(
+                table_name=table_name,
+                source_file_path=csv_path,
+                s3_object_meta=s3_object_meta,
+                table=drop_columns(table, partition_cols))
+            paths, _ = main.write_parquet_dataset(
+                table=table,
+                dest_path=dest_path,
+                partition_cols=partition_cols,
+                writer_profile=writer_profile,
+                output_mode='append')
+            output_files.extend(paths)
+            loaded_rows += table.num_rows
+    return loaded_rows
+
+
+# yields the transformed arrow tables of the file, one per chunk
+def _read_tables(csv_path, s3_object_meta, engine, chunk_size):
+    if engine == 'pyarrow':
+        if chunk_size:
+            logging.warning(
+                'chunk-size is not supported by the pyarrow engine. Reading the whole file.'
+            )
+        table = main.read_csv_arrow(source_file_path=csv_path,
+                                    event={},
+                                    s3_object_meta=s3_object_meta)
+        yield main.transform_table(table=table,
+                                   source_file_path=csv_path,
+                                   s3_object_meta=s3_object_meta)
+        return
+
+    if chunk_size:
+        dataframes = main.read_csv_chunks(source_file_path=csv_path,
+                                          event={},
+                                          s3_object_meta=s3_object_meta,
+                                          chunk_size=chunk_size)
+    else:
+        dataframes = [
+            main.read_csv(source_file_path=csv_path,
+                          event={},
+                          s3_object_meta=s3_object_meta)
+        ]
+    output_dtypes = main.get_schema_plan(csv_path,
+                                         s3_object_meta).output_dtypes
+    for df in dataframes:
+        if df.empty:
+            continue
+        df = main.transform_df(dataframe=df,
+                               source_file_path=csv_path,
+                               s3_object_meta=s3_object_meta)
+        if not df.empty:
+            yield main.dataframe_to_table(df, output_dtypes)
+
+
+# The pipeline runs on cloud mode, driven by the metadata. The cores are
+# shared by the worker processes, so each one parses with fewer arrow threads.
+def _configure_worker(dest_path, workers, endpoint_url):
+    global WORKER_CONFIGURED
+    if WORKER_CONFIGURED:
+        return
+    main.setup_logging()
+    main.EXECUTION_MODE = 'cloud'
+    main.pa.set_cpu_count(max((os.cpu_count() or 1) // max(workers, 1), 1))
+    if endpoint_url and dest_path.startswith('s3://'):
+        endpoint = urlparse(endpoint_url)
+        main.register_arrow_filesystem(
+            dest_path.split('/', 3)[2],
+            main.pa_fs.S3FileSystem(endpoint_override=endpoint.netloc,
+                                    scheme=endpoint.scheme or 'https'))
+    WORKER_CONFIGURED = True
+
+
+def _delete_files(paths):
+    for path in paths:
+        filesystem, file_path = main._get_arrow_filesystem(path)
+        try:
+            filesystem.delete_file(file_path)
+        except OSError:
+            logging.exception(f'Failed to delete {path}.')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,196 @@
+'''
+    About: Lambda function that compacts the small parquet files of the tables
+           written by main.py into files of a target size.
+           Each load of a csv file writes its own parquet files, so tables fed
+           by many small csv files end up with many tiny files per partition.
+           It runs periodically and rewrites every partition (directory) of
+           s3://[TARGET_S3_BUCKET]/databases/[TARGET_GLUE_DATABASE]/[table]/
+           that has more than one small file.
+
+    Event: {"tables": ["tbl_weather"]} compacts the given tables. Every table
+           of the database is compacted if "tables" is not specified.
+           "path" can replace the s3 location of the database (e.g. by a
+           local directory).
+'''
+
+import os
+import logging
+import uuid
+
+from main import (setup_logging, LazyModule, pq, TARGET_S3_BUCKET,
+                  TARGET_GLUE_DATABASE)
+
+pa_fs = LazyModule('pyarrow.fs')
+
+# GLOBAL VARIABLES
+# gets environment variables
+COMPACTION_TARGET_FILE_SIZE_MB = os.getenv('COMPACTION_TARGET_FILE_SIZE_MB',
+                                           '128')
+COMPACTION_ROW_GROUP_SIZE = os.getenv('COMPACTION_ROW_GROUP_SIZE', '1000000')
+COMPACTION_COMPRESSION = os.getenv('COMPACTION_COMPRESSION', 'snappy')
+# files smaller than this share of the target size are compacted
+SMALL_FILE_RATIO = 0.75
+
+
+# main function
+def handler(event, context):
+    setup_logging()
+    database_path = event.get(
+        'path', f's3://{TARGET_S3_BUCKET}/databases/{TARGET_GLUE_DATABASE}/')
+    table_names = event.get('tables') or _list_tables(database_path)
+
+    results = []
+    for table_name in table_names:
+        table_path = f'{database_path.rstrip("/")}/{table_name}/'
+        logging.info(f'#--- Starting compaction of {table_path}. ---#')
+        results.extend(compact_table(table_path))
+        logging.info(f'#--- Finished compaction of {table_path}. ---#')
+
+    logging.info(f'Results: {results}')
+    return results
+
+
+def _list_tables(database_path):
+    filesystem, root_path = pa_fs.FileSystem.from_uri(database_path)
+    selector = pa_fs.FileSelector(root_path.rstrip('/'), allow_not_found=True)
+    return sorted(file_info.base_name
+                  for file_info in filesystem.get_file_info(selector)
+                  if file_info.type == pa_fs.FileType.Directory)
+
+
+# compacts every partition directory of a table
+def compact_table(table_path,
+                  target_file_size=None,
+                  row_group_size=None,
+                  compression=None):
+    target_file_size = target_file_size or int(
+        COMPACTION_TARGET_FILE_SIZE_MB) * 1024 * 1024
+    row_group_size = row_group_size or int(COMPACTION_ROW_GROUP_SIZE)
+    compression = compression or COMPACTION_COMPRESSION
+
+    filesystem, root_path = pa_fs.FileSystem.from_uri(table_path)
+    results = []
+    for partition_path, files in _list_parquet_files(filesystem,
+                                                     root_path).items():
+        small_files = [
+            file_info for file_info in files
+            if file_info.size < target_file_size * SMALL_FILE_RATIO
+        ]
+        if len(small_files) < 2:
+            continue
+
+        results.append(
+            compact_partition(filesystem=filesystem,
+                              partition_path=partition_path,
+                              files=small_files,
+                              target_file_size=target_file_size,
+                              row_group_size=row_group_size,
+                              compression=compression))
+    return results
+
+
+# returns the parquet files of each directory under root_path
+def _list_parquet_files(filesystem, root_path):
+    selector = pa_fs.FileSelector(root_path.rstrip('/'),
+                                  recursive=True,
+                                  allow_not_found=True)
+    partitions = {}
+    for file_info in filesystem.get_file_info(selector):
+        if file_info.type == pa_fs.FileType.File and file_info.path.endswith(
+                '.parquet'):
+            partition_path = file_info.path.rsplit('/', 1)[0]
+            partitions.setdefault(partition_path, []).append(file_info)
+
+    for files in partitions.values():
+        files.sort(key=lambda file_info: file_info.path)
+    return partitions
+
+
+# Rewrites the small files of a partition into files of about
+# target_file_size bytes. The source files are read one at a time, so memory
+# usage depends on the size of the small files and not on the partition size.
+# Files whose schema differs from the first file are left untouched.
+def compact_partition(filesystem, partition_path, files, target_file_size,
+                      row_group_size, compression):
+    logging.info(f'Compacting {len(files)} files of {partition_path}.')
+    compacted_files = []
+    output_files = []
+    writer = None
+    sink = None
+    written_bytes = 0
+    schema = None
+    try:
+        for file_info in files:
+            table = pq.read_table(file_info.path, filesystem=filesystem)
+            if schema is None:
+                schema = table.schema
+            elif not table.schema.equals(schema, check_metadata=False):
+                logging.warning(
+                    f'Skipping {file_info.path} as its schema differs from the other files.'
+                )
+                continue
+
+            if writer is None:
+                output_file = f'{partition_path}/{uuid.uuid4().hex}.compacted.{compression}.parquet'
+                sink = filesystem.open_output_stream(output_file)
+                writer = pq.ParquetWriter(sink,
+                                          schema,
+                                          compression=compression)
+                output_files.append(output_file)
+
+            writer.write_table(table.replace_schema_metadata(schema.metadata),
+                               row_group_size=row_group_size)
+            compacted_files.append(file_info)
+            written_bytes += file_info.size
+            if written_bytes >= target_file_size:
+                _close_writer(writer, sink)
+                writer = None
+                written_bytes = 0
+    finally:
+        if writer is not None:
+            _close_writer(writer, sink)
+
+    return _replace_compacted_files(filesystem, partition_path,
+                                    compacted_files, output_files)
+
+
+# the writer does not close a stream it did not open, and the stream only
+# uploads the file to s3 when closed
+def _close_writer(writer, sink):
+    writer.close()
+    sink.close()
+
+
+# Deletes the compacted source files. If any of them was removed meanwhile,
+# e.g. by a load with output-mode overwrite_partitions, the partition was
+# rewritten concurrently and the compacted output is deleted instead, so
+# no overwritten data comes back.
+def _replace_compacted_files(filesystem, partition_path, compacted_files,
+                             output_files):
+    current_files = filesystem.get_file_info(
+        [file_info.path for file_info in compacted_files])
+    if any(file_info.type == pa_fs.FileType.NotFound
+           for file_info in current_files):
+        logging.warning(
+            f'Partition {partition_path} changed during compaction. Discarding compacted files.'
+        )
+        for output_file in output_files:
+            filesystem.delete_file(output_file)
+        return {
+            'partition': partition_path,
+            'status': 'CONFLICT',
+            'compacted_files': 0,
+            'output_files': []
+        }
+
+    for file_info in compacted_files:
+        filesystem.delete_file(file_info.path)
+    logging.info(
+        f'Compacted {len(compacted_files)} files of {partition_path} into {len(output_files)} files.'
+    )
+    return {
+        'partition': partition_path,
+        'status': 'SUCCESS',
+        'compacted_files': len(compacted_files),
+        'output_files': output_files
+    }
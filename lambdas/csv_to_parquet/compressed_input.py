@@ -0,0 +1,169 @@
+'''
+    About: Compressed csv files of the csv_to_parquet lambda.
+           gzip, zstd, bz2 and zip files are detected by their extension or
+           magic bytes and decompressed as a stream while they are parsed, so
+           the uncompressed file is never held in memory nor written to disk.
+'''
+
+import bz2
+import gzip
+import importlib
+import io
+import os
+import struct
+import zipfile
+import zlib
+
+# accepted values of the input-compression metadata, besides auto
+INPUT_COMPRESSIONS = ('none', 'gzip', 'zstd', 'bz2', 'zip')
+COMPRESSION_EXTENSIONS = {
+    '.gz': 'gzip',
+    '.zst': 'zstd',
+    '.bz2': 'bz2',
+    '.zip': 'zip'
+}
+# suffixes of the s3 keys loaded by the lambda
+INPUT_SUFFIXES = ('.csv', '.csv.gz', '.csv.zst', '.csv.bz2', '.zip')
+MAGIC_BYTES = ((b'\x1f\x8b', 'gzip'), (b'\x28\xb5\x2f\xfd', 'zstd'),
+               (b'BZh', 'bz2'), (b'PK\x03\x04', 'zip'))
+ZIP_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+# size of the blocks read from the compressed stream of a zip file
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def is_supported_input(path):
+    return path.lower().endswith(INPUT_SUFFIXES)
+
+
+def get_compression_from_extension(path):
+    return COMPRESSION_EXTENSIONS.get(
+        os.path.splitext(path)[1].lower(), 'none')
+
+
+def get_compression_from_magic_bytes(head):
+    for magic_bytes, compression in MAGIC_BYTES:
+        if head.startswith(magic_bytes):
+            return compression
+    return 'none'
+
+
+# Binary stream of the decompressed content of a stream, which closes the
+# stream along with the decompressor: the gzip, bz2 and zip decompressors
+# leave the stream they read from open, which would keep the connection of
+# an s3 object body out of the pool.
+class DecompressedStream(io.BufferedIOBase):
+
+    def __init__(self, decompressed, stream):
+        super().__init__()
+        self._decompressed = decompressed
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self._decompressed.read()
+        return self._decompressed.read(size)
+
+    read1 = read
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._decompressed.close()
+        finally:
+            self._stream.close()
+            super().close()
+
+
+# Returns a binary stream that decompresses the given binary stream while it
+# is read. Closing it closes the given stream. zstd is decompressed by
+# pyarrow, since the python 3.6 standard library has no zstd codec.
+def open_decompressed(stream, compression):
+    if compression == 'none':
+        return stream
+    return DecompressedStream(_open_decompressor(stream, compression), stream)
+
+
+def _open_decompressor(stream, compression):
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    elif compression == 'bz2':
+        return bz2.BZ2File(stream, mode='rb')
+    elif compression == 'zstd':
+        pa = importlib.import_module('pyarrow')
+        return pa.CompressedInputStream(pa.PythonFile(stream, mode='r'),
+                                        'zstd')
+    elif compression == 'zip':
+        return _open_zip_member(stream)
+    raise ValueError(f'Unsupported compression {compression}.')
+
+
+# The central directory of a zip file is at its end, so the file must be
+# seekable. The lambda downloads zip files to /tmp first, so the compressed
+# file is only read into memory when /tmp has no space left.
+def _open_zip_member(stream):
+    seekable = getattr(stream, 'seekable', None)
+    if seekable is None or not seekable():
+        stream = io.BytesIO(stream.read())
+    archive = zipfile.ZipFile(stream)
+    members = [member for member in archive.infolist() if not member.is_dir()]
+    if len(members) != 1:
+        raise ValueError(
+            f'A zip file must contain a single csv file and it contains {len(members)} files.'
+        )
+    return archive.open(members[0])
+
+
+# Returns up to size decompressed bytes from the start of a compressed stream,
+# reading only as much of the stream as needed. Zip files are read from their
+# first local header, so the stream does not need to be seekable. Returns
+# None for zip compression methods other than stored and deflated.
+def read_head(stream, compression, size):
+    if compression == 'zip':
+        return _read_zip_head(stream, size)
+    return _open_decompressor(stream, compression).read(size)
+
+
+# Decompresses the start of a compressed file from its first bytes only, which
+# may end in the middle of the compressed stream. Returns up to size bytes, or
+# None when they do not decompress to anything: zstd and bz2 blocks (of up to
+# 128 KB and 900 KB) are only decompressed whole.
+def decompress_head(data, compression, size):
+    try:
+        if compression == 'gzip':
+            head = zlib.decompressobj(zlib.MAX_WBITS | 16).decompress(
+                data, size)
+        elif compression == 'bz2':
+            head = bz2.BZ2Decompressor().decompress(data, max_length=size)
+        else:
+            head = read_head(io.BytesIO(data), compression, size)
+    except (EOFError, OSError, ValueError, zlib.error):
+        return None
+    return head or None
+
+
+def _read_zip_head(stream, size):
+    (signature, _, _, method, _, _, _, _, _, name_length,
+     extra_length) = ZIP_LOCAL_HEADER.unpack(
+         stream.read(ZIP_LOCAL_HEADER.size))
+    if signature != b'PK\x03\x04':
+        raise ValueError('Invalid zip file.')
+    stream.read(name_length + extra_length)
+    if method == ZIP_STORED:
+        return stream.read(size)
+    elif method != ZIP_DEFLATED:
+        return None
+
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    head = b''
+    while len(head) < size and not decompressor.eof:
+        block = stream.read(READ_BLOCK_SIZE)
+        if not block:
+            break
+        head += decompressor.decompress(block)
+    return head[:size]
@@ -0,0 +1,118 @@
+'''
+    About: Parquet dataset writer of the csv_to_parquet lambda.
+           Writes an arrow table as a hive partitioned parquet dataset, one
+           file per partition, on any pyarrow filesystem (s3, or a local
+           directory), with the output modes of awswrangler:
+             overwrite: deletes the whole dataset first.
+             overwrite_partitions: deletes the written partitions first, or
+                                   the whole dataset when not partitioned.
+             append: keeps every existing file.
+           It replaces awswrangler's writer, which does not expose the codec
+           level, row group size nor dictionary encoding of pyarrow.
+           Partitions are written concurrently, and the rows of a partition
+           are only taken by the thread that writes it.
+'''
+
+import importlib
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+
+OUTPUT_MODES = ('overwrite', 'overwrite_partitions', 'append')
+# value of the partition directory of null partition values
+HIVE_DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+# Writes the table under root_path of the filesystem, with the writer_profile
+# keyword arguments of pq.write_table. Returns the paths of the written files,
+# relative to root_path, and the values of each written partition directory.
+def write_dataset(table, filesystem, root_path, partition_cols,
+                  writer_profile, output_mode, max_workers):
+    if output_mode not in OUTPUT_MODES:
+        raise ValueError(
+            f'Invalid output mode {output_mode}. Expected one of {list(OUTPUT_MODES)}.'
+        )
+    root_path = root_path.rstrip('/')
+    if output_mode == 'overwrite':
+        _delete_dir_contents(filesystem, root_path)
+    elif output_mode == 'overwrite_partitions' and not partition_cols:
+        _delete_dir_contents(filesystem, root_path)
+
+    if not partition_cols:
+        file_path = _write_parquet_file(filesystem, root_path, table,
+                                        writer_profile)
+        return [file_path[len(root_path) + 1:]], {}
+
+    data_table = drop_columns(table, partition_cols)
+    partition_rows = group_partition_rows(table, partition_cols)
+
+    # at most max_workers partitions are held in memory at a time. Taking the
+    # rows, compressing and uploading release the GIL.
+    def write_partition(partition):
+        partition_values, indices = partition
+        partition_dir = '/'.join(
+            f'{column_name}={value}'
+            for column_name, value in zip(partition_cols, partition_values))
+        if output_mode == 'overwrite_partitions':
+            _delete_dir_contents(filesystem, f'{root_path}/{partition_dir}')
+        file_path = _write_parquet_file(filesystem,
+                                        f'{root_path}/{partition_dir}',
+                                        data_table.take(indices),
+                                        writer_profile)
+        return partition_dir, file_path
+
+    max_workers = max(min(max_workers, len(partition_rows)), 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        written_files = list(
+            executor.map(write_partition, partition_rows.items()))
+
+    paths = []
+    partitions_values = {}
+    for partition_values, (partition_dir, file_path) in zip(
+            partition_rows, written_files):
+        paths.append(file_path[len(root_path) + 1:])
+        partitions_values[partition_dir] = list(partition_values)
+    return paths, partitions_values
+
+
+def drop_columns(table, column_names):
+    return table.select([
+        column_name for column_name in table.column_names
+        if column_name not in column_names
+    ])
+
+
+# returns the row indices of each distinct tuple of partition values
+def group_partition_rows(table, partition_cols):
+    pa = importlib.import_module('pyarrow')
+    pd = importlib.import_module('pandas')
+    partition_keys = table.select(partition_cols).to_pandas(
+        types_mapper={
+            pa.int64(): pd.Int64Dtype()
+        }.get).astype(object)
+    partition_keys = partition_keys.where(partition_keys.notna(),
+                                          HIVE_DEFAULT_PARTITION).astype(str)
+    return {
+        partition_values if isinstance(partition_values, tuple) else (partition_values, ):
+        indices
+        for partition_values, indices in partition_keys.groupby(
+            partition_cols, sort=False).indices.items()
+    }
+
+
+def _delete_dir_contents(filesystem, dir_path):
+    pa_fs = importlib.import_module('pyarrow.fs')
+    if filesystem.get_file_info(dir_path).type != pa_fs.FileType.NotFound:
+        filesystem.delete_dir_contents(dir_path)
+
+
+def _write_parquet_file(filesystem, dir_path, table, writer_profile):
+    pq = importlib.import_module('pyarrow.parquet')
+    compression = writer_profile['compression']
+    file_path = f'{dir_path}/{uuid.uuid4().hex}{f".{compression}" if compression else ""}.parquet'
+    # s3 has no directories, creating one would write an empty object
+    if filesystem.type_name != 's3':
+        filesystem.create_dir(dir_path, recursive=True)
+    with filesystem.open_output_stream(file_path) as sink:
+        pq.write_table(table, sink, **writer_profile)
+    return file_path
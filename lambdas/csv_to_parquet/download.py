@@ -0,0 +1,100 @@
+'''
+    About: Parallel download of s3 objects of the csv_to_parquet lambda.
+           A single GET streams the object through a single connection, so
+           large files are downloaded as byte range parts fetched
+           concurrently, each one written at its offset of a file under /tmp.
+           The file can then be memory mapped by the csv parser instead of
+           being copied into memory.
+
+           Concurrent downloads of the same container reserve their space on
+           /tmp, so a download only starts when the whole object fits.
+'''
+
+import os
+import shutil
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+# size of the blocks copied from each part into the file
+COPY_BLOCK_SIZE = 1024 * 1024
+
+RESERVED_BYTES = 0
+RESERVED_LOCK = threading.Lock()
+
+
+# Reserves space for a file of the given size on the directory, keeping at
+# least min_free_bytes free. Returns False when there is not enough space.
+def reserve_space(directory, size, min_free_bytes):
+    global RESERVED_BYTES
+    with RESERVED_LOCK:
+        free_bytes = shutil.disk_usage(directory).free - RESERVED_BYTES
+        if free_bytes - size < min_free_bytes:
+            return False
+        RESERVED_BYTES += size
+        return True
+
+
+def release_space(size):
+    global RESERVED_BYTES
+    with RESERVED_LOCK:
+        RESERVED_BYTES -= size
+
+
+# Downloads the object to local_path with up to max_concurrency range GETs of
+# part_size bytes at a time. With etag, every part must belong to the same
+# version of the object, otherwise the download fails.
+def download_object(client,
+                    bucket,
+                    key,
+                    size,
+                    local_path,
+                    part_size,
+                    max_concurrency,
+                    etag=None):
+    with open(local_path, 'wb') as local_file:
+        local_file.truncate(size)
+
+    extra_args = {'IfMatch': etag} if etag else {}
+    file_descriptor = os.open(local_path, os.O_WRONLY) if hasattr(
+        os, 'pwrite') else None
+
+    def download_part(start):
+        end = min(start + part_size, size) - 1
+        body = client.get_object(Bucket=bucket,
+                                 Key=key,
+                                 Range=f'bytes={start}-{end}',
+                                 **extra_args)['Body']
+        received = _write_part(body, local_path, file_descriptor, start)
+        if received != end + 1 - start:
+            raise IOError(
+                f'Incomplete part {start}-{end} of s3://{bucket}/{key}: received {received} bytes.'
+            )
+
+    try:
+        part_starts = range(0, size, part_size)
+        max_workers = max(min(max_concurrency, len(part_starts)), 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(download_part, part_starts))
+    finally:
+        if file_descriptor is not None:
+            os.close(file_descriptor)
+
+
+# Writes the blocks of a part from its start offset and returns the number of
+# bytes written. Where os.pwrite does not exist (windows), each part is
+# written through its own handle of the file instead.
+def _write_part(body, local_path, file_descriptor, start):
+    blocks = iter(lambda: body.read(COPY_BLOCK_SIZE), b'')
+    offset = start
+    if file_descriptor is not None:
+        for block in blocks:
+            os.pwrite(file_descriptor, block, offset)
+            offset += len(block)
+    else:
+        with open(local_path, 'r+b') as part_file:
+            part_file.seek(start)
+            for block in blocks:
+                part_file.write(block)
+                offset += len(block)
+    return offset - start
@@ -0,0 +1,349 @@
+'''
+    About: Glue catalog tables and partitions of the csv_to_parquet lambda.
+           A snapshot of each table (its columns and the partitions it
+           registered) is kept per lambda container, so the table is only updated when its columns change and each
+           partition is only sent to glue once per container, with
+           BatchCreatePartition in batches of up to 100 partitions. Existing
+           partitions are not read from glue: a partition created by another
+           container is sent again and its AlreadyExists error is ignored.
+           The snapshot is also used to check the schema of each file against
+           its table before anything is written (see check_schema).
+           Every glue call goes through the given boto3 glue client, so it can
+           be replaced by a fake one.
+'''
+
+import logging
+import threading
+import time
+
+# maximum number of partitions of a BatchCreatePartition request
+BATCH_CREATE_PARTITION_SIZE = 100
+# attempts to add columns to a table changed meanwhile by someone else
+UPDATE_TABLE_ATTEMPTS = 3
+# what to do with a file whose schema differs from the schema of its table
+SCHEMA_POLICIES = ('reject', 'add-columns', 'coerce')
+# integer types, from the narrowest to the widest
+INTEGER_TYPES = ('tinyint', 'smallint', 'int', 'bigint')
+
+PARQUET_INPUT_FORMAT = 'org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat'
+PARQUET_OUTPUT_FORMAT = 'org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat'
+PARQUET_SERDE = 'org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe'
+
+
+class GlueCatalog:
+
+    def __init__(self, client, database, snapshot_ttl_seconds):
+        self._client = client
+        self.database = database
+        self.snapshot_ttl_seconds = snapshot_ttl_seconds
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    # Creates the table if it does not exist and adds the columns it does not
+    # have yet. With overwrite, the table is recreated with the given columns,
+    # dropping its partitions.
+    def sync_table(self,
+                   table_name,
+                   path,
+                   columns_types,
+                   partitions_types,
+                   compression,
+                   overwrite=False):
+        snapshot = self.get_snapshot(table_name)
+        if snapshot is not None and overwrite:
+            logging.info(f'Recreating glue table {table_name}.')
+            self._client.delete_table(DatabaseName=self.database,
+                                      Name=table_name)
+            snapshot = None
+
+        if snapshot is None:
+            try:
+                self._client.create_table(DatabaseName=self.database,
+                                          TableInput=_build_table_input(
+                                              table_name, path, columns_types,
+                                              partitions_types, compression))
+                logging.info(f'Created glue table {table_name}.')
+                self._set_snapshot(table_name, columns_types,
+                                   partitions_types)
+                return
+            except self._client.exceptions.AlreadyExistsException:
+                # created meanwhile by a concurrent invocation
+                snapshot = self.get_snapshot(table_name, refresh=True)
+
+        new_columns = {
+            column_name: data_type
+            for column_name, data_type in columns_types.items()
+            if column_name not in snapshot['columns_types']
+        }
+        if new_columns:
+            self._add_columns(table_name, path, new_columns, compression,
+                              snapshot['partitions'])
+
+    # The columns are added to the table read right before the update, so the
+    # columns added meanwhile by a concurrent invocation are kept. Glue
+    # rejects the update if the table changed since it was read (VersionId),
+    # and it is then tried again.
+    def _add_columns(self, table_name, path, new_columns, compression,
+                     partitions):
+        for attempt in range(1, UPDATE_TABLE_ATTEMPTS + 1):
+            table = self._client.get_table(DatabaseName=self.database,
+                                           Name=table_name)['Table']
+            columns_types, partitions_types = _get_table_types(table)
+            missing_columns = {
+                column_name: data_type
+                for column_name, data_type in new_columns.items()
+                if column_name not in columns_types
+            }
+            if not missing_columns:
+                break
+
+            logging.info(
+                f'Adding columns {missing_columns} to glue table {table_name}.')
+            columns_types = dict(columns_types, **missing_columns)
+            # boto3 versions without table versions do not return it
+            version = {
+                'VersionId': table['VersionId']
+            } if 'VersionId' in table else {}
+            try:
+                self._client.update_table(DatabaseName=self.database,
+                                          TableInput=_build_table_input(
+                                              table_name, path, columns_types,
+                                              partitions_types, compression),
+                                          **version)
+                break
+            except self._client.exceptions.ConcurrentModificationException:
+                if attempt == UPDATE_TABLE_ATTEMPTS:
+                    raise
+                logging.warning(
+                    f'Glue table {table_name} changed while adding columns. Trying again.'
+                )
+        self._set_snapshot(table_name, columns_types, partitions_types,
+                           partitions)
+
+    # Registers the partitions that this container did not register yet.
+    # partitions_values maps each partition path to its values.
+    # Returns the number of partitions sent to glue.
+    def add_partitions(self, table_name, partitions_values, compression):
+        snapshot = self.get_snapshot(table_name)
+        new_partitions = [(path, values)
+                          for path, values in partitions_values.items()
+                          if tuple(values) not in snapshot['partitions']]
+
+        for start in range(0, len(new_partitions),
+                           BATCH_CREATE_PARTITION_SIZE):
+            batch = new_partitions[start:start + BATCH_CREATE_PARTITION_SIZE]
+            response = self._client.batch_create_partition(
+                DatabaseName=self.database,
+                TableName=table_name,
+                PartitionInputList=[
+                    _build_partition_input(path, values, compression)
+                    for path, values in batch
+                ])
+            # partitions added meanwhile by a concurrent invocation are fine
+            errors = [
+                error for error in response.get('Errors', [])
+                if error['ErrorDetail']['ErrorCode'] not in
+                ('AlreadyExistsException', )
+            ]
+            if errors:
+                raise RuntimeError(
+                    f'Failed to create partitions of glue table {table_name}: {errors}'
+                )
+            with self._lock:
+                snapshot['partitions'].update(
+                    tuple(values) for _, values in batch)
+
+        if new_partitions:
+            logging.info(
+                f'Registered {len(new_partitions)} partitions of glue table {table_name} in {-(-len(new_partitions) // BATCH_CREATE_PARTITION_SIZE)} requests.'
+            )
+        return len(new_partitions)
+
+    # Compares the columns of a file with the snapshot of its table:
+    #   reject: any new, missing or retyped column fails the file.
+    #   add-columns: new columns are added to the table. Retyped columns are
+    #                cast to the type of the table when it is a safe numeric
+    #                change (see is_safe_cast), the other ones fail.
+    #   coerce: retyped columns are cast to the type of the table and new
+    #           columns are dropped, so the table is never changed.
+    # Missing columns are read as null, except with reject. Partition columns
+    # must always match. Returns the columns to cast, with the type of the
+    # table, and the columns to drop. Raises ValueError if the file is rejected.
+    def check_schema(self, table_name, columns_types, partitions_types,
+                     policy):
+        if policy not in SCHEMA_POLICIES:
+            raise ValueError(
+                f'Invalid schema policy {policy}. Expected either reject, add-columns or coerce.'
+            )
+        snapshot = self.get_snapshot(table_name)
+        if snapshot is None:
+            return {}, []
+
+        if list(partitions_types) != list(snapshot['partitions_types']):
+            raise ValueError(
+                f'Partition columns {list(partitions_types)} do not match the partition columns {list(snapshot["partitions_types"])} of glue table {table_name}.'
+            )
+        table_types = dict(snapshot['columns_types'],
+                           **snapshot['partitions_types'])
+        new_columns = [
+            column_name for column_name in columns_types
+            if column_name not in table_types
+        ]
+        missing_columns = [
+            column_name for column_name in snapshot['columns_types']
+            if column_name not in columns_types
+        ]
+        file_types = dict(columns_types, **partitions_types)
+        retyped_columns = {
+            column_name: data_type
+            for column_name, data_type in file_types.items()
+            if table_types.get(column_name, data_type) != data_type
+        }
+
+        if policy == 'add-columns':
+            casts = {
+                column_name: table_types[column_name]
+                for column_name, data_type in retyped_columns.items()
+                if is_safe_cast(data_type, table_types[column_name])
+            }
+            retyped_columns = {
+                column_name: data_type
+                for column_name, data_type in retyped_columns.items()
+                if column_name not in casts
+            }
+        problems = [
+            f'column {column_name} is {data_type} but {table_types[column_name]} on the table'
+            for column_name, data_type in retyped_columns.items()
+        ] if policy != 'coerce' else []
+        if policy == 'reject':
+            problems += [f'new column {column_name}' for column_name in new_columns]
+            problems += [
+                f'missing column {column_name}'
+                for column_name in missing_columns
+            ]
+        if problems:
+            raise ValueError(
+                f'Schema does not match glue table {table_name} ({policy} policy): {"; ".join(problems)}.'
+            )
+
+        if policy == 'coerce':
+            return {
+                column_name: table_types[column_name]
+                for column_name in retyped_columns
+            }, new_columns
+        if policy == 'add-columns':
+            return casts, []
+        return {}, []
+
+    # drops the cached snapshot, so it is read again from glue
+    def invalidate(self, table_name):
+        with self._lock:
+            self._snapshots.pop(table_name, None)
+
+    # Returns the cached snapshot of the table, or None if it does not exist.
+    # The snapshot is read again from glue once it is older than the ttl.
+    def get_snapshot(self, table_name, refresh=False):
+        with self._lock:
+            snapshot = self._snapshots.get(table_name)
+        if snapshot is not None and not refresh and time.monotonic(
+        ) - snapshot['loaded_at'] < self.snapshot_ttl_seconds:
+            return snapshot
+
+        try:
+            table = self._client.get_table(DatabaseName=self.database,
+                                           Name=table_name)['Table']
+        except self._client.exceptions.EntityNotFoundException:
+            with self._lock:
+                self._snapshots.pop(table_name, None)
+            return None
+        columns_types, partitions_types = _get_table_types(table)
+        return self._set_snapshot(table_name, columns_types, partitions_types)
+
+    # partitions are the ones registered by this container, the ones already
+    # on glue are not read
+    def _set_snapshot(self,
+                      table_name,
+                      columns_types,
+                      partitions_types,
+                      partitions=None):
+        snapshot = {
+            'columns_types': dict(columns_types),
+            'partitions_types': dict(partitions_types),
+            'partitions': partitions if partitions is not None else set(),
+            'loaded_at': time.monotonic()
+        }
+        with self._lock:
+            self._snapshots[table_name] = snapshot
+        return snapshot
+
+
+# Whether the values of a file column can be cast to the type of its table
+# column without losing a value: integers to a wider integer, and integers
+# and float to double. double to bigint would drop the fractional part, so it
+# is only cast by the coerce policy.
+def is_safe_cast(file_type, table_type):
+    if file_type in INTEGER_TYPES and table_type in INTEGER_TYPES:
+        return INTEGER_TYPES.index(file_type) < INTEGER_TYPES.index(
+            table_type)
+    if table_type == 'double':
+        return file_type in INTEGER_TYPES + ('float', )
+    return False
+
+
+# returns the types of the columns and of the partition columns of a table
+def _get_table_types(table):
+    return {
+        column['Name']: column['Type']
+        for column in table['StorageDescriptor']['Columns']
+    }, {
+        column['Name']: column['Type']
+        for column in table.get('PartitionKeys', [])
+    }
+
+
+def _build_storage_descriptor(path, compression):
+    return {
+        'Location': path,
+        'InputFormat': PARQUET_INPUT_FORMAT,
+        'OutputFormat': PARQUET_OUTPUT_FORMAT,
+        'Compressed': compression is not None,
+        'NumberOfBuckets': -1,
+        'SerdeInfo': {
+            'SerializationLibrary': PARQUET_SERDE,
+            'Parameters': {
+                'serialization.format': '1'
+            }
+        },
+        'StoredAsSubDirectories': False
+    }
+
+
+def _build_table_input(table_name, path, columns_types, partitions_types,
+                       compression):
+    storage_descriptor = _build_storage_descriptor(path, compression)
+    storage_descriptor['Columns'] = [{
+        'Name': column_name,
+        'Type': data_type
+    } for column_name, data_type in columns_types.items()]
+    return {
+        'Name': table_name,
+        'TableType': 'EXTERNAL_TABLE',
+        'Parameters': {
+            'classification': 'parquet',
+            'compressionType': str(compression).lower(),
+            'typeOfData': 'file',
+            'EXTERNAL': 'TRUE'
+        },
+        'PartitionKeys': [{
+            'Name': column_name,
+            'Type': data_type
+        } for column_name, data_type in partitions_types.items()],
+        'StorageDescriptor': storage_descriptor
+    }
+
+
+def _build_partition_input(path, values, compression):
+    return {
+        'Values': list(values),
+        'StorageDescriptor': _build_storage_descriptor(path, compression)
+    }
@@ -0,0 +1,249 @@
+'''
+    About: Per stage metrics of the csv_to_parquet lambda.
+           Each stage of a file (head_object, read_csv, cast_df_columns, ...)
+           records its wall time, cpu time, peak rss and the rows and bytes it
+           received and returned. One CloudWatch Embedded Metric Format (EMF)
+           json line is written per file, so the metrics can be graphed per
+           table and the slowest stage of each dataset can be found.
+
+           PROFILE can be set to cprofile and/or tracemalloc (comma separated)
+           to also dump, per file, the cProfile stats and the top memory
+           allocations to PROFILE_DIR.
+'''
+
+import os
+import json
+import logging
+import threading
+import time
+import functools
+import contextlib
+
+# GLOBAL VARIABLES
+# gets environment variables
+STAGE_METRICS = os.getenv('STAGE_METRICS', 'true')
+METRICS_NAMESPACE = os.getenv('METRICS_NAMESPACE', 'CsvToParquet')
+PROFILE = os.getenv('PROFILE', '')
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/profiles')
+# number of allocation sites written to the tracemalloc dump
+TRACEMALLOC_TOP_LINES = 25
+
+# files are processed concurrently, each one on its own thread
+FILE_METRICS = threading.local()
+
+# cpu time of the current thread, so concurrent files are not mixed up.
+# Python 3.6 has no thread_time, so the process cpu time is used instead.
+cpu_time = getattr(time, 'thread_time', time.process_time)
+
+
+class FileMetrics:
+
+    def __init__(self, file_path, table_name):
+        self.file_path = file_path
+        self.table_name = table_name
+        self.stages = {}
+        self.tracemalloc = None
+
+    @contextlib.contextmanager
+    def measure(self, stage_name, data_in=None):
+        if self.tracemalloc is not None and hasattr(self.tracemalloc,
+                                                    'reset_peak'):
+            self.tracemalloc.reset_peak()
+        # the input is measured before the stage, which may modify it in place
+        rows_in, bytes_in = _get_data_size(data_in)
+        measurement = {'data_out': None}
+        start_wall_time = time.perf_counter()
+        start_cpu_time = cpu_time()
+        try:
+            yield measurement
+        finally:
+            stage = self.stages.setdefault(stage_name, {
+                'calls': 0,
+                'wall_ms': 0.0,
+                'cpu_ms': 0.0
+            })
+            stage['calls'] += 1
+            stage['wall_ms'] += (time.perf_counter() - start_wall_time) * 1000
+            stage['cpu_ms'] += (cpu_time() - start_cpu_time) * 1000
+            peak_rss_mb = get_peak_rss_mb()
+            if peak_rss_mb is not None:
+                stage['peak_rss_mb'] = peak_rss_mb
+            if self.tracemalloc is not None:
+                stage['traced_peak_mb'] = max(
+                    stage.get('traced_peak_mb', 0),
+                    self.tracemalloc.get_traced_memory()[1] / 1024 / 1024)
+            _add_data_size(stage, 'in', rows_in, bytes_in)
+            _add_data_size(stage, 'out',
+                           *_get_data_size(measurement['data_out']))
+
+    # returns a single EMF json document with the metrics of every stage
+    def to_emf(self, properties):
+        metrics = []
+        document = {'table': self.table_name}
+        peak_rss_mb = get_peak_rss_mb()
+        if peak_rss_mb is not None:
+            metrics.append({'Name': 'peak_rss_mb', 'Unit': 'Megabytes'})
+            document['peak_rss_mb'] = peak_rss_mb
+        for stage_name, stage in self.stages.items():
+            for metric_name in ('wall_ms', 'cpu_ms'):
+                document[f'{stage_name}.{metric_name}'] = round(
+                    stage[metric_name], 3)
+                metrics.append({
+                    'Name': f'{stage_name}.{metric_name}',
+                    'Unit': 'Milliseconds'
+                })
+        document.update({
+            '_aws': {
+                'Timestamp':
+                int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [['table']],
+                    'Metrics': metrics
+                }]
+            },
+            'file_path': self.file_path,
+            'stages': {
+                stage_name: {
+                    key: round(value, 3)
+                    for key, value in stage.items()
+                }
+                for stage_name, stage in self.stages.items()
+            }
+        })
+        document.update(properties)
+        return document
+
+
+# returns None where the resource module does not exist (windows)
+def get_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# rows and bytes of a dataframe or arrow table. The bytes of a dataframe do
+# not include the content of its python strings, which would require visiting
+# every value.
+def _get_data_size(data):
+    if hasattr(data, 'num_rows') and hasattr(data, 'nbytes'):
+        return data.num_rows, data.nbytes
+    if hasattr(data, 'memory_usage') and hasattr(data, 'columns'):
+        return len(data), int(data.memory_usage(deep=False).sum())
+    return None, None
+
+
+def _add_data_size(stage, direction, rows, size):
+    if rows is None:
+        return
+    stage[f'rows_{direction}'] = stage.get(f'rows_{direction}', 0) + rows
+    stage[f'bytes_{direction}'] = stage.get(f'bytes_{direction}', 0) + size
+
+
+def get_file_metrics():
+    return getattr(FILE_METRICS, 'current', None)
+
+
+# Collects the metrics of the stages run by the current thread while
+# processing a file. The EMF line is written when the file is done, with the
+# given properties (e.g. the status of the file) as of that moment.
+@contextlib.contextmanager
+def file_metrics(file_path, table_name, properties):
+    if STAGE_METRICS.lower() != 'true':
+        yield None
+        return
+
+    metrics = FileMetrics(file_path, table_name)
+    profiler = _start_profiling(metrics)
+    FILE_METRICS.current = metrics
+    try:
+        yield metrics
+    finally:
+        FILE_METRICS.current = None
+        _stop_profiling(metrics, profiler)
+        # EMF documents must be written as raw json lines, without the
+        # prefix added by the logging format
+        print(json.dumps(metrics.to_emf(properties), default=str), flush=True)
+
+
+def _start_profiling(metrics):
+    profiler = None
+    if 'cprofile' in PROFILE:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if 'tracemalloc' in PROFILE:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        metrics.tracemalloc = tracemalloc
+    return profiler
+
+
+def _stop_profiling(metrics, profiler):
+    if profiler is None and metrics.tracemalloc is None:
+        return
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    dump_path = os.path.join(
+        PROFILE_DIR,
+        f'{os.path.basename(metrics.file_path)}.{int(time.time() * 1000)}')
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(f'{dump_path}.prof')
+        logging.info(f'cProfile stats saved on {dump_path}.prof')
+    if metrics.tracemalloc is not None:
+        top_stats = metrics.tracemalloc.take_snapshot().statistics('lineno')
+        with open(f'{dump_path}.tracemalloc.txt', 'w') as dump_file:
+            dump_file.writelines(f'{stat}\n'
+                                 for stat in top_stats[:TRACEMALLOC_TOP_LINES])
+        logging.info(
+            f'tracemalloc top allocations saved on {dump_path}.tracemalloc.txt'
+        )
+
+
+# Decorator that measures a stage of the pipeline. The stage input is the
+# dataframe or table argument of the function and its output is the returned
+# value. It does nothing outside of file_metrics.
+def measure_stage(stage_name=None):
+
+    def decorator(function):
+        name = stage_name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            metrics = get_file_metrics()
+            if metrics is None:
+                return function(*args, **kwargs)
+
+            data_in = kwargs.get('dataframe', kwargs.get('table'))
+            if data_in is None and args:
+                data_in = args[0]
+            with metrics.measure(name, data_in) as measurement:
+                measurement['data_out'] = function(*args, **kwargs)
+            return measurement['data_out']
+
+        return wrapper
+
+    return decorator
+
+
+# measures the time spent producing each item of an iterator (e.g. reading
+# each chunk of a csv file) as a single stage
+def measure_iterator(stage_name, iterator):
+    iterator = iter(iterator)
+    while True:
+        metrics = get_file_metrics()
+        if metrics is None:
+            item = next(iterator, StopIteration)
+        else:
+            with metrics.measure(stage_name) as measurement:
+                item = next(iterator, StopIteration)
+                if item is not StopIteration:
+                    measurement['data_out'] = item
+        if item is StopIteration:
+            return
+        yield item
@@ -6,14 +6,59 @@
 
 import os
 import logging
-import pandas as pd
+import threading
+import time
 import re
-import numpy as np
-import boto3
-
+import importlib
+import functools
+import uuid
+import contextlib
+import csv
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from ast import literal_eval
-import awswrangler as wr
+
+from manifest import build_manifest_id, create_manifest
+from glue_catalog import GlueCatalog
+from notifications import SnsNotifier
+from preflight import sniff_csv
+from download import download_object, reserve_space, release_space
+from dataset_writer import write_dataset, drop_columns
+from compressed_input import (INPUT_COMPRESSIONS, is_supported_input,
+                              get_compression_from_extension,
+                              get_compression_from_magic_bytes,
+                              open_decompressed, read_head, decompress_head)
+from instrumentation import (file_metrics, measure_stage, measure_iterator,
+                             cpu_time)
+
+
+# Heavy libraries are only imported the first time one of their attributes
+# is used, so the cold start of the lambda does not pay for libraries that
+# the invocation does not need (e.g. boto3 on local mode or pyarrow on the
+# pandas engine).
+class LazyModule:
+
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._module_name)
+        return getattr(self._module, attribute)
+
+
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+boto3 = LazyModule('boto3')
+botocore_config = LazyModule('botocore.config')
+pa = LazyModule('pyarrow')
+pc = LazyModule('pyarrow.compute')
+pq = LazyModule('pyarrow.parquet')
+pa_csv = LazyModule('pyarrow.csv')
+pa_fs = LazyModule('pyarrow.fs')
 
 # GLOBAL VARIABLES
 # gets environment variables
@@ -24,9 +69,101 @@ EXECUTION_MODE = os.getenv('EXECUTION_MODE',
 TARGET_S3_BUCKET = os.getenv('TARGET_S3_BUCKET')
 TARGET_GLUE_DATABASE = os.getenv('TARGET_GLUE_DATABASE')
 SNS_TOPIC_NAME = os.getenv('SNS_TOPIC_NAME')
+# number of rows read per chunk. 0 reads the whole file at once.
+CSV_CHUNK_SIZE = os.getenv('CSV_CHUNK_SIZE', '0')
+ENGINE = os.getenv('ENGINE', 'pandas')  # accepted values: pandas or pyarrow
+# number of files of the same event processed concurrently
+MAX_WORKERS = os.getenv('MAX_WORKERS', '1')
+# size of the connection pool shared by every request of a boto3 client. The
+# pool is never smaller than MAX_WORKERS * DOWNLOAD_CONCURRENCY, the number of
+# range GETs that the files of an event can run at once.
+BOTO3_MAX_POOL_CONNECTIONS = os.getenv('BOTO3_MAX_POOL_CONNECTIONS', '10')
+# number of distinct custom-cast/partition-cols metadata kept compiled
+SCHEMA_PLAN_CACHE_SIZE = os.getenv('SCHEMA_PLAN_CACHE_SIZE', '128')
+# string columns whose ratio of distinct values to rows is at most this
+# threshold are converted to categorical. 0 disables the conversion.
+CATEGORICAL_THRESHOLD = os.getenv('CATEGORICAL_THRESHOLD', '0')
+# number of rows sampled to estimate the ratio of distinct values of a column
+CATEGORICAL_SAMPLE_SIZE = 10000
+# number of distinct table/header/categorical metadata whose categorical
+# columns are kept, the least recently used ones are dropped first
+CATEGORICAL_COLUMNS_CACHE_SIZE = os.getenv('CATEGORICAL_COLUMNS_CACHE_SIZE',
+                                           '128')
+# number of raw column names kept with its normalized name
+NORMALIZED_NAMES_CACHE_SIZE = os.getenv('NORMALIZED_NAMES_CACHE_SIZE', '16384')
+# backend of the manifest of loaded files. Accepted values: none, json,
+# sqlite or dynamodb. Redelivered files found on the manifest are skipped.
+MANIFEST_BACKEND = os.getenv('MANIFEST_BACKEND', 'none')
+MANIFEST_PATH = os.getenv('MANIFEST_PATH',
+                          os.path.join(os.path.dirname(__file__),
+                                       'manifest.json'))  # json or sqlite
+MANIFEST_TABLE = os.getenv('MANIFEST_TABLE')  # dynamodb
+# number of parquet files of a loaded file listed on its manifest record. The
+# others are only counted, so the record stays below the 400 KB limit of a
+# dynamodb item.
+MANIFEST_MAX_OUTPUT_FILES = os.getenv('MANIFEST_MAX_OUTPUT_FILES', '100')
+# compression of the parquet files when output-compression is not specified.
+# auto samples the first data written to each table and picks the codec.
+OUTPUT_COMPRESSION = os.getenv('OUTPUT_COMPRESSION', 'snappy')
+# cpu time, in ms per MB of data, that the codec picked by auto may spend
+COMPRESSION_CPU_BUDGET_MS_PER_MB = os.getenv(
+    'COMPRESSION_CPU_BUDGET_MS_PER_MB', '20')
+# number of rows compressed with each candidate codec by auto
+COMPRESSION_SAMPLE_ROWS = 10000
+# number of partitions of a file written (and held in memory) concurrently
+WRITER_CONCURRENCY = os.getenv('WRITER_CONCURRENCY', '8')
+# seconds the snapshot of a glue table (its columns and known partitions) is
+# reused before being read again from glue
+GLUE_SNAPSHOT_TTL_SECONDS = os.getenv('GLUE_SNAPSHOT_TTL_SECONDS', '300')
+# what to do when the first bytes of a file do not match its metadata, when
+# preflight is not specified. Accepted values: off, reject or correct. off
+# reads every file with its metadata, as the files loaded so far were.
+PREFLIGHT = os.getenv('PREFLIGHT', 'off')
+# number of bytes fetched from the start of each file by the pre-flight check
+PREFLIGHT_BYTES = os.getenv('PREFLIGHT_BYTES', '16384')
+# number of byte range parts of a file downloaded concurrently to
+# DOWNLOAD_DIR, whose copy is then memory mapped by the csv parser. Files of
+# a single part, or that do not fit on DOWNLOAD_DIR while keeping
+# DOWNLOAD_MIN_FREE_MB free, are streamed from s3 instead. 0 always streams.
+DOWNLOAD_CONCURRENCY = os.getenv('DOWNLOAD_CONCURRENCY', '8')
+DOWNLOAD_PART_SIZE_MB = os.getenv('DOWNLOAD_PART_SIZE_MB', '8')
+DOWNLOAD_DIR = os.getenv('DOWNLOAD_DIR', '/tmp')
+DOWNLOAD_MIN_FREE_MB = os.getenv('DOWNLOAD_MIN_FREE_MB', '64')
+# what to do when the schema of a file differs from its glue table, when
+# schema-policy is not specified. Accepted values: reject, add-columns or coerce
+SCHEMA_POLICY = os.getenv('SCHEMA_POLICY', 'add-columns')
+# seconds the sns notifications are queued before being published in batches.
+# 0 publishes them only when the handler returns.
+NOTIFICATION_WINDOW_SECONDS = os.getenv('NOTIFICATION_WINDOW_SECONDS', '5')
 
 # aws sns topic arn is set by application
 SNS_TOPIC_ARN = ''
+# notifier queuing the sns notifications, created on first use
+NOTIFIER = None
+
+# boto3 session and clients are created once per lambda container and reused
+# by every invocation. The default session is not thread safe, so they are
+# created under a lock.
+BOTO3_CLIENT_LOCK = threading.Lock()
+BOTO3_SESSION = None
+BOTO3_CLIENTS = {}
+# creation time of each client and number of times it was reused
+BOTO3_CLIENTS_STATS = {}
+# manifest of loaded files, created on first use
+MANIFEST = None
+# pyarrow filesystem of each bucket and the compression picked for each table
+ARROW_FILESYSTEMS = {}
+WRITER_PROFILES = {}
+WRITER_LOCK = threading.Lock()
+# string columns converted to categorical, per table, csv header and
+# categorical metadata, in least recently used order (see
+# get_categorical_columns)
+CATEGORICAL_COLUMNS = OrderedDict()
+CATEGORICAL_LOCK = threading.Lock()
+# glue catalog with the snapshot of each table, created on first use
+GLUE_CATALOG = None
+# local copy of the file being processed by each thread, if any
+LOCAL_COPIES = threading.local()
 
 # LOCAL_CSV_FILE_PATH used only for running the script locally
 LOCAL_CSV_FILE_PATH = os.path.join(
@@ -40,36 +177,285 @@ def handler(event, context):
     build_sns_topic_arn(context)
     s3_objects = parse_event(event)
 
-    for s3_object in s3_objects:
-        source_file_path = get_source_file_path(s3_object)
-        logging.info(f'#--- Starting processing file {source_file_path}. ---#')
-        s3_object_meta = get_s3_object_metadata(s3_object)
-        partition_cols = get_partition_cols(source_file_path=source_file_path,
-                                            s3_object_meta=s3_object_meta)
-
-        df = read_csv(source_file_path=source_file_path,
-                      event=event,
+    table_groups = _group_by_target_table(s3_objects)
+    max_workers = max(min(int(MAX_WORKERS), len(table_groups)), 1)
+    logging.info(
+        f'Processing {len(s3_objects)} files of {len(table_groups)} tables with {max_workers} workers.'
+    )
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            group_results = list(
+                executor.map(
+                    lambda table_group: _process_table_group(
+                        table_group, event), table_groups))
+    finally:
+        # the container may be frozen once the handler returns
+        flush_notifications()
+    results = [None] * len(s3_objects)
+    for table_group, table_results in zip(table_groups, group_results):
+        for (index, _), result in zip(table_group, table_results):
+            results[index] = result
+
+    logging.info(f'Results: {results}')
+    _log_boto3_clients_stats()
+    failed_results = [
+        result for result in results if result['status'] == 'FAILED'
+    ]
+    if failed_results:
+        message = f'{len(failed_results)} of {len(results)} files failed to load: {failed_results}'
+        # Failing the invocation makes lambda retry the whole event. Only with
+        # a manifest the files already loaded are skipped on the retry, so
+        # they are not loaded twice. Otherwise the failures were already
+        # notified to sns and the invocation succeeds.
+        if _get_manifest() is not None:
+            raise RuntimeError(message)
+        logging.error(message)
+    return results
+
+
+# groups the s3 objects by target table, keeping their index in the event.
+# The files of a table are loaded one after the other, so two files writing
+# the same partitions (overwrite_partitions) can not interleave their writes.
+def _group_by_target_table(s3_objects):
+    table_groups = {}
+    for index, s3_object in enumerate(s3_objects):
+        table_groups.setdefault(s3_object['target_table'], []).append(
+            (index, s3_object))
+    return list(table_groups.values())
+
+
+def _process_table_group(table_group, event):
+    return [
+        _process_s3_object_safely(s3_object, event)
+        for _, s3_object in table_group
+    ]
+
+
+# errors of a single file are logged and returned as its result, so they do
+# not abort the processing of the other files of the event. The metrics of
+# each stage of the file are written as a single EMF line.
+def _process_s3_object_safely(s3_object, event):
+    result = {'object_path': s3_object['object_path']}
+    with file_metrics(s3_object['object_path'], s3_object['target_table'],
+                      result):
+        try:
+            loaded_rows = process_s3_object(s3_object, event)
+            if loaded_rows is None:
+                result['status'] = 'SKIPPED'
+            else:
+                result['status'] = 'SUCCESS' if loaded_rows else 'EMPTY'
+                result['loaded_rows'] = loaded_rows
+        except Exception as err:
+            logging.exception(f'Failed to process {s3_object["object_path"]}.')
+            result['status'] = 'FAILED'
+            result['error'] = repr(err)
+    return result
+
+
+# extracts, transforms and loads a single s3 object. Returns the number of
+# loaded rows, or None if the file was already loaded.
+def process_s3_object(s3_object, event):
+    source_file_path = get_source_file_path(s3_object)
+    logging.info(f'#--- Starting processing file {source_file_path}. ---#')
+    manifest_id = get_manifest_id(s3_object, source_file_path)
+    manifest_record = get_manifest_record(manifest_id)
+    if manifest_record is not None:
+        logging.info(
+            f'#--- File {source_file_path} was already loaded on {manifest_record["loaded_at"]}. Skipping it. ---#'
+        )
+        return None
+
+    s3_object_meta = get_s3_object_metadata(s3_object)
+    s3_object_meta = preflight_check(s3_object=s3_object,
+                                     source_file_path=source_file_path,
+                                     s3_object_meta=s3_object_meta)
+    partition_cols = get_partition_cols(source_file_path=source_file_path,
+                                        s3_object_meta=s3_object_meta)
+    chunk_size = get_chunk_size(source_file_path=source_file_path,
+                                s3_object_meta=s3_object_meta)
+    engine = get_engine(source_file_path=source_file_path,
+                        s3_object_meta=s3_object_meta)
+
+    with local_copy(s3_object=s3_object,
+                    source_file_path=source_file_path,
+                    s3_object_meta=s3_object_meta):
+        if engine == 'pyarrow':
+            if chunk_size:
+                logging.warning(
+                    'chunk-size is not supported by the pyarrow engine. Reading the whole file.'
+                )
+            loaded_rows, output_files = _load_csv_arrow(
+                s3_object=s3_object,
+                source_file_path=source_file_path,
+                s3_object_meta=s3_object_meta,
+                partition_cols=partition_cols,
+                event=event)
+        elif chunk_size:
+            loaded_rows, output_files = _load_csv_in_chunks(
+                s3_object=s3_object,
+                source_file_path=source_file_path,
+                s3_object_meta=s3_object_meta,
+                partition_cols=partition_cols,
+                event=event,
+                chunk_size=chunk_size)
+        else:
+            loaded_rows, output_files = _load_csv(
+                s3_object=s3_object,
+                source_file_path=source_file_path,
+                s3_object_meta=s3_object_meta,
+                partition_cols=partition_cols,
+                event=event)
+
+    put_manifest_record(manifest_id=manifest_id,
+                        source_file_path=source_file_path,
+                        loaded_rows=loaded_rows,
+                        output_files=output_files)
+    if loaded_rows:
+        publish_success_to_sns(s3_object)
+        logging.info(f'#--- Finished loading file {source_file_path}. ---#')
+    else:
+        logging.info(
+            f'#--- File {source_file_path} is empty. No data was loaded. ---#')
+    return loaded_rows
+
+
+# reads the whole csv file into memory, transforms and saves it at once
+def _load_csv(s3_object, source_file_path, s3_object_meta, partition_cols,
+              event):
+    df = read_csv(source_file_path=source_file_path,
+                  event=event,
+                  s3_object_meta=s3_object_meta)
+    if df.empty:
+        return 0, []
+
+    df = transform_df(dataframe=df,
+                      source_file_path=source_file_path,
                       s3_object_meta=s3_object_meta)
-        if not df.empty:
-            df = cast_df_columns(dataframe=df,
-                                 source_file_path=source_file_path,
-                                 s3_object_meta=s3_object_meta)
-            df = str_columns_to_upper(df, s3_object_meta)
-            df = add_etl_metadata_to_df(df, source_file_path=source_file_path)
-            df = normalize_column_name(df)
-            df = replace_nan_values(df)
-            save_as_parquet(dataframe=df,
-                            s3_object=s3_object,
-                            partition_cols=partition_cols,
-                            event=event,
+    if df.empty:
+        # every row was removed by the row-filter
+        return 0, []
+
+    output_files = save_as_parquet(dataframe=df,
+                                   s3_object=s3_object,
+                                   partition_cols=partition_cols,
+                                   event=event,
+                                   s3_object_meta=s3_object_meta)
+    return len(df), output_files
+
+
+# reads the csv file in chunks of chunk_size rows, so memory usage depends on
+# the chunk size instead of the file size. Each chunk is saved as separate
+# parquet files under the same dataset path.
+def _load_csv_in_chunks(s3_object, source_file_path, s3_object_meta,
+                        partition_cols, event, chunk_size):
+    logging.info(f'Loading file in chunks of {chunk_size} rows.')
+    output_mode = s3_object_meta.get('output-mode', 'overwrite_partitions')
+    written_partitions = set()
+    loaded_rows = 0
+    output_files = []
+
+    # a chunk that fails closes the reader, and its s3 body, right away
+    chunks = read_csv_chunks(source_file_path=source_file_path,
+                             event=event,
+                             s3_object_meta=s3_object_meta,
+                             chunk_size=chunk_size)
+    with contextlib.closing(chunks):
+        for chunk_index, df in enumerate(chunks):
+            if df.empty:
+                continue
+
+            logging.info(f'Processing chunk {chunk_index} with {len(df)} rows.')
+            df = transform_df(dataframe=df,
+                              source_file_path=source_file_path,
+                              s3_object_meta=s3_object_meta)
+            if df.empty:
+                continue
+
+            for df_part, part_output_mode in _split_chunk_by_output_mode(
+                    dataframe=df,
+                    output_mode=output_mode,
+                    partition_cols=partition_cols,
+                    is_first_chunk=loaded_rows == 0,
+                    written_partitions=written_partitions):
+                output_files.extend(
+                    save_as_parquet(dataframe=df_part,
+                                    s3_object=s3_object,
+                                    partition_cols=partition_cols,
+                                    event=event,
+                                    s3_object_meta=s3_object_meta,
+                                    output_mode=part_output_mode))
+            loaded_rows += len(df)
+
+    return loaded_rows, output_files
+
+
+# reads, transforms and saves the csv file as an arrow table, using arrow
+# compute kernels instead of pandas operations
+def _load_csv_arrow(s3_object, source_file_path, s3_object_meta,
+                    partition_cols, event):
+    table = read_csv_arrow(source_file_path=source_file_path,
+                           event=event,
+                           s3_object_meta=s3_object_meta)
+    if table.num_rows == 0:
+        return 0, []
+
+    table = transform_table(table=table,
+                            source_file_path=source_file_path,
                             s3_object_meta=s3_object_meta)
-            publish_success_to_sns(s3_object)
-            logging.info(
-                f'#--- Finished loading file {source_file_path}. ---#')
-        else:
-            logging.info(
-                f'#--- File {source_file_path} is empty. No data was loaded. ---#'
-            )
+    if table.num_rows == 0:
+        return 0, []
+
+    output_files = save_table_as_parquet(table=table,
+                                         s3_object=s3_object,
+                                         partition_cols=partition_cols,
+                                         event=event,
+                                         s3_object_meta=s3_object_meta)
+    return table.num_rows, output_files
+
+
+# Only the first write of a partition may overwrite it. Rows of partitions
+# already written by a previous chunk of the same file must be appended,
+# otherwise each chunk would replace the data of the chunk before it.
+def _split_chunk_by_output_mode(dataframe, output_mode, partition_cols,
+                                is_first_chunk, written_partitions):
+    if output_mode == 'append':
+        return [(dataframe, output_mode)]
+
+    if output_mode == 'overwrite' or not partition_cols:
+        return [(dataframe, output_mode if is_first_chunk else 'append')]
+
+    partition_keys = pd.MultiIndex.from_frame(
+        dataframe[partition_cols].astype(str))
+    written_mask = partition_keys.isin(list(written_partitions))
+    written_partitions.update(partition_keys.unique())
+
+    df_parts = []
+    if written_mask.any():
+        df_parts.append((dataframe[written_mask], 'append'))
+    if not written_mask.all():
+        df_parts.append((dataframe[~written_mask], output_mode))
+    return df_parts
+
+
+# applies every transformation step to a dataframe (or a chunk of it)
+def transform_df(dataframe, source_file_path, s3_object_meta):
+    dataframe = filter_df_rows(dataframe=dataframe,
+                               source_file_path=source_file_path,
+                               s3_object_meta=s3_object_meta)
+    dataframe = cast_df_columns(dataframe=dataframe,
+                                source_file_path=source_file_path,
+                                s3_object_meta=s3_object_meta)
+    dataframe = str_columns_to_categorical(dataframe=dataframe,
+                                           source_file_path=source_file_path,
+                                           s3_object_meta=s3_object_meta)
+    dataframe = normalize_str_columns(dataframe, s3_object_meta)
+    dataframe = add_etl_metadata_to_df(dataframe,
+                                       source_file_path=source_file_path)
+    dataframe = normalize_column_name(dataframe,
+                                      schema_plan=get_schema_plan(
+                                          source_file_path, s3_object_meta),
+                                      source_file_path=source_file_path)
+    return dataframe
 
 
 def setup_logging():
@@ -95,6 +481,48 @@ def _is_local_execution_mode():
     return False
 
 
+def _get_boto3_session():
+    global BOTO3_SESSION
+    with BOTO3_CLIENT_LOCK:
+        if BOTO3_SESSION is None:
+            BOTO3_SESSION = boto3.Session()
+        return BOTO3_SESSION
+
+
+def _get_boto3_client(service_name):
+    session = _get_boto3_session()
+    with BOTO3_CLIENT_LOCK:
+        client = BOTO3_CLIENTS.get(service_name)
+        if client is not None:
+            BOTO3_CLIENTS_STATS[service_name]['reused'] += 1
+            return client
+
+        start_time = time.perf_counter()
+        client = session.client(
+            service_name,
+            config=botocore_config.Config(
+                max_pool_connections=max(
+                    int(BOTO3_MAX_POOL_CONNECTIONS),
+                    int(MAX_WORKERS) * int(DOWNLOAD_CONCURRENCY))))
+        creation_ms = (time.perf_counter() - start_time) * 1000
+        logging.info(f'Created {service_name} client in {creation_ms:.1f} ms.')
+        BOTO3_CLIENTS[service_name] = client
+        BOTO3_CLIENTS_STATS[service_name] = {
+            'creation_ms': creation_ms,
+            'reused': 0
+        }
+        return client
+
+
+# logs the client creation time saved by reusing the clients so far
+def _log_boto3_clients_stats():
+    saved_ms = sum(stats['creation_ms'] * stats['reused']
+                   for stats in BOTO3_CLIENTS_STATS.values())
+    logging.info(
+        f'boto3 clients: {BOTO3_CLIENTS_STATS}. Client creation time saved by reuse on this container: {saved_ms:.1f} ms.'
+    )
+
+
 # returns a list containing path related properties of each s3 object in event
 def parse_event(event):
     logging.info(f'Event received: {str(event)}')
@@ -104,17 +532,40 @@ def parse_event(event):
         bucket_name = record['s3']['bucket']['name']
         object_key = record['s3']['object']['key']
 
+        if not is_supported_input(object_key):
+            logging.warning(
+                f'Skipping s3://{bucket_name}/{object_key}: not a csv file nor a supported compressed file.'
+            )
+            continue
+
         if len(object_key.split("/")) > 1:
             s3_objects.append({
                 'object_path': f"s3://{bucket_name}/{object_key}",
                 'object_bucket': bucket_name,
                 'object_key': object_key,
-                'target_table': f'tbl_{object_key.split("/")[1]}'
+                'object_etag': record['s3']['object'].get('eTag'),
+                'object_size': record['s3']['object'].get('size'),
+                'object_compression':
+                get_compression_from_extension(object_key),
+                'target_table': get_target_table(object_key)
             })
 
     return s3_objects
 
 
+# the table of a file is named after the first folder of its key
+def get_target_table(object_key):
+    return f'tbl_{object_key.split("/")[1]}'
+
+
+# target table of the s3 path of a file. Local files (local mode and
+# backfill) are not named after a table, their directory is used instead.
+def _get_source_table(file_path):
+    if not file_path.startswith('s3://'):
+        return os.path.dirname(os.path.abspath(file_path))
+    return get_target_table(file_path.split('/', 3)[-1])
+
+
 def get_source_file_path(s3_object):
     if _is_cloud_execution_mode():
         return s3_object['object_path']
@@ -122,12 +573,75 @@ def get_source_file_path(s3_object):
         return LOCAL_CSV_FILE_PATH
 
 
+# Returns the id of the version of the file on the manifest. The ETag and size
+# are sent on the s3 event, so checking the manifest does not need any request
+# to s3. On local mode the modification time of the file replaces the ETag.
+def get_manifest_id(s3_object, source_file_path):
+    if _get_manifest() is None:
+        return None
+    if _is_cloud_execution_mode():
+        if s3_object.get('object_etag') is None:
+            return None
+        return build_manifest_id(source_file_path, s3_object['object_etag'],
+                                 s3_object['object_size'])
+    elif _is_local_execution_mode():
+        file_stat = os.stat(source_file_path)
+        return build_manifest_id(source_file_path, file_stat.st_mtime_ns,
+                                 file_stat.st_size)
+
+
+def _get_manifest():
+    global MANIFEST
+    if MANIFEST is None and MANIFEST_BACKEND not in ('', 'none'):
+        client = _get_boto3_client(
+            'dynamodb') if MANIFEST_BACKEND == 'dynamodb' else None
+        with BOTO3_CLIENT_LOCK:
+            if MANIFEST is None:
+                MANIFEST = create_manifest(MANIFEST_BACKEND,
+                                           path=MANIFEST_PATH,
+                                           table_name=MANIFEST_TABLE,
+                                           client=client)
+    return MANIFEST
+
+
+# returns the manifest record of a file already loaded, otherwise None
+def get_manifest_record(manifest_id):
+    manifest = _get_manifest()
+    if manifest is None or manifest_id is None:
+        return None
+    return manifest.get(manifest_id)
+
+
+# Records a loaded file on the manifest, with the first
+# MANIFEST_MAX_OUTPUT_FILES parquet files it wrote and their count. The data
+# is already saved, so a failure is only logged: failing the file would
+# reload it on the retry.
+def put_manifest_record(manifest_id, source_file_path, loaded_rows,
+                        output_files):
+    manifest = _get_manifest()
+    if manifest is None or manifest_id is None:
+        return
+    try:
+        manifest.put(
+            manifest_id, {
+                'object_path': source_file_path,
+                'loaded_rows': loaded_rows,
+                'output_files': output_files[:int(MANIFEST_MAX_OUTPUT_FILES)],
+                'output_files_count': len(output_files),
+                'loaded_at': datetime.utcnow().isoformat()
+            })
+    except Exception:
+        logging.exception(
+            f'Failed to record {source_file_path} on the manifest.')
+
+
 # gets custom metadata of a single s3 object from s3
+@measure_stage('head_object')
 def get_s3_object_metadata(s3_object):
     metadata = {}
     if _is_cloud_execution_mode():
         logging.info('Retrieving object metadata.')
-        s3 = boto3.client('s3')
+        s3 = _get_boto3_client('s3')
         response = s3.head_object(Bucket=s3_object['object_bucket'],
                                   Key=s3_object['object_key'])
         metadata = response.get('Metadata')
@@ -136,41 +650,518 @@ def get_s3_object_metadata(s3_object):
     return metadata
 
 
+# Fetches the first bytes of the file with a range GET and checks them against
+# the metadata, so a bad file fails in milliseconds instead of after being
+# downloaded and parsed. An encoding, separator or decimal char that does not
+# fit the file is corrected (preflight: correct) or rejects the file
+# (preflight: reject). Columns of partition-cols and row-filter missing from
+# the header always reject the file, while missing custom-cast and select-cols
+# columns only do so with reject. Returns the metadata to read the file with.
+@measure_stage()
+def preflight_check(s3_object, source_file_path, s3_object_meta):
+    mode = s3_object_meta.get('preflight', PREFLIGHT).lower()
+    if not _is_cloud_execution_mode() or mode == 'off':
+        return s3_object_meta
+    if mode not in ('reject', 'correct'):
+        logging.error(
+            f'Invalid preflight metadata for object {source_file_path}.')
+        publish_error_to_sns(source_file_path,
+                             '\n\nError:\nInvalid preflight metadata.')
+        raise ValueError(
+            f'Invalid preflight metadata for object {source_file_path}. Expected either off, reject or correct and received {mode}.'
+        )
+
+    logging.info('Checking the first bytes of the file.')
+    sample_size = int(PREFLIGHT_BYTES)
+    configured = {
+        'input-compression':
+        get_input_compression(source_file_path, s3_object_meta),
+        'file-encoding': s3_object_meta.get('file-encoding', 'utf-8'),
+        'separator': s3_object_meta.get('separator', ','),
+        'decimal-char': s3_object_meta.get('decimal-char', '.')
+    }
+    try:
+        s3 = _get_boto3_client('s3')
+        response = s3.get_object(Bucket=s3_object['object_bucket'],
+                                 Key=s3_object['object_key'],
+                                 Range=f'bytes=0-{sample_size - 1}')
+        sample = response['Body'].read()
+        truncated = len(sample) >= sample_size
+        compression = get_compression_from_magic_bytes(sample)
+        if compression != 'none':
+            # the start of a compressed file is decompressed from the bytes
+            # already fetched, or else from a stream that is closed as soon
+            # as enough bytes were read
+            head = decompress_head(sample, compression, sample_size)
+            if head is None:
+                body = s3.get_object(Bucket=s3_object['object_bucket'],
+                                     Key=s3_object['object_key'])['Body']
+                try:
+                    head = read_head(body, compression, sample_size) or b''
+                finally:
+                    body.close()
+            truncated = truncated or len(head) >= sample_size
+            sample = head
+        sniffed = sniff_csv(sample,
+                            truncated=truncated,
+                            separator=configured['separator'],
+                            decimal_char=configured['decimal-char'],
+                            encoding=configured['file-encoding'])
+        sniffed['input-compression'] = compression
+    except LookupError as err:
+        logging.error(f'Invalid file-encoding metadata: {err}.')
+        publish_error_to_sns(source_file_path, f'\n\nError:\n{err}')
+        raise ValueError(f'Invalid file-encoding metadata: {err}.')
+    except Exception as err:
+        logging.error(f'Failed to check the first bytes of {source_file_path}.')
+        publish_error_to_sns(source_file_path, f'\n\nError:\n{err}')
+        raise err
+
+    corrections = {
+        metadata_key: sniffed[metadata_key]
+        for metadata_key, value in configured.items()
+        if sniffed[metadata_key] != value
+    }
+    problems = [
+        f'{metadata_key} is {configured[metadata_key]!r} but the file seems to use {value!r}'
+        for metadata_key, value in corrections.items()
+    ]
+    # an empty file, or one that cannot be sniffed, has no header to check
+    missing_columns = missing_optional_columns = []
+    if sniffed['header']:
+        missing_columns, missing_optional_columns = _find_missing_columns(
+            sniffed['header'], get_schema_plan(source_file_path,
+                                               s3_object_meta))
+    problems += [
+        f'column {column_name} of {metadata_key} is not on the header'
+        for column_name, metadata_key in missing_columns
+    ]
+    optional_problems = [
+        f'column {column_name} of {metadata_key} is not on the header'
+        for column_name, metadata_key in missing_optional_columns
+    ]
+
+    rejected = mode == 'reject' and (problems or optional_problems)
+    if missing_columns or rejected:
+        error_message = f'Pre-flight check failed: {"; ".join(problems + optional_problems)}.'
+        logging.error(f'{error_message} Object: {source_file_path}.')
+        publish_error_to_sns(source_file_path, f'\n\nError:\n{error_message}')
+        raise ValueError(error_message)
+    for problem in optional_problems:
+        logging.warning(f'Pre-flight check: {problem}.')
+    if corrections:
+        logging.warning(
+            f'Pre-flight check: {"; ".join(problems)}. Reading the file with {corrections}.'
+        )
+        return dict(s3_object_meta, **corrections)
+    return s3_object_meta
+
+
+# Returns the columns of the metadata that are missing from the csv header, as
+# (column, metadata key) pairs: those that make the load fail and those that
+# are only skipped (custom-cast and select-cols).
+def _find_missing_columns(header, schema_plan):
+    normalized_header = schema_plan.column_names(header)
+    missing_columns = [(column_name, 'partition-cols')
+                       for column_name in schema_plan.partition_cols or ()
+                       if column_name not in normalized_header]
+    missing_columns += [(column_name, 'row-filter')
+                        for column_name, _, _ in schema_plan.row_filter
+                        if column_name not in header]
+    missing_optional_columns = [(column_name, 'custom-cast')
+                                for column_name in schema_plan.casts
+                                if column_name not in header]
+    select_cols = schema_plan.select_cols or ()
+    missing_optional_columns += [(column_name, 'select-cols')
+                                 for column_name in select_cols
+                                 if column_name not in header]
+    return missing_columns, missing_optional_columns
+
+
+# Downloads the file to DOWNLOAD_DIR, with concurrent range GETs, while it is
+# processed by the current thread. The readers use the local copy instead of
+# streaming the object from s3 (see get_local_copy). The copy is deleted once
+# the file is processed. Nothing is downloaded for files that are streamed.
+@contextlib.contextmanager
+def local_copy(s3_object, source_file_path, s3_object_meta):
+    # zip files cannot be decompressed as a stream, so they are always
+    # downloaded
+    compression = get_input_compression(source_file_path, s3_object_meta)
+    local_path = download_to_tmp(s3_object=s3_object,
+                                 source_file_path=source_file_path,
+                                 force=compression == 'zip')
+    try:
+        with use_local_copy(source_file_path, local_path):
+            yield local_path
+    finally:
+        if local_path is not None:
+            os.remove(local_path)
+            release_space(s3_object['object_size'])
+
+
+# Makes the readers of the current thread read the file from local_path.
+# Also used by backfill.py, whose files are local already.
+@contextlib.contextmanager
+def use_local_copy(source_file_path, local_path):
+    LOCAL_COPIES.current = (source_file_path, local_path)
+    try:
+        yield local_path
+    finally:
+        LOCAL_COPIES.current = None
+
+
+# returns the local copy of the file processed by the current thread, if any
+def get_local_copy(source_file_path):
+    current = getattr(LOCAL_COPIES, 'current', None)
+    if current is not None and current[0] == source_file_path:
+        return current[1]
+    return None
+
+
+# Downloads the file in parts of DOWNLOAD_PART_SIZE_MB with up to
+# DOWNLOAD_CONCURRENCY concurrent range GETs. Returns the local path, or None
+# if the file should be streamed instead: the download is disabled, the file
+# fits on a single part (unless forced) or there is not enough space on
+# DOWNLOAD_DIR.
+@measure_stage('download')
+def download_to_tmp(s3_object, source_file_path, force=False):
+    size = s3_object.get('object_size')
+    part_size = int(DOWNLOAD_PART_SIZE_MB) * 1024 * 1024
+    concurrency = int(DOWNLOAD_CONCURRENCY)
+    if not _is_cloud_execution_mode() or concurrency <= 0 or not size:
+        return None
+    if size <= part_size and not force:
+        return None
+    if not reserve_space(DOWNLOAD_DIR, size,
+                         int(DOWNLOAD_MIN_FREE_MB) * 1024 * 1024):
+        logging.warning(
+            f'Not enough space on {DOWNLOAD_DIR} to download {size} bytes. Streaming the file from s3.'
+        )
+        return None
+
+    # the extension is kept, so readers can infer the compression of the file
+    local_path = os.path.join(
+        DOWNLOAD_DIR,
+        f'{uuid.uuid4().hex}.{os.path.basename(s3_object["object_key"])}')
+    logging.info(
+        f'Downloading {size} bytes in parts of {part_size} bytes to {local_path}.'
+    )
+    try:
+        download_object(_get_boto3_client('s3'),
+                        bucket=s3_object['object_bucket'],
+                        key=s3_object['object_key'],
+                        size=size,
+                        local_path=local_path,
+                        part_size=part_size,
+                        max_concurrency=concurrency,
+                        etag=s3_object.get('object_etag'))
+    except Exception as err:
+        release_space(size)
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        logging.error(f'Failed to download {source_file_path}.')
+        publish_error_to_sns(source_file_path, f'\n\nError:\n{err}')
+        raise err
+    return local_path
+
+
 # parses s3 object metadata to identify if table must be partitioned
 def get_partition_cols(source_file_path, s3_object_meta):
     if _is_cloud_execution_mode():
         logging.info('Identifying partition columns.')
-        partition_cols = s3_object_meta.get('partition-cols')
-
+        schema_plan = get_schema_plan(source_file_path, s3_object_meta)
+        partition_cols = schema_plan.partition_cols
         if partition_cols:
-
-            try:
-                partition_cols = literal_eval(partition_cols)
-            except Exception:
-                pass
-
-            if isinstance(partition_cols, list):
-                partition_cols = [
-                    _normalize_name(col) for col in partition_cols
-                ]
-            elif isinstance(partition_cols, str):
-                partition_cols = [_normalize_name(partition_cols)]
-            else:
-                logging.error(
-                    f'Invalid partition-cols metadata for object {source_file_path}.'
-                )
-                publish_error_to_sns(
-                    source_file_path,
-                    '\n\nError:\nInvalid partition-cols metadata.')
-                raise ValueError(
-                    f'Invalid partition-cols metadata for object {source_file_path}. Please specify either a list or a string.'
-                )
+            partition_cols = list(partition_cols)
 
         logging.info('Partition Columns: {}'.format(partition_cols))
         return partition_cols
 
 
+# Validated custom-cast, partition-cols, select-cols, drop-cols and row-filter
+# metadata of a table. Files of the same table usually share the same
+# metadata, so a plan is compiled once per distinct metadata and reused by
+# every file.
+class SchemaPlan:
+
+    def __init__(self,
+                 casts,
+                 partition_cols,
+                 select_cols=None,
+                 drop_cols=(),
+                 row_filter=()):
+        self.casts = casts
+        self.partition_cols = partition_cols
+        self.select_cols = select_cols
+        self.drop_cols = drop_cols
+        self.row_filter = row_filter
+        # row-filter columns are read even when they are not selected, and
+        # dropped once the rows are filtered
+        self.filter_cols = tuple(
+            dict.fromkeys(column_name for column_name, _, _ in row_filter))
+        self.unselected_filter_cols = tuple(
+            column_name for column_name in self.filter_cols
+            if not self.is_selected(column_name))
+        # dtypes parsed by the csv reader itself, so pandas never infers and
+        # then re-casts these columns
+        self.reader_dtypes = {
+            column_name: READER_DTYPES[data_type]
+            for column_name, data_type in casts.items()
+            if data_type in READER_DTYPES
+        }
+        # int, date and datetime columns are casted after reading, and after
+        # the unselected row-filter columns are dropped. The reader fails
+        # when a parse_dates column does not exist on the csv file.
+        self.post_read_casts = {
+            column_name: data_type
+            for column_name, data_type in casts.items()
+            if data_type not in READER_DTYPES and self.is_selected(column_name)
+        }
+        # date columns stay datetime64 while they are transformed and are
+        # only written as parquet/glue dates
+        self.output_dtypes = {
+            _normalize_name(column_name): 'date'
+            for column_name, data_type in casts.items() if data_type == 'date'
+        }
+        self._column_names = {}
+
+    # returns whether a csv column is loaded, according to select-cols and drop-cols
+    def is_selected(self, column):
+        if self.select_cols is not None and column not in self.select_cols:
+            return False
+        return column not in self.drop_cols
+
+    # returns whether a csv column is read: the loaded columns and the
+    # row-filter ones
+    def is_read(self, column):
+        return self.is_selected(column) or column in self.filter_cols
+
+    # usecols argument of the csv reader. None reads every column.
+    @property
+    def usecols(self):
+        if self.select_cols is None and not self.drop_cols:
+            return None
+        return self.is_read
+
+    # returns the partition columns that select-cols or drop-cols leave out
+    def unselected_partition_cols(self):
+        selected_names = None
+        if self.select_cols is not None:
+            selected_names = {
+                _normalize_name(column) for column in self.select_cols
+            }
+        dropped_names = {_normalize_name(column) for column in self.drop_cols}
+        return [
+            column_name for column_name in self.partition_cols or ()
+            if column_name in dropped_names or (
+                selected_names is not None and column_name not in selected_names)
+        ]
+
+    # returns the normalized column names of a csv header
+    def column_names(self, columns):
+        columns = tuple(columns)
+        column_names = self._column_names.get(columns)
+        if column_names is None:
+            column_names = normalize_names(columns)
+            self._column_names[columns] = column_names
+        return column_names
+
+
+# parses the object metadata into a schema plan, publishing invalid metadata errors to sns
+def get_schema_plan(source_file_path, s3_object_meta):
+    try:
+        return compile_schema_plan(s3_object_meta.get('custom-cast'),
+                                   s3_object_meta.get('partition-cols'),
+                                   s3_object_meta.get('select-cols'),
+                                   s3_object_meta.get('drop-cols'),
+                                   s3_object_meta.get('row-filter'))
+    except ValueError as err:
+        logging.error(f'{err} Object: {source_file_path}.')
+        publish_error_to_sns(source_file_path, f'\n\nError:\n{err}')
+        raise err
+
+
+@functools.lru_cache(maxsize=int(SCHEMA_PLAN_CACHE_SIZE))
+def compile_schema_plan(custom_cast,
+                        partition_cols,
+                        select_cols=None,
+                        drop_cols=None,
+                        row_filter=None):
+    drop_cols = _parse_column_list(drop_cols, 'drop-cols')
+    schema_plan = SchemaPlan(
+        casts=_parse_custom_cast(custom_cast),
+        partition_cols=_parse_partition_cols(partition_cols),
+        select_cols=_parse_column_list(select_cols, 'select-cols'),
+        drop_cols=drop_cols if drop_cols else (),
+        row_filter=_parse_row_filter(row_filter))
+    unselected_partition_cols = schema_plan.unselected_partition_cols()
+    if unselected_partition_cols:
+        raise ValueError(
+            f'Invalid partition-cols metadata. The partition columns {unselected_partition_cols} are not loaded: add them to select-cols and remove them from drop-cols.'
+        )
+    return schema_plan
+
+
+def _parse_custom_cast(custom_cast):
+    if not custom_cast:
+        return {}
+
+    try:
+        casts = literal_eval(custom_cast)
+    except Exception:
+        casts = None
+    if not isinstance(casts, dict):
+        raise ValueError(
+            'Invalid custom-cast format. Dict-like string is expected.')
+
+    for column_name, data_type in casts.items():
+        if data_type not in CAST_DATA_TYPES:
+            raise ValueError(
+                f'Unable to cast column {column_name}. Expected either int, float, date, datetime or string and received {data_type}.'
+            )
+    return casts
+
+
+def _parse_partition_cols(partition_cols):
+    partition_cols = _parse_column_list(partition_cols, 'partition-cols')
+    if partition_cols is None:
+        return None
+    return tuple(_normalize_name(col) for col in partition_cols)
+
+
+# parses a metadata value that is either a column name or a list of column names
+def _parse_column_list(columns, metadata_key):
+    if not columns:
+        return None
+
+    try:
+        columns = literal_eval(columns)
+    except Exception:
+        pass
+
+    if isinstance(columns, list):
+        return tuple(columns)
+    elif isinstance(columns, str):
+        return (columns, )
+    raise ValueError(
+        f'Invalid {metadata_key} metadata. Please specify either a list or a string.'
+    )
+
+
+# row-filter is a list of (column, operator, value) conditions that every
+# loaded row must meet, e.g. [("Country", "==", "SCOTLAND"), ("WindSpeed", ">", 10)]
+def _parse_row_filter(row_filter):
+    if not row_filter:
+        return ()
+
+    try:
+        conditions = literal_eval(row_filter)
+    except Exception:
+        conditions = None
+    if isinstance(conditions, tuple) and len(conditions) == 3 and isinstance(
+            conditions[1], str):
+        conditions = [conditions]
+    if not isinstance(conditions, list) or not all(
+            isinstance(condition, tuple) and len(condition) == 3
+            for condition in conditions):
+        raise ValueError(
+            'Invalid row-filter format. A list of (column, operator, value) tuples is expected.'
+        )
+
+    for column_name, operator_name, value in conditions:
+        if operator_name not in ROW_FILTER_OPERATORS:
+            raise ValueError(
+                f'Invalid row-filter operator {operator_name} for column {column_name}. Expected one of {list(ROW_FILTER_OPERATORS)}.'
+            )
+        if operator_name in ('in', 'not in') and not isinstance(
+                value, (list, tuple, set)):
+            raise ValueError(
+                f'Invalid row-filter value for column {column_name}. A list is expected by operator {operator_name}.'
+            )
+    return tuple(conditions)
+
+
+# parses s3 object metadata (or CSV_CHUNK_SIZE env var) to identify if file must be read in chunks
+def get_chunk_size(source_file_path, s3_object_meta):
+    chunk_size = s3_object_meta.get('chunk-size', CSV_CHUNK_SIZE)
+    try:
+        chunk_size = int(chunk_size)
+    except (TypeError, ValueError):
+        logging.error(
+            f'Invalid chunk-size metadata for object {source_file_path}.')
+        publish_error_to_sns(source_file_path,
+                             '\n\nError:\nInvalid chunk-size metadata.')
+        raise ValueError(
+            f'Invalid chunk-size metadata for object {source_file_path}. Please specify an integer number of rows.'
+        )
+
+    if chunk_size > 0:
+        return chunk_size
+    return None
+
+
+# parses s3 object metadata (or ENGINE env var) to identify which engine processes the file
+def get_engine(source_file_path, s3_object_meta):
+    engine = s3_object_meta.get('engine', ENGINE).lower()
+    if engine not in ('pandas', 'pyarrow'):
+        logging.error(
+            f'Invalid engine metadata for object {source_file_path}.')
+        publish_error_to_sns(source_file_path,
+                             '\n\nError:\nInvalid engine metadata.')
+        raise ValueError(
+            f'Invalid engine metadata for object {source_file_path}. Expected either pandas or pyarrow and received {engine}.'
+        )
+
+    logging.info(f'Engine: {engine}')
+    return engine
+
+
+# Parses s3 object metadata to identify how the file is compressed. auto
+# uses the extension of the file, while the pre-flight check also looks at
+# its magic bytes.
+def get_input_compression(source_file_path, s3_object_meta):
+    compression = s3_object_meta.get('input-compression', 'auto').lower()
+    if compression == 'auto':
+        return get_compression_from_extension(source_file_path)
+    if compression not in INPUT_COMPRESSIONS:
+        logging.error(
+            f'Invalid input-compression metadata for object {source_file_path}.'
+        )
+        publish_error_to_sns(source_file_path,
+                             '\n\nError:\nInvalid input-compression metadata.')
+        raise ValueError(
+            f'Invalid input-compression metadata for object {source_file_path}. Expected either auto, none, gzip, zstd, bz2 or zip and received {compression}.'
+        )
+    return compression
+
+
+# Returns a stream of the decompressed content of a compressed file, read
+# from its local copy or streamed from s3. Closing it closes the s3 body.
+def open_decompressed_csv(s3_source_path, compression):
+    local_path = get_local_copy(s3_source_path)
+    if local_path is not None:
+        stream = open(local_path, 'rb')
+    else:
+        stream = open_s3_object(s3_source_path)
+    try:
+        return open_decompressed(stream, compression)
+    except Exception:
+        stream.close()
+        raise
+
+
+# Returns the body of the s3 object as a stream, read with the shared s3
+# client of the lambda instead of opening a new s3fs connection. A body that
+# is not read to its end holds its pooled connection until it is closed.
+def open_s3_object(s3_source_path):
+    bucket_name, object_key = s3_source_path.replace('s3://', '',
+                                                     1).split('/', 1)
+    return _get_boto3_client('s3').get_object(Bucket=bucket_name,
+                                              Key=object_key)['Body']
+
+
 # reads csv file from s3 or from local computer
+@measure_stage()
 def read_csv(source_file_path, event, s3_object_meta):
     if _is_cloud_execution_mode():
         return _read_csv_cloud(source_file_path, s3_object_meta)
@@ -178,33 +1169,96 @@ def read_csv(source_file_path, event, s3_object_meta):
         return _read_csv_local(event)
 
 
-def _read_csv_cloud(s3_source_path, s3_object_meta):
+# reads csv file from s3 or from local computer as an iterator of dataframes
+def read_csv_chunks(source_file_path, event, s3_object_meta, chunk_size):
+    if _is_cloud_execution_mode():
+        reader = _read_csv_cloud(source_file_path,
+                                 s3_object_meta,
+                                 chunk_size=chunk_size)
+    elif _is_local_execution_mode():
+        reader = _read_csv_local(event, chunk_size=chunk_size)
+    return _iter_csv_chunks(reader, source_file_path, event)
+
+
+# parsing errors of a chunked reader only show up while iterating over it.
+# The reader is closed once the chunks are used up, or when the generator is
+# closed because a chunk failed.
+def _iter_csv_chunks(reader, source_file_path, event):
+    try:
+        for chunk in measure_iterator('read_csv', reader):
+            if _is_local_execution_mode():
+                chunk = _parse_local_dates(chunk, event)
+            yield chunk
+    except Exception as err:
+        logging.error(f'Failed to read csv {source_file_path}.')
+        publish_error_to_sns(source_file_path, f'\n\nError:\n{err}')
+        raise err
+    finally:
+        reader.close()
+
+
+# yields the chunks of a reader and then closes the stream it reads
+def _close_after_chunks(reader, source):
+    try:
+        yield from reader
+    finally:
+        _close_source(source)
+
+
+# closes the streams of open_s3_object and open_decompressed_csv. Local paths
+# are opened and closed by the reader itself.
+def _close_source(source):
+    if source is not None and not isinstance(source, str):
+        source.close()
+
+
+def _read_csv_cloud(s3_source_path, s3_object_meta, chunk_size=None):
     logging.info('Extracting csv file from s3.')
     separator = s3_object_meta.get('separator', ',')
     decimal_char = s3_object_meta.get('decimal-char', '.')
     encoding = s3_object_meta.get('file-encoding', 'utf-8')
+    schema_plan = get_schema_plan(s3_source_path, s3_object_meta)
+    compression = get_input_compression(s3_source_path, s3_object_meta)
+    local_path = get_local_copy(s3_source_path)
+    source = None
     try:
-        df = pd.read_csv(s3_source_path,
+        if compression != 'none':
+            # decompressed while it is parsed, chunk by chunk when chunked
+            source = open_decompressed_csv(s3_source_path, compression)
+            local_path = None
+        else:
+            source = local_path or open_s3_object(s3_source_path)
+        df = pd.read_csv(source,
+                         memory_map=local_path is not None,
                          sep=separator,
                          decimal=decimal_char,
-                         encoding=encoding)
+                         encoding=encoding,
+                         dtype=schema_plan.reader_dtypes,
+                         usecols=schema_plan.usecols,
+                         chunksize=chunk_size)
     except Exception as err:
+        _close_source(source)
         logging.error(f'Failed to read csv {s3_source_path} on S3.')
         publish_error_to_sns(s3_source_path, f'\n\nError:\n{err}')
         raise err
 
+    if chunk_size is not None:
+        # the stream is read while the chunks are iterated over
+        return _close_after_chunks(df, source)
+    _close_source(source)
     return df
 
 
-def _read_csv_local(event):
+def _read_csv_local(event, chunk_size=None):
     logging.info('Extracting csv file.')
     try:
         df = pd.read_csv(LOCAL_CSV_FILE_PATH,
                          dtype=event['dtypes'],
                          parse_dates=event.get('parse_dates'),
-                         na_filter=False)
-        for column in event.get('parse_dates', list()):
-            df[column] = df[column].dt.date
+                         na_filter=False,
+                         chunksize=chunk_size)
+        if chunk_size is None:
+            df = _parse_local_dates(df, event)
     except Exception as err:
         logging.error(f'Failed to read csv {LOCAL_CSV_FILE_PATH}.')
         raise err
@@ -212,78 +1266,256 @@ def _read_csv_local(event):
     return df
 
 
+def _parse_local_dates(dataframe, event):
+    for column in event.get('parse_dates', list()):
+        dataframe[column] = dataframe[column].dt.date
+    return dataframe
+
+
+# data types accepted by custom-cast
+CAST_DATA_TYPES = ('int', 'float', 'date', 'datetime', 'string')
+
+# pandas dtypes passed to the csv reader for each custom-cast data type.
+# int is left out: the reader parses nullable Int64 columns from strings,
+# which is slower than casting the inferred int64/float64 column afterwards.
+READER_DTYPES = {'float': 'float64', 'string': 'str'}
+
+# row-filter operators applied to a dataframe column
+ROW_FILTER_OPERATORS = {
+    '==': lambda column, value: column == value,
+    '!=': lambda column, value: column != value,
+    '<': lambda column, value: column < value,
+    '<=': lambda column, value: column <= value,
+    '>': lambda column, value: column > value,
+    '>=': lambda column, value: column >= value,
+    'in': lambda column, value: column.isin(value),
+    'not in': lambda column, value: ~column.isin(value)
+}
+
+
+# keeps only the rows that meet the row-filter metadata conditions, so the
+# filtered out rows are not transformed nor saved. The row-filter columns
+# that are not selected are dropped afterwards.
+@measure_stage()
+def filter_df_rows(dataframe, source_file_path, s3_object_meta):
+    schema_plan = get_schema_plan(source_file_path, s3_object_meta)
+    row_filter = schema_plan.row_filter
+    if row_filter:
+        logging.info(f'Filtering rows: {row_filter}')
+        try:
+            mask = np.ones(len(dataframe), dtype=bool)
+            for column_name, operator_name, value in row_filter:
+                condition = ROW_FILTER_OPERATORS[operator_name](
+                    dataframe[column_name], value)
+                mask &= condition.fillna(False).to_numpy(dtype=bool)
+        except Exception as err:
+            logging.error(f'Could not apply row-filter {row_filter}.')
+            publish_error_to_sns(source_file_path, f'\n\nError:\n{err}')
+            raise err
+        dataframe = dataframe.loc[mask, [
+            column for column in dataframe.columns
+            if column not in schema_plan.unselected_filter_cols
+        ]].copy()
+        logging.info(f'{len(dataframe)} rows left after filtering.')
+    return dataframe
+
+
+# functions that cast a dataframe column after reading. date columns are kept
+# as datetime64 and only written as dates (see SchemaPlan.output_dtypes).
+POST_READ_CASTS = {
+    'date': lambda column: pd.to_datetime(column),
+    'datetime': lambda column: pd.to_datetime(column),
+    'int': lambda column: column.astype('Int64')
+}
+
+
 # parses s3 object metadata to identify if columns must be casted and then apply cast.
+@measure_stage()
 def cast_df_columns(dataframe, source_file_path, s3_object_meta):
     if _is_cloud_execution_mode():
         logging.info('Casting dataframe columns.')
-        cast_schema = s3_object_meta.get('custom-cast')
-        if cast_schema:
+        schema_plan = get_schema_plan(source_file_path, s3_object_meta)
+        for column_name, data_type in schema_plan.post_read_casts.items():
+            if column_name not in dataframe.columns:
+                logging.warning(
+                    f'Skipping cast of column {column_name} to {data_type} as the column does not exists on csv file.'
+                )
+                continue
+
             try:
-                cast_schema = literal_eval(cast_schema)
+                dataframe[column_name] = POST_READ_CASTS[data_type](
+                    dataframe[column_name])
             except Exception as err:
                 logging.error(
-                    f'Invalid custom-cast format for object {source_file_path}. Dict-like string is expected.'
-                )
-                publish_error_to_sns(
-                    source_file_path,
-                    '\n\nError:\nInvalid custom-cast format. Dict-like string is expected.'
-                )
+                    f'Could not cast column {column_name} to {data_type}.')
+                publish_error_to_sns(source_file_path, f'\n\nError:\n{err}')
                 raise err
 
-            for column_name, data_type in cast_schema.items():
-                try:
-                    if data_type == 'date':
-                        dataframe[column_name] = pd.to_datetime(
-                            dataframe[column_name]).dt.date
-                    elif data_type == 'datetime':
-                        dataframe[column_name] = pd.to_datetime(
-                            dataframe[column_name])
-                    elif data_type == 'int':
-                        dataframe[column_name] = dataframe[column_name].astype(
-                            'Int64')
-                    elif data_type == 'float':
-                        dataframe[column_name] = dataframe[column_name].astype(
-                            'float64')
-                    elif data_type == 'string':
-                        dataframe[column_name] = dataframe[column_name].astype(
-                            str)
-                    else:
-                        logging.error(
-                            f'Invalid data type {data_type} for column {column_name}.'
-                        )
-                        publish_error_to_sns(
-                            source_file_path,
-                            f'\n\nError:\nInvalid data type {data_type} for column {column_name}.'
-                        )
-                        raise ValueError(
-                            f'Unable to cast column {column_name}. Expected either int, float, date, datetime or string and received {data_type}.'
-                        )
-                except KeyError:
-                    logging.warn(
-                        f'Skipping cast of column {column_name} to {data_type} as the column does not exists on csv file.'
-                    )
-                except Exception as err:
-                    logging.error(
-                        f'Could not cast column {column_name} to {data_type}.')
-                    publish_error_to_sns(source_file_path,
-                                         f'\n\nError:\n{err}')
-                    raise err
+    return dataframe
+
 
+# Converts low cardinality string columns to categorical, so the following
+# steps process each distinct value once instead of once per row. Partition
+# columns are never converted.
+@measure_stage()
+def str_columns_to_categorical(dataframe, source_file_path, s3_object_meta):
+    # object columns, or str columns on pandas versions reading strings as str
+    str_columns = [
+        column for column, dtype in dataframe.dtypes.items()
+        if dtype == object or isinstance(dtype, pd.StringDtype)
+    ]
+    columns = get_categorical_columns(
+        source_file_path=source_file_path,
+        s3_object_meta=s3_object_meta,
+        columns=dataframe.columns,
+        str_columns=str_columns,
+        is_low_cardinality=lambda column, threshold: _is_low_cardinality(
+            dataframe[column], threshold))
+    # a column may have no string value on a later chunk
+    columns = [column for column in columns if column in str_columns]
+    if columns:
+        logging.info(f'Converting columns to categorical: {columns}')
+        for column in columns:
+            dataframe[column] = dataframe[column].astype('category')
     return dataframe
 
 
-# Applies upper to string columns
-def str_columns_to_upper(dataframe, s3_object_meta):
+# Returns the string columns to convert to categorical. They are picked from
+# the first chunk of the first file of the table with the same header and
+# categorical metadata, and reused by the following chunks and files, so every
+# parquet file of a table is written with the same schema.
+def get_categorical_columns(source_file_path, s3_object_meta, columns,
+                            str_columns, is_low_cardinality):
+    try:
+        threshold = float(
+            s3_object_meta.get('categorical-threshold', CATEGORICAL_THRESHOLD))
+        categorical_cols = _parse_column_list(
+            s3_object_meta.get('categorical-cols'), 'categorical-cols') or ()
+        non_categorical_cols = _parse_column_list(
+            s3_object_meta.get('non-categorical-cols'),
+            'non-categorical-cols') or ()
+    except ValueError as err:
+        logging.error(
+            f'Invalid categorical metadata for object {source_file_path}.')
+        publish_error_to_sns(source_file_path, f'\n\nError:\n{err}')
+        raise err
+
+    partition_cols = get_schema_plan(source_file_path,
+                                     s3_object_meta).partition_cols or ()
+    key = (_get_source_table(source_file_path), tuple(columns), threshold,
+           categorical_cols, non_categorical_cols, partition_cols)
+    with CATEGORICAL_LOCK:
+        categorical_columns = CATEGORICAL_COLUMNS.get(key)
+        if categorical_columns is not None:
+            CATEGORICAL_COLUMNS.move_to_end(key)
+    if categorical_columns is None:
+        categorical_columns = []
+        for column in str_columns:
+            if column in non_categorical_cols or _normalize_name(
+                    column) in partition_cols:
+                continue
+            if column in categorical_cols or is_low_cardinality(
+                    column, threshold):
+                categorical_columns.append(column)
+        categorical_columns = tuple(categorical_columns)
+        with CATEGORICAL_LOCK:
+            categorical_columns = CATEGORICAL_COLUMNS.setdefault(
+                key, categorical_columns)
+            while len(CATEGORICAL_COLUMNS) > int(
+                    CATEGORICAL_COLUMNS_CACHE_SIZE):
+                CATEGORICAL_COLUMNS.popitem(last=False)
+    return categorical_columns
+
+
+# estimates the ratio of distinct values to rows from a sample of the column
+def _is_low_cardinality(df_column, threshold):
+    if threshold <= 0:
+        return False
+    sample = df_column.iloc[:CATEGORICAL_SAMPLE_SIZE]
+    return sample.nunique() <= threshold * len(sample)
+
+
+# Converts string columns to arrow backed string[pyarrow] columns, applying
+# upper on the way, in a single pass over each column. Missing values become
+# arrow nulls, which the parquet writer keeps as nulls, and the column is
+# converted to an arrow table without being copied again. Upper gives the
+# same values as str.upper (see utf8_upper). Object columns that arrow does
+# not take as strings keep the pandas upper. On pandas versions without
+# string[pyarrow] (before 1.3) every object column does.
+@measure_stage()
+def normalize_str_columns(dataframe, s3_object_meta):
     output_str_upper = s3_object_meta.get('output-str-upper', 'true').lower()
-    if output_str_upper == 'true':
-        logging.info('Applying upper to string columns.')
-        # excludes numerical columns
-        df_objects = dataframe.select_dtypes(include='object')
-        for column in df_objects.columns:
-            dataframe.loc[:, column] = _df_column_to_upper(df_objects[column])
+    upper = output_str_upper == 'true'
+    logging.info('Normalizing string columns.')
+    arrow_strings = getattr(pd.arrays, 'ArrowStringArray', None)
+    for column in list(dataframe.columns):
+        df_column = dataframe[column]
+        if isinstance(df_column.dtype, pd.CategoricalDtype):
+            if upper:
+                dataframe[column] = _categorical_column_to_upper(df_column)
+            continue
+        if df_column.dtype != object and not isinstance(
+                df_column.dtype, pd.StringDtype):
+            continue
+
+        if arrow_strings is not None:
+            try:
+                dataframe[column] = _df_column_to_arrow_strings(
+                    df_column, upper, arrow_strings)
+                continue
+            except (pa.ArrowTypeError, pa.ArrowInvalid):
+                # objects that are not strings, such as numbers
+                pass
+        if upper:
+            dataframe[column] = _df_column_to_upper(df_column)
     return dataframe
 
 
+def _df_column_to_arrow_strings(df_column, upper, arrow_strings):
+    # object columns are copied once into arrow, NaN and None become nulls.
+    # string columns are arrow backed already.
+    values = pa.array(df_column,
+                      type=pa.string() if df_column.dtype == object else None,
+                      from_pandas=True)
+    if upper:
+        values = utf8_upper(values)
+    return pd.Series(arrow_strings(values),
+                     index=df_column.index,
+                     name=df_column.name)
+
+
+# Upper cases arrow strings like str.upper. pc.utf8_upper maps each character
+# to a single one, where str.upper expands some of them (e.g. straße becomes
+# STRASSE), so the values that are not ascii are upper cased by python.
+def utf8_upper(values):
+    if isinstance(values, pa.ChunkedArray):
+        return pa.chunked_array([utf8_upper(chunk) for chunk in values.chunks],
+                                type=values.type)
+    upper_values = pc.utf8_upper(values)
+    non_ascii = pc.fill_null(pc.invert(pc.string_is_ascii(values)), False)
+    if not pc.any(non_ascii).as_py():
+        return upper_values
+    python_upper = pa.array([
+        value.upper() for value in pc.filter(values, non_ascii).to_pylist()
+    ], type=values.type)
+    return pc.replace_with_mask(upper_values, non_ascii, python_upper)
+
+
+# applies upper to the categories instead of to every row
+def _categorical_column_to_upper(df_column):
+    categories = df_column.cat.categories
+    if categories.inferred_type != 'string':
+        return df_column
+
+    # arrow backed categories (pandas 3) would be upper cased by utf8_upper
+    upper_categories = categories.astype(object).str.upper()
+    if upper_categories.is_unique:
+        return df_column.cat.rename_categories(upper_categories)
+    # categories that only differ by case are merged into one
+    return df_column.map(dict(zip(categories,
+                                  upper_categories))).astype('category')
+
+
 def _df_column_to_upper(df_column):
     try:
         df_column = df_column.str.upper()
@@ -295,6 +1527,7 @@ def _df_column_to_upper(df_column):
 
 
 # adds metadata to the dataframe regarding the load process.
+@measure_stage()
 def add_etl_metadata_to_df(dataframe, source_file_path):
     logging.info('Adding ETL metadata.')
     dataframe['dl_creation_date'] = datetime.today().date()
@@ -302,118 +1535,606 @@ def add_etl_metadata_to_df(dataframe, source_file_path):
     return dataframe
 
 
-def _normalize_name(name):
-    name = name.replace(' ', '_')
-    name = name.replace('-', '_')
-    name = name.replace('.', '_')
-    name = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
-    name = re.sub('([a-z0-9])([A-Z])', r'\1_\2', name)
-    name = name.lower()
-    return re.sub(r'(_)\1+', '\\1', name)
+# column name normalization rules
+NAME_SEPARATORS = str.maketrans(' -.', '___')
+CAMEL_CASE_WORD_REGEX = re.compile('(.)([A-Z][a-z]+)')
+CAMEL_CASE_BOUNDARY_REGEX = re.compile('([a-z0-9])([A-Z])')
+REPEATED_UNDERSCORES_REGEX = re.compile(r'(_)\1+')
 
 
-def normalize_column_name(dataframe):
+# the same headers are received by every file of a table, so the normalized
+# names are memoized
+@functools.lru_cache(maxsize=int(NORMALIZED_NAMES_CACHE_SIZE))
+def _normalize_name(name):
+    name = name.translate(NAME_SEPARATORS)
+    name = CAMEL_CASE_WORD_REGEX.sub(r'\1_\2', name)
+    name = CAMEL_CASE_BOUNDARY_REGEX.sub(r'\1_\2', name)
+    name = name.lower()
+    return REPEATED_UNDERSCORES_REGEX.sub('\\1', name)
+
+
+# normalizes a list of column names. Raises ValueError when two columns
+# normalize to the same name, as parquet files can not have duplicated columns.
+def normalize_names(columns):
+    normalized_names = [_normalize_name(column) for column in columns]
+    if len(set(normalized_names)) != len(normalized_names):
+        raw_names = {}
+        for column, normalized_name in zip(columns, normalized_names):
+            raw_names.setdefault(normalized_name, []).append(column)
+        collisions = {
+            normalized_name: columns
+            for normalized_name, columns in raw_names.items()
+            if len(columns) > 1
+        }
+        raise ValueError(
+            f'Columns have the same normalized name: {collisions}.')
+    return normalized_names
+
+
+@measure_stage()
+def normalize_column_name(dataframe, schema_plan=None, source_file_path=None):
     logging.info('Normalizing column names.')
-    columns = list(dataframe.columns)
-    dataframe.columns = [_normalize_name(column) for column in columns]
+    dataframe.columns = _get_normalized_column_names(list(dataframe.columns),
+                                                     schema_plan,
+                                                     source_file_path)
     return dataframe
 
 
-# Removes NaN values
-def replace_nan_values(dataframe):
-    logging.info('Replacing NaN values to None.')
-    # excludes numerical columns
-    df_objects = dataframe.select_dtypes(include='object')
-    df_objects = df_objects.replace({np.nan: None})
-    dataframe[df_objects.columns] = df_objects
-    return dataframe
+def _get_normalized_column_names(columns, schema_plan, source_file_path):
+    try:
+        if schema_plan is not None:
+            return schema_plan.column_names(columns)
+        return normalize_names(columns)
+    except ValueError as err:
+        logging.error(f'Could not normalize column names. {err}')
+        if source_file_path:
+            publish_error_to_sns(source_file_path, f'\n\nError:\n{err}')
+        raise err
 
 
-def build_sns_topic_arn(context):
-    if _is_cloud_execution_mode():
-        global SNS_TOPIC_ARN
-        lambda_arn_splitted = context.invoked_function_arn.split(":")
-        aws_region = lambda_arn_splitted[3]
-        aws_account_id = lambda_arn_splitted[4]
-        SNS_TOPIC_ARN = f'arn:aws:sns:{aws_region}:{aws_account_id}:{SNS_TOPIC_NAME}'
+# ARROW ENGINE
+# The functions below are the pyarrow equivalents of the pandas steps above.
 
+# maps custom-cast data types to the arrow types used by the csv parser.
+# date columns are parsed as timestamps and converted to date32 afterwards.
+ARROW_CAST_TYPES = {
+    'date': lambda: pa.timestamp('ns'),
+    'datetime': lambda: pa.timestamp('ns'),
+    'int': lambda: pa.int64(),
+    'float': lambda: pa.float64(),
+    'string': lambda: pa.string()
+}
 
-def publish_success_to_sns(s3_object):
-    if _is_cloud_execution_mode():
-        file_path = s3_object['object_path']
-        table_name = s3_object['target_table']
-        file_name = file_path.rsplit(sep='/', maxsplit=1)[1]
-        subject = f'SUCCESS - {file_name} - Csv to parquet succeeded.'
-        message = f'The file {file_path} was loaded successfully into S3 Analytics and is accessible via Athena on table {table_name}.'
-
-        logging.info(f'Publishing success to {SNS_TOPIC_ARN}')
-        _publish_to_sns(SNS_TOPIC_ARN, subject, message)
+# maps the dtypes of the local test event to custom-cast data types
+LOCAL_DTYPES_TO_CAST = {'Int64': 'int', 'float64': 'float', 'str': 'string'}
 
 
-def publish_error_to_sns(file_path, exception_message):
+# reads csv file from s3 or from local computer as an arrow table
+@measure_stage()
+def read_csv_arrow(source_file_path, event, s3_object_meta):
     if _is_cloud_execution_mode():
-        file_name = file_path.rsplit(sep='/', maxsplit=1)[1]
-        subject = f'ERROR - {file_name} - Csv to parquet failed.'
-        message = f'The file {file_path} could not be loaded into S3 Analytics. Please check the logs for more details.\n\n {exception_message}'
+        cast_schema = get_schema_plan(source_file_path, s3_object_meta).casts
+        return _read_csv_arrow_cloud(source_file_path, s3_object_meta,
+                                     cast_schema)
+    elif _is_local_execution_mode():
+        cast_schema = {
+            column: LOCAL_DTYPES_TO_CAST.get(dtype, 'string')
+            for column, dtype in event['dtypes'].items()
+        }
+        for column in event.get('parse_dates', list()):
+            cast_schema[column] = 'date'
+        return _read_csv_arrow_local(cast_schema)
 
-        logging.info(f'Publishing error to {SNS_TOPIC_ARN}')
-        _publish_to_sns(SNS_TOPIC_ARN, subject, message)
 
+def _read_csv_arrow_cloud(s3_source_path, s3_object_meta, cast_schema):
+    logging.info('Extracting csv file from s3.')
+    separator = s3_object_meta.get('separator', ',')
+    decimal_char = s3_object_meta.get('decimal-char', '.')
+    encoding = s3_object_meta.get('file-encoding', 'utf-8')
+    if decimal_char != '.':
+        logging.error(
+            f'The pyarrow engine does not support decimal-char {decimal_char}.'
+        )
+        publish_error_to_sns(
+            s3_source_path,
+            f'\n\nError:\nThe pyarrow engine does not support decimal-char {decimal_char}. Use the pandas engine instead.'
+        )
+        raise ValueError(
+            f'The pyarrow engine does not support decimal-char {decimal_char}.'
+        )
+
+    compression = get_input_compression(s3_source_path, s3_object_meta)
+    local_path = get_local_copy(s3_source_path)
+    try:
+        header = _read_csv_header(s3_source_path, s3_object_meta, compression)
+        include_columns = _get_include_columns(s3_source_path, s3_object_meta,
+                                               header)
+        inferred_columns = _get_inferred_columns(include_columns or header,
+                                                 cast_schema)
+        if compression != 'none':
+            with open_decompressed_csv(s3_source_path,
+                                       compression) as source:
+                table = _arrow_read_csv(source, cast_schema,
+                                        inferred_columns, separator,
+                                        encoding, include_columns)
+        elif local_path is not None:
+            # the parser reads the blocks of the memory map without copying
+            # them and parses them on multiple threads
+            with pa.memory_map(local_path) as source:
+                table = _arrow_read_csv(source, cast_schema, inferred_columns,
+                                        separator, encoding, include_columns)
+        else:
+            with contextlib.closing(
+                    open_s3_object(s3_source_path)) as source:
+                table = _arrow_read_csv(source, cast_schema,
+                                        inferred_columns, separator,
+                                        encoding, include_columns)
+        table = _cast_table_dates(table, cast_schema)
+    except Exception as err:
+        logging.error(f'Failed to read csv {s3_source_path} on S3.')
+        publish_error_to_sns(s3_source_path, f'\n\nError:\n{err}')
+        raise err
 
-def _publish_to_sns(topic_arn, subject, message):
-    client = boto3.client('sns')
+    return table
+
+
+def _read_csv_arrow_local(cast_schema):
+    logging.info('Extracting csv file.')
     try:
-        client.publish(TopicArn=topic_arn, Message=message, Subject=subject)
+        with open(LOCAL_CSV_FILE_PATH, 'rb') as local_file:
+            header = _parse_csv_header(local_file.read(int(PREFLIGHT_BYTES)),
+                                       {})
+        table = _arrow_read_csv(LOCAL_CSV_FILE_PATH, cast_schema,
+                                _get_inferred_columns(header, cast_schema))
+        table = _cast_table_dates(table, cast_schema)
     except Exception as err:
-        logging.error(f'Unable to post to topic {topic_arn}.')
+        logging.error(f'Failed to read csv {LOCAL_CSV_FILE_PATH}.')
         raise err
 
+    return table
+
+
+# Returns the columns the csv parser must read, according to select-cols,
+# drop-cols and row-filter, or None to read every column. The parser only
+# takes column names, so they are picked from the header of the file.
+def _get_include_columns(s3_source_path, s3_object_meta, header):
+    schema_plan = get_schema_plan(s3_source_path, s3_object_meta)
+    if schema_plan.usecols is None or header is None:
+        return None
+    return [column for column in header if schema_plan.is_read(column)]
+
+
+# Returns the column names of the first line of the file, read from its local
+# copy or with a range GET, or None when the line is longer than
+# PREFLIGHT_BYTES.
+def _read_csv_header(s3_source_path, s3_object_meta, compression):
+    sample_size = int(PREFLIGHT_BYTES)
+    local_path = get_local_copy(s3_source_path)
+    if compression != 'none':
+        with open_decompressed_csv(s3_source_path, compression) as stream:
+            sample = stream.read(sample_size)
+    elif local_path is not None:
+        with open(local_path, 'rb') as local_file:
+            sample = local_file.read(sample_size)
+    else:
+        bucket_name, object_key = s3_source_path.replace('s3://', '',
+                                                         1).split('/', 1)
+        sample = _get_boto3_client('s3').get_object(
+            Bucket=bucket_name,
+            Key=object_key,
+            Range=f'bytes=0-{sample_size - 1}')['Body'].read()
+    return _parse_csv_header(sample, s3_object_meta)
+
+
+def _parse_csv_header(sample, s3_object_meta):
+    text = sample.decode(s3_object_meta.get('file-encoding', 'utf-8'),
+                         errors='ignore').lstrip('\ufeff')
+    lines = text.splitlines()
+    if not lines or (len(lines) == 1 and len(sample) >= int(PREFLIGHT_BYTES)):
+        return None
+    return next(
+        csv.reader([lines[0]], delimiter=s3_object_meta.get('separator',
+                                                            ',')))
+
+
+# Columns without custom-cast are read as strings and given the type the
+# pandas csv reader infers for them (see _infer_pandas_type), so both engines
+# write the same types. The arrow parser would read dates, times and
+# timestamps as such, where pandas keeps them as strings. Without a header
+# (first line longer than PREFLIGHT_BYTES), the parser infers the types and
+# its temporal columns are cast to strings.
+def _get_inferred_columns(columns, cast_schema):
+    if columns is None:
+        return None
+    return [column for column in columns if column not in cast_schema]
+
+
+# casts are applied by the csv parser itself, so no column is parsed twice.
+# Columns out of include_columns are skipped by the parser.
+def _arrow_read_csv(source,
+                    cast_schema,
+                    inferred_columns,
+                    separator=',',
+                    encoding='utf-8',
+                    include_columns=None):
+    column_types = {
+        column: ARROW_CAST_TYPES[data_type]()
+        for column, data_type in cast_schema.items()
+    }
+    for column in inferred_columns or []:
+        column_types[column] = pa.string()
+    table = pa_csv.read_csv(
+        source,
+        read_options=pa_csv.ReadOptions(encoding=encoding),
+        parse_options=pa_csv.ParseOptions(delimiter=separator),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=column_types,
+            include_columns=include_columns or [],
+            strings_can_be_null=True))
+
+    if inferred_columns is None:
+        inferred_columns = [
+            column_name for column_name in table.column_names
+            if column_name not in cast_schema
+        ]
+    for column_name in inferred_columns:
+        if column_name in table.column_names:
+            table = _set_table_column(
+                table, column_name,
+                _infer_pandas_type(table.column(column_name)))
+    return table
+
+
+# values the pandas csv reader parses as booleans
+PANDAS_TRUE_VALUES = ('True', 'TRUE', 'true')
+PANDAS_FALSE_VALUES = ('False', 'FALSE', 'false')
+
+
+# Converts a column read without custom-cast to the type the pandas csv
+# reader infers for it: int64 (float64 when it has nulls), float64, bool or
+# string. A column without any value is float64.
+def _infer_pandas_type(column):
+    if pa.types.is_temporal(column.type):
+        column = column.cast(pa.string())
+    if not pa.types.is_string(column.type):
+        return column
+    if column.null_count == len(column):
+        return column.cast(pa.float64())
+    for arrow_type in (pa.int64(), pa.float64()):
+        try:
+            converted = column.cast(arrow_type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            continue
+        if converted.null_count:
+            converted = converted.cast(pa.float64())
+        return converted
+
+    bool_values = pa.array(PANDAS_TRUE_VALUES + PANDAS_FALSE_VALUES)
+    if pc.all(pc.is_in(pc.drop_null(column), value_set=bool_values)).as_py():
+        return pc.if_else(
+            pc.is_valid(column),
+            pc.is_in(column, value_set=pa.array(PANDAS_TRUE_VALUES)),
+            pa.scalar(None, pa.bool_()))
+    return column
+
+
+def _cast_table_dates(table, cast_schema):
+    for column_name, data_type in cast_schema.items():
+        if data_type == 'date' and column_name in table.column_names:
+            table = _set_table_column(
+                table, column_name,
+                table.column(column_name).cast(pa.date32()))
+    return table
+
+
+def _set_table_column(table, column_name, column):
+    index = table.column_names.index(column_name)
+    return table.set_column(index, column_name, column)
+
+
+# applies every transformation step to an arrow table. Null values are
+# already kept as arrow nulls, so there is no NaN replacement step. Rows are
+# filtered before the columns are selected, as the row-filter columns may not
+# be selected.
+def transform_table(table, source_file_path, s3_object_meta):
+    table = filter_table_rows(table, source_file_path, s3_object_meta)
+    table = select_table_columns(table, source_file_path, s3_object_meta)
+    table = str_columns_to_categorical_arrow(table, source_file_path,
+                                             s3_object_meta)
+    table = str_columns_to_upper_arrow(table, s3_object_meta)
+    table = add_etl_metadata_to_table(table, source_file_path)
+    table = normalize_table_column_name(table,
+                                        schema_plan=get_schema_plan(
+                                            source_file_path, s3_object_meta),
+                                        source_file_path=source_file_path)
+    return table
+
+
+# row-filter operators applied to an arrow column
+ARROW_ROW_FILTER_OPERATORS = {
+    '==':
+    lambda column, value: pc.equal(column, value),
+    '!=':
+    lambda column, value: pc.not_equal(column, value),
+    '<':
+    lambda column, value: pc.less(column, value),
+    '<=':
+    lambda column, value: pc.less_equal(column, value),
+    '>':
+    lambda column, value: pc.greater(column, value),
+    '>=':
+    lambda column, value: pc.greater_equal(column, value),
+    'in':
+    lambda column, value: pc.is_in(column, value_set=value),
+    'not in':
+    lambda column, value: pc.invert(pc.is_in(column, value_set=value))
+}
+
+
+# applies select-cols and drop-cols to an arrow table
+@measure_stage()
+def select_table_columns(table, source_file_path, s3_object_meta):
+    schema_plan = get_schema_plan(source_file_path, s3_object_meta)
+    if schema_plan.usecols is not None:
+        table = table.select([
+            column for column in table.column_names
+            if schema_plan.is_selected(column)
+        ])
+    return table
+
+
+@measure_stage()
+def filter_table_rows(table, source_file_path, s3_object_meta):
+    row_filter = get_schema_plan(source_file_path, s3_object_meta).row_filter
+    if row_filter:
+        logging.info(f'Filtering rows: {row_filter}')
+        try:
+            mask = None
+            for column_name, operator_name, value in row_filter:
+                column = table.column(column_name)
+                condition = ARROW_ROW_FILTER_OPERATORS[operator_name](
+                    column, _cast_filter_value(value, column.type))
+                mask = condition if mask is None else pc.and_(mask, condition)
+            table = table.filter(mask)
+        except Exception as err:
+            logging.error(f'Could not apply row-filter {row_filter}.')
+            publish_error_to_sns(source_file_path, f'\n\nError:\n{err}')
+            raise err
+        logging.info(f'{table.num_rows} rows left after filtering.')
+    return table
+
+
+# The columns are already casted by the csv parser, so the string values of
+# the row-filter are casted to the type of the column, e.g. "2020-05-01" to a
+# date. Other values are compared as they are.
+def _cast_filter_value(value, data_type):
+    if isinstance(value, (list, tuple, set)):
+        values = pa.array(list(value))
+        if pa.types.is_string(values.type):
+            return values.cast(data_type)
+        return values
+    if isinstance(value, str):
+        return pa.scalar(value).cast(data_type)
+    return value
+
+
+# dictionary encodes the low cardinality string columns, as
+# str_columns_to_categorical does for the pandas engine
+@measure_stage()
+def str_columns_to_categorical_arrow(table, source_file_path, s3_object_meta):
+    columns = get_categorical_columns(
+        source_file_path=source_file_path,
+        s3_object_meta=s3_object_meta,
+        columns=table.column_names,
+        str_columns=[
+            field.name for field in table.schema
+            if pa.types.is_string(field.type)
+        ],
+        is_low_cardinality=lambda column, threshold:
+        _is_low_cardinality_arrow(table.column(column), threshold))
+    str_columns = {
+        field.name
+        for field in table.schema if pa.types.is_string(field.type)
+    }
+    columns = [column for column in columns if column in str_columns]
+    if columns:
+        logging.info(f'Converting columns to dictionary: {columns}')
+        for column in columns:
+            table = _set_table_column(table, column,
+                                      table.column(column).dictionary_encode())
+    return table
+
+
+def _is_low_cardinality_arrow(column, threshold):
+    if threshold <= 0:
+        return False
+    sample = column.slice(0, CATEGORICAL_SAMPLE_SIZE)
+    return len(pc.unique(sample)) <= threshold * len(sample)
+
+
+# upper is applied to the dictionary of dictionary encoded columns, once per
+# distinct value
+@measure_stage()
+def str_columns_to_upper_arrow(table, s3_object_meta):
+    output_str_upper = s3_object_meta.get('output-str-upper', 'true').lower()
+    if output_str_upper == 'true':
+        logging.info('Applying upper to string columns.')
+        for field in table.schema:
+            if pa.types.is_string(field.type):
+                table = _set_table_column(table, field.name,
+                                          utf8_upper(table.column(field.name)))
+            elif pa.types.is_dictionary(field.type) and pa.types.is_string(
+                    field.type.value_type):
+                table = _set_table_column(
+                    table, field.name,
+                    _dictionary_column_to_upper(table.column(field.name)))
+    return table
+
+
+def _dictionary_column_to_upper(column):
+    chunks = [
+        pa.DictionaryArray.from_arrays(chunk.indices,
+                                       utf8_upper(chunk.dictionary))
+        for chunk in column.chunks
+    ]
+    return pa.chunked_array(chunks, type=column.type)
+
+
+@measure_stage()
+def add_etl_metadata_to_table(table, source_file_path):
+    logging.info('Adding ETL metadata.')
+    # the same value on every row, without building a list of num_rows values
+    table = table.append_column(
+        'dl_creation_date',
+        pa.repeat(pa.scalar(datetime.today().date(), pa.date32()),
+                  table.num_rows))
+    table = table.append_column(
+        'dl_source_file',
+        pa.repeat(pa.scalar(source_file_path, pa.string()), table.num_rows))
+    return table
+
+
+@measure_stage()
+def normalize_table_column_name(table, schema_plan, source_file_path):
+    logging.info('Normalizing column names.')
+    return table.rename_columns(
+        _get_normalized_column_names(table.column_names, schema_plan,
+                                     source_file_path))
+
+
+def build_sns_topic_arn(context):
+    if _is_cloud_execution_mode():
+        global SNS_TOPIC_ARN
+        lambda_arn_splitted = context.invoked_function_arn.split(":")
+        aws_region = lambda_arn_splitted[3]
+        aws_account_id = lambda_arn_splitted[4]
+        SNS_TOPIC_ARN = f'arn:aws:sns:{aws_region}:{aws_account_id}:{SNS_TOPIC_NAME}'
 
+
+# Notifications are queued and published in batches off the thread that
+# loads the file (see notifications.py)
+def publish_success_to_sns(s3_object):
+    notifier = _get_notifier()
+    if notifier is not None:
+        notifier.notify_success(s3_object['object_path'],
+                                s3_object['target_table'])
+
+
+# Errors of the same table with the same message are sent as a single
+# notification
+def publish_error_to_sns(file_path, exception_message):
+    notifier = _get_notifier()
+    if notifier is not None:
+        object_key = file_path.replace('s3://', '', 1).split('/', 1)[-1]
+        notifier.notify_error(file_path, get_target_table(object_key),
+                              exception_message)
+
+
+# publishes the queued notifications, waiting for them to be sent
+def flush_notifications():
+    if NOTIFIER is not None:
+        NOTIFIER.flush()
+
+
+# no topic is set when the pipeline is not run by the handler, e.g. by
+# backfill.py, so nothing is published
+def _get_notifier():
+    global NOTIFIER
+    if not _is_cloud_execution_mode() or not SNS_TOPIC_ARN:
+        return None
+    if NOTIFIER is None:
+        client = _get_boto3_client('sns')
+        with BOTO3_CLIENT_LOCK:
+            if NOTIFIER is None:
+                NOTIFIER = SnsNotifier(
+                    client,
+                    SNS_TOPIC_ARN,
+                    window_seconds=float(NOTIFICATION_WINDOW_SECONDS))
+    return NOTIFIER
+
+
+@measure_stage()
 def save_as_parquet(dataframe,
                     s3_object,
                     s3_object_meta,
                     partition_cols,
                     event,
-                    compression='snappy'):
+                    compression=None,
+                    output_mode=None):
     if _is_cloud_execution_mode():
-        _save_to_s3_as_parquet(dataframe=dataframe,
-                               table_name=s3_object['target_table'],
-                               partition_cols=partition_cols,
-                               compression=compression,
-                               source_file_path=s3_object['object_path'],
-                               s3_object_meta=s3_object_meta)
+        schema_plan = get_schema_plan(s3_object['object_path'], s3_object_meta)
+        return _save_to_s3_as_parquet(
+            table=dataframe_to_table(dataframe, schema_plan.output_dtypes),
+            table_name=s3_object['target_table'],
+            partition_cols=partition_cols,
+            compression=compression,
+            source_file_path=s3_object['object_path'],
+            s3_object_meta=s3_object_meta,
+            output_mode=output_mode)
     elif _is_local_execution_mode():
         _save_to_local_as_parquet(dataframe=dataframe,
                                   output_path=event.get('output_path'),
                                   partition_cols=event.get('partition_cols'),
-                                  compression=compression)
-
-
-# saves dataframe to s3, creates glue table if not exists and updates glue table's partitions
-def _save_to_s3_as_parquet(dataframe, table_name, partition_cols, compression,
-                           source_file_path, s3_object_meta):
+                                  compression=compression or 'snappy')
+        return []
+
+
+# Saves the arrow table to s3, creates glue table if not exists and updates
+# glue table's partitions. Returns the paths of the written files.
+# The files are written by dataset_writer.py instead of awswrangler.
+def _save_to_s3_as_parquet(table,
+                           table_name,
+                           partition_cols,
+                           compression,
+                           source_file_path,
+                           s3_object_meta,
+                           output_mode=None):
     logging.info('Saving dataframe to s3.')
 
     dest_path = f's3://{TARGET_S3_BUCKET}/databases/{TARGET_GLUE_DATABASE}/{table_name}/'
-    compression = s3_object_meta.get('output-compression', compression)
-    output_mode = s3_object_meta.get('output-mode', 'overwrite_partitions')
+    if output_mode is None:
+        output_mode = s3_object_meta.get('output-mode', 'overwrite_partitions')
+    partition_cols = list(partition_cols or [])
 
     try:
-        wr.s3.to_parquet(df=dataframe,
-                         path=dest_path,
-                         compression=compression,
-                         dataset=True,
-                         partition_cols=partition_cols,
-                         mode=output_mode,
-                         database=TARGET_GLUE_DATABASE,
-                         table=table_name)
+        # the table is recreated on overwrite, so its schema does not matter
+        if output_mode != 'overwrite':
+            table = conform_table_to_glue_schema(
+                table=table,
+                table_name=table_name,
+                partition_cols=partition_cols,
+                policy=s3_object_meta.get('schema-policy',
+                                          SCHEMA_POLICY).lower())
+        writer_profile = get_writer_profile(
+            table_name=table_name,
+            source_file_path=source_file_path,
+            s3_object_meta=s3_object_meta,
+            table=drop_columns(table, partition_cols),
+            compression=compression)
+        paths, partitions_values = write_parquet_dataset(
+            table=table,
+            dest_path=dest_path,
+            partition_cols=partition_cols,
+            writer_profile=writer_profile,
+            output_mode=output_mode)
+        _update_glue_table(table_name=table_name,
+                           dest_path=dest_path,
+                           schema=table.schema,
+                           partition_cols=partition_cols,
+                           partitions_values=partitions_values,
+                           compression=writer_profile['compression'],
+                           output_mode=output_mode)
     except Exception as err:
         logging.error(f'Failed to save to S3 on {dest_path}.')
+        # the table may have been changed by someone else meanwhile
+        if GLUE_CATALOG is not None:
+            GLUE_CATALOG.invalidate(table_name)
         publish_error_to_sns(source_file_path, f'\n\nError:\n{err}')
         raise err
     logging.info(
         f'Successfully saved dataframe to s3 on {dest_path}. You can query the data on Athena using: select * from {TARGET_GLUE_DATABASE}.{table_name} limit 10;'
     )
+    return paths
 
 
 def _save_to_local_as_parquet(dataframe, output_path, partition_cols,
@@ -425,6 +2146,346 @@ def _save_to_local_as_parquet(dataframe, output_path, partition_cols,
     logging.info('Parquet files saved successfully.')
 
 
+@measure_stage()
+def save_table_as_parquet(table,
+                          s3_object,
+                          s3_object_meta,
+                          partition_cols,
+                          event,
+                          compression=None):
+    if _is_cloud_execution_mode():
+        return _save_to_s3_as_parquet(
+            table=table,
+            table_name=s3_object['target_table'],
+            partition_cols=partition_cols,
+            compression=compression,
+            source_file_path=s3_object['object_path'],
+            s3_object_meta=s3_object_meta)
+    elif _is_local_execution_mode():
+        output_path = event.get('output_path')
+        logging.info(f'Saving parquet files locally on: {output_path}')
+        pq.write_to_dataset(
+            table,
+            root_path=output_path,
+            partition_cols=[_normalize_name(event.get('partition_cols'))],
+            compression=compression or 'snappy')
+        logging.info('Parquet files saved successfully.')
+        return []
+
+
+# PARQUET WRITER
+
+PARQUET_COMPRESSIONS = ('snappy', 'gzip', 'zstd', 'none', 'auto')
+# codecs and levels tried by auto compression, cheapest first
+COMPRESSION_CANDIDATES = (('snappy', None), ('zstd', 1), ('zstd', 3),
+                          ('zstd', 9), ('gzip', None))
+# arrow type of each athena type written by the lambda, but decimals
+ATHENA_ARROW_TYPES = {
+    'boolean': lambda: pa.bool_(),
+    'tinyint': lambda: pa.int8(),
+    'smallint': lambda: pa.int16(),
+    'int': lambda: pa.int32(),
+    'bigint': lambda: pa.int64(),
+    'float': lambda: pa.float32(),
+    'double': lambda: pa.float64(),
+    'date': lambda: pa.date32(),
+    'timestamp': lambda: pa.timestamp('ms'),
+    'binary': lambda: pa.binary(),
+    'string': lambda: pa.string()
+}
+
+
+# converts a transformed dataframe to an arrow table. Date columns are
+# datetime64 on pandas and are only written as dates.
+def dataframe_to_table(dataframe, output_dtypes):
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    for column_name, data_type in output_dtypes.items():
+        if data_type == 'date' and column_name in table.column_names:
+            table = _set_table_column(
+                table, column_name,
+                pc.cast(table.column(column_name), pa.date32(), safe=False))
+    return table
+
+
+# Returns the keyword arguments of pq.write_table for a table. Compression is
+# either set by output-compression (or OUTPUT_COMPRESSION), or picked by auto
+# once per target table, using the first data written to it as sample.
+def get_writer_profile(table_name,
+                       source_file_path,
+                       s3_object_meta,
+                       table,
+                       compression=None):
+    try:
+        writer_profile = _parse_writer_profile(s3_object_meta, compression)
+    except ValueError as err:
+        logging.error(f'{err} Object: {source_file_path}.')
+        publish_error_to_sns(source_file_path, f'\n\nError:\n{err}')
+        raise err
+
+    if writer_profile['compression'] == 'auto':
+        # zstd-level and dictionary-cols still override the picked values
+        auto_compression = _get_auto_compression(table_name, table)
+        writer_profile['compression'] = auto_compression['compression']
+        for argument, value in auto_compression.items():
+            writer_profile.setdefault(argument, value)
+    if writer_profile['compression'] != 'zstd':
+        writer_profile.pop('compression_level', None)
+    logging.info(f'Parquet writer profile: {writer_profile}')
+    return writer_profile
+
+
+def _parse_writer_profile(s3_object_meta, compression=None):
+    if compression is None:
+        compression = OUTPUT_COMPRESSION
+    compression = s3_object_meta.get('output-compression', compression).lower()
+    if compression not in PARQUET_COMPRESSIONS:
+        raise ValueError(
+            f'Invalid output-compression {compression}. Expected either snappy, gzip, zstd, none or auto.'
+        )
+    writer_profile = {
+        'compression': None if compression == 'none' else compression,
+        # timestamps as written by awswrangler, which athena can read
+        'coerce_timestamps': 'ms',
+        'allow_truncated_timestamps': True,
+        'flavor': 'spark'
+    }
+
+    for metadata_key, argument in (('zstd-level', 'compression_level'),
+                                   ('row-group-size', 'row_group_size')):
+        value = s3_object_meta.get(metadata_key)
+        if value is None:
+            continue
+        if not value.isdigit() or int(value) < 1:
+            raise ValueError(
+                f'Invalid {metadata_key} metadata. Please specify a positive integer.'
+            )
+        writer_profile[argument] = int(value)
+
+    dictionary_cols = _parse_column_list(s3_object_meta.get('dictionary-cols'),
+                                         'dictionary-cols')
+    if dictionary_cols is not None:
+        writer_profile['use_dictionary'] = [
+            _normalize_name(column_name) for column_name in dictionary_cols
+        ]
+    return writer_profile
+
+
+def _get_auto_compression(table_name, table):
+    with WRITER_LOCK:
+        auto_compression = WRITER_PROFILES.get(table_name)
+    if auto_compression is None:
+        auto_compression = choose_compression(
+            table.slice(0, COMPRESSION_SAMPLE_ROWS),
+            float(COMPRESSION_CPU_BUDGET_MS_PER_MB))
+        logging.info(
+            f'Picked compression {auto_compression} for table {table_name}.')
+        with WRITER_LOCK:
+            WRITER_PROFILES[table_name] = auto_compression
+    return auto_compression
+
+
+# Compresses the sample with each candidate codec, with and without
+# dictionary encoding, and returns the one with the smallest output among
+# those whose cpu time is within the budget. Snappy is always allowed.
+def choose_compression(sample, cpu_budget_ms_per_mb):
+    sample_mb = max(sample.nbytes / 1024 / 1024, 1e-6)
+    best_compression, best_size = None, None
+    for codec, level in COMPRESSION_CANDIDATES:
+        for use_dictionary in (True, False):
+            cpu_ms, size = _measure_compression(sample, codec, level,
+                                                use_dictionary)
+            if codec != 'snappy' and cpu_ms / sample_mb > cpu_budget_ms_per_mb:
+                # dictionary encoding makes the codec compress less data, so
+                # the codec is not tried without it
+                break
+            if best_size is None or size < best_size:
+                best_size = size
+                best_compression = {
+                    'compression': codec,
+                    'use_dictionary': use_dictionary
+                }
+                if level is not None:
+                    best_compression['compression_level'] = level
+    return best_compression
+
+
+# returns the cpu time, in ms, and the size, in bytes, of the sample as parquet
+def _measure_compression(sample, codec, level, use_dictionary):
+    sink = pa.BufferOutputStream()
+    start_cpu_time = cpu_time()
+    pq.write_table(sample,
+                   sink,
+                   compression=codec,
+                   compression_level=level,
+                   use_dictionary=use_dictionary)
+    return (cpu_time() - start_cpu_time) * 1000, sink.getvalue().size
+
+
+# uses the given filesystem for every path of the bucket, e.g. one of an s3
+# compatible endpoint
+def register_arrow_filesystem(bucket_name, filesystem):
+    with WRITER_LOCK:
+        ARROW_FILESYSTEMS[('s3:', '', bucket_name)] = filesystem
+
+
+def _get_arrow_filesystem(path):
+    bucket_uri = path.split('/', 3)[:3]
+    with WRITER_LOCK:
+        filesystem = ARROW_FILESYSTEMS.get(tuple(bucket_uri))
+        if filesystem is None:
+            filesystem = pa_fs.FileSystem.from_uri('/'.join(bucket_uri))[0]
+            ARROW_FILESYSTEMS[tuple(bucket_uri)] = filesystem
+    return filesystem, path.split('://', 1)[-1].rstrip('/')
+
+
+# Writes the table as a hive partitioned parquet dataset (see
+# dataset_writer.py). Returns the written paths and the values of each written
+# partition path.
+def write_parquet_dataset(table, dest_path, partition_cols, writer_profile,
+                          output_mode):
+    filesystem, root_path = _get_arrow_filesystem(dest_path)
+    paths, partitions_values = write_dataset(
+        table=table,
+        filesystem=filesystem,
+        root_path=root_path,
+        partition_cols=partition_cols,
+        writer_profile=writer_profile,
+        output_mode=output_mode,
+        max_workers=int(WRITER_CONCURRENCY))
+    return [dest_path + path for path in paths], {
+        f'{dest_path}{partition_dir}/': partition_values
+        for partition_dir, partition_values in partitions_values.items()
+    }
+
+
+# arrow type of an athena type, the reverse of get_athena_type
+def get_arrow_type(athena_type):
+    if athena_type in ATHENA_ARROW_TYPES:
+        return ATHENA_ARROW_TYPES[athena_type]()
+    if athena_type.startswith('decimal('):
+        precision, scale = athena_type[len('decimal('):-1].split(',')
+        return pa.decimal128(int(precision), int(scale))
+    raise ValueError(f'Unsupported athena type {athena_type}.')
+
+
+# athena type of an arrow type, as registered on the glue catalog
+def get_athena_type(arrow_type):
+    if pa.types.is_dictionary(arrow_type):
+        return get_athena_type(arrow_type.value_type)
+    if pa.types.is_boolean(arrow_type):
+        return 'boolean'
+    if pa.types.is_int8(arrow_type):
+        return 'tinyint'
+    if pa.types.is_int16(arrow_type):
+        return 'smallint'
+    if pa.types.is_int32(arrow_type):
+        return 'int'
+    if pa.types.is_integer(arrow_type):
+        return 'bigint'
+    if pa.types.is_float32(arrow_type):
+        return 'float'
+    if pa.types.is_floating(arrow_type):
+        return 'double'
+    if pa.types.is_decimal(arrow_type):
+        return f'decimal({arrow_type.precision},{arrow_type.scale})'
+    if pa.types.is_date(arrow_type):
+        return 'date'
+    if pa.types.is_timestamp(arrow_type):
+        return 'timestamp'
+    if pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type):
+        return 'binary'
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(
+            arrow_type) or pa.types.is_null(arrow_type):
+        return 'string'
+    raise ValueError(f'Unsupported data type {arrow_type}.')
+
+
+# athena types of the columns and partition columns of an arrow schema
+def get_glue_types(schema, partition_cols):
+    columns_types = {
+        field.name: get_athena_type(field.type)
+        for field in schema if field.name not in partition_cols
+    }
+    partitions_types = {
+        column_name: get_athena_type(schema.field(column_name).type)
+        for column_name in partition_cols
+    }
+    return columns_types, partitions_types
+
+
+# Checks the schema of the table against the cached schema of its glue table
+# before anything is written, so a file that does not fit the table fails
+# before being uploaded. With the coerce policy, the retyped columns are cast
+# to the type of the glue table and the new columns are dropped.
+@measure_stage()
+def conform_table_to_glue_schema(table, table_name, partition_cols, policy):
+    glue_catalog = _get_glue_catalog()
+    snapshot = glue_catalog.get_snapshot(table_name)
+    if snapshot is not None:
+        # columns without any value have no type of their own
+        table_types = dict(snapshot['columns_types'],
+                           **snapshot['partitions_types'])
+        for field in table.schema:
+            if pa.types.is_null(field.type) and field.name in table_types:
+                table = table.set_column(
+                    table.schema.get_field_index(field.name), field.name,
+                    table.column(field.name).cast(
+                        get_arrow_type(table_types[field.name])))
+
+    columns_types, partitions_types = get_glue_types(table.schema,
+                                                     partition_cols)
+    casts, dropped_columns = glue_catalog.check_schema(
+        table_name=table_name,
+        columns_types=columns_types,
+        partitions_types=partitions_types,
+        policy=policy)
+    if dropped_columns:
+        logging.warning(
+            f'Dropping columns {dropped_columns}, which are not on glue table {table_name}.'
+        )
+        table = drop_columns(table, dropped_columns)
+    for column_name, athena_type in casts.items():
+        logging.warning(
+            f'Casting column {column_name} to {athena_type}, its type on glue table {table_name}.'
+        )
+        table = table.set_column(
+            table.schema.get_field_index(column_name), column_name,
+            table.column(column_name).cast(get_arrow_type(athena_type)))
+    return table
+
+
+def _get_glue_catalog():
+    global GLUE_CATALOG
+    if GLUE_CATALOG is None:
+        client = _get_boto3_client('glue')
+        with BOTO3_CLIENT_LOCK:
+            if GLUE_CATALOG is None:
+                GLUE_CATALOG = GlueCatalog(
+                    client, TARGET_GLUE_DATABASE,
+                    snapshot_ttl_seconds=int(GLUE_SNAPSHOT_TTL_SECONDS))
+    return GLUE_CATALOG
+
+
+# Creates the glue table, or adds the new columns to it, and registers the
+# written partitions. Glue is only called when the table snapshot shows that
+# the columns changed or that a partition is new, and the new partitions of
+# the whole file (or chunk) are sent in batches.
+def _update_glue_table(table_name, dest_path, schema, partition_cols,
+                       partitions_values, compression, output_mode):
+    columns_types, partitions_types = get_glue_types(schema, partition_cols)
+    glue_catalog = _get_glue_catalog()
+    glue_catalog.sync_table(table_name=table_name,
+                            path=dest_path,
+                            columns_types=columns_types,
+                            partitions_types=partitions_types,
+                            compression=compression,
+                            overwrite=output_mode == 'overwrite')
+    if partitions_values:
+        glue_catalog.add_partitions(table_name=table_name,
+                                    partitions_values=partitions_values,
+                                    compression=compression)
+
+
 # run test
 if __name__ == '__main__':
     # test event for running locally
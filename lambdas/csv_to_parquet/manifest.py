@@ -0,0 +1,111 @@
+'''
+    About: Manifest of the files already loaded by the csv_to_parquet lambda.
+           S3 delivers events at least once, so the same file may be received
+           more than once. Each loaded file is recorded by its key, ETag and
+           size, which lets a redelivered event be skipped without reading it.
+'''
+
+import json
+import logging
+import sqlite3
+import threading
+
+
+# returns the manifest id of an s3 object. A new version of the same key has
+# a different ETag, so it is loaded again.
+def build_manifest_id(object_path, etag, size):
+    return f'{object_path}|{str(etag).strip(chr(34))}|{size}'
+
+
+# Manifest stored as a json file. Meant for local runs and tests.
+class JsonManifest:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as manifest_file:
+                self._records = json.load(manifest_file)
+        except FileNotFoundError:
+            self._records = {}
+
+    def get(self, manifest_id):
+        with self._lock:
+            return self._records.get(manifest_id)
+
+    def put(self, manifest_id, record):
+        with self._lock:
+            self._records[manifest_id] = record
+            with open(self.path, 'w') as manifest_file:
+                json.dump(self._records, manifest_file)
+
+
+# Manifest stored on a local sqlite database. Meant for local runs and tests.
+class SqliteManifest:
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS manifest (manifest_id TEXT PRIMARY KEY, record TEXT)'
+            )
+
+    def get(self, manifest_id):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT record FROM manifest WHERE manifest_id = ?',
+                (manifest_id, )).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, manifest_id, record):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO manifest (manifest_id, record) VALUES (?, ?)',
+                (manifest_id, json.dumps(record)))
+
+
+# Manifest stored on a DynamoDB table whose partition key is "manifest_id".
+# Any DynamoDB compatible endpoint can be used through the boto3 client.
+class DynamoDBManifest:
+
+    def __init__(self, client, table_name):
+        self._client = client
+        self.table_name = table_name
+
+    def get(self, manifest_id):
+        response = self._client.get_item(
+            TableName=self.table_name,
+            Key={'manifest_id': {
+                'S': manifest_id
+            }},
+            ConsistentRead=True)
+        item = response.get('Item')
+        return json.loads(item['record']['S']) if item else None
+
+    def put(self, manifest_id, record):
+        self._client.put_item(TableName=self.table_name,
+                              Item={
+                                  'manifest_id': {
+                                      'S': manifest_id
+                                  },
+                                  'record': {
+                                      'S': json.dumps(record)
+                                  }
+                              })
+
+
+# creates the manifest of the given backend. Returns None when disabled.
+def create_manifest(backend, path=None, table_name=None, client=None):
+    if backend == 'json':
+        return JsonManifest(path)
+    elif backend == 'sqlite':
+        return SqliteManifest(path)
+    elif backend == 'dynamodb':
+        return DynamoDBManifest(client, table_name)
+    elif backend in ('', 'none', None):
+        return None
+    logging.error(f'Invalid manifest backend {backend}.')
+    raise ValueError(
+        f'Invalid manifest backend {backend}. Expected either none, json, sqlite or dynamodb.'
+    )
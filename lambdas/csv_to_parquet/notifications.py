@@ -0,0 +1,163 @@
+'''
+    About: Sns notifications of the csv_to_parquet lambda.
+           Notifications are queued instead of being published by the thread
+           that loads the file. A background thread publishes them every
+           window_seconds with PublishBatch, up to 10 messages per request,
+           and the handler flushes the rest before it returns.
+           Errors of the same table with the same error message queued in
+           the same window are sent as a single message listing every file,
+           so a burst of bad files does not flood the subscribers.
+           Every publish goes through the given boto3 sns client, so it can
+           be replaced by a fake one.
+'''
+
+import logging
+import threading
+
+# maximum number of messages of a PublishBatch request
+PUBLISH_BATCH_SIZE = 10
+# a PublishBatch request holds up to 256 KB, so each message of a full batch
+# is cut to a tenth of it
+MAX_MESSAGE_BYTES = 25 * 1024
+MAX_SUBJECT_LENGTH = 100
+# number of files listed on an aggregated error message
+MAX_LISTED_FILES = 50
+
+
+class SnsNotifier:
+
+    def __init__(self, client, topic_arn, window_seconds):
+        self._client = client
+        self.topic_arn = topic_arn
+        self.window_seconds = window_seconds
+        self._successes = []
+        # files of each (table, error message), in the order they failed
+        self._errors = {}
+        self._lock = threading.Lock()
+        # held while publishing, so flush waits for the background thread
+        self._publish_lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._thread = None
+
+    def notify_success(self, file_path, table_name):
+        file_name = file_path.rsplit(sep='/', maxsplit=1)[1]
+        with self._lock:
+            self._successes.append((
+                f'SUCCESS - {file_name} - Csv to parquet succeeded.',
+                f'The file {file_path} was loaded successfully into S3 Analytics and is accessible via Athena on table {table_name}.'
+            ))
+            full_batch = len(self._successes) >= PUBLISH_BATCH_SIZE
+        self._start_thread(wake_up=full_batch)
+
+    def notify_error(self, file_path, table_name, exception_message):
+        with self._lock:
+            file_paths = self._errors.setdefault(
+                (table_name, exception_message), [])
+            if file_path not in file_paths:
+                file_paths.append(file_path)
+        self._start_thread()
+
+    # Publishes every queued notification. Returns once they are published,
+    # including the ones being published by the background thread.
+    def flush(self):
+        with self._publish_lock:
+            with self._lock:
+                messages = self._successes + [
+                    _build_error_message(table_name, file_paths,
+                                         exception_message)
+                    for (table_name, exception_message
+                         ), file_paths in self._errors.items()
+                ]
+                self._successes = []
+                self._errors = {}
+            for start in range(0, len(messages), PUBLISH_BATCH_SIZE):
+                end = start + PUBLISH_BATCH_SIZE
+                self._publish_batch(messages[start:end])
+
+    # The thread is started by the first notification. With a window of 0,
+    # notifications are only published by flush.
+    def _start_thread(self, wake_up=False):
+        if self.window_seconds <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='sns-notifier',
+                                                daemon=True)
+                self._thread.start()
+        if wake_up:
+            self._wake_up.set()
+
+    def _run(self):
+        while True:
+            self._wake_up.wait(self.window_seconds)
+            self._wake_up.clear()
+            try:
+                self.flush()
+            except Exception:
+                logging.exception('Failed to publish notifications.')
+
+    # Failed notifications are logged, not raised, since they must not fail
+    # the load of the files. boto3 versions older than 1.20 have no
+    # publish_batch, so each message is published on its own request.
+    def _publish_batch(self, messages):
+        logging.info(
+            f'Publishing {len(messages)} notifications to {self.topic_arn}')
+        if not hasattr(self._client, 'publish_batch'):
+            for subject, message in messages:
+                self._publish(subject, message)
+            return
+        try:
+            response = self._client.publish_batch(
+                TopicArn=self.topic_arn,
+                PublishBatchRequestEntries=[{
+                    'Id': str(index),
+                    'Subject': _truncate(subject, MAX_SUBJECT_LENGTH),
+                    'Message': _truncate_bytes(message, MAX_MESSAGE_BYTES)
+                } for index, (subject, message) in enumerate(messages)])
+        except Exception:
+            logging.exception(f'Unable to post to topic {self.topic_arn}.')
+            return
+        for failed in response.get('Failed', []):
+            logging.error(
+                f'Unable to post {messages[int(failed["Id"])][0]} to topic {self.topic_arn}: {failed.get("Message")}'
+            )
+
+    def _publish(self, subject, message):
+        try:
+            self._client.publish(TopicArn=self.topic_arn,
+                                 Subject=_truncate(subject,
+                                                   MAX_SUBJECT_LENGTH),
+                                 Message=message)
+        except Exception:
+            logging.exception(f'Unable to post to topic {self.topic_arn}.')
+
+
+def _build_error_message(table_name, file_paths, exception_message):
+    if len(file_paths) == 1:
+        file_name = file_paths[0].rsplit(sep='/', maxsplit=1)[1]
+        return (
+            f'ERROR - {file_name} - Csv to parquet failed.',
+            f'The file {file_paths[0]} could not be loaded into S3 Analytics. Please check the logs for more details.\n\n {exception_message}'
+        )
+
+    listed_files = '\n'.join(file_paths[:MAX_LISTED_FILES])
+    if len(file_paths) > MAX_LISTED_FILES:
+        listed_files += f'\n... and {len(file_paths) - MAX_LISTED_FILES} more files.'
+    return (
+        f'ERROR - {table_name} - {len(file_paths)} files failed to load.',
+        f'The following files of table {table_name} could not be loaded into S3 Analytics with the same error. Please check the logs for more details.\n\n{listed_files}\n\n {exception_message}'
+    )
+
+
+def _truncate(text, max_length):
+    if len(text) <= max_length:
+        return text
+    return text[:max_length - 3] + '...'
+
+
+def _truncate_bytes(text, max_bytes):
+    encoded = text.encode('utf-8')
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes - 3].decode('utf-8', errors='ignore') + '...'
@@ -0,0 +1,119 @@
+'''
+    About: Pre-flight check of the csv files of the csv_to_parquet lambda.
+           Only the first bytes of a file are inspected to find its encoding,
+           separator, decimal character and header, so a file that does not
+           match its metadata can be rejected or corrected before it is
+           downloaded and parsed as a whole.
+'''
+
+import codecs
+import csv
+import io
+import re
+
+# separators looked for when the configured one does not split the header
+SNIFFED_SEPARATORS = ',;\t|'
+# number of lines of the sample used to sniff the separator and decimal char
+SNIFFED_LINES = 50
+# encodings tried, in order, when the sample does not decode with the
+# configured one. latin-1 decodes any byte, so it is the last resort.
+FALLBACK_ENCODINGS = ('utf-8', 'cp1252', 'latin-1')
+# byte order marks of the encodings that pandas does not detect by itself.
+# utf-32 goes first, since its little endian BOM starts with the utf-16 one.
+BYTE_ORDER_MARKS = ((codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE,
+                                                      'utf-32'),
+                    (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE,
+                                                      'utf-16'))
+
+COMMA_DECIMAL_REGEX = re.compile(r'^[-+]?\d+,\d+$')
+DOT_DECIMAL_REGEX = re.compile(r'^[-+]?\d*\.\d+$')
+
+
+# Sniffs the first bytes of a csv file. truncated tells whether the file
+# continues after the sample, so its last line may be incomplete. Returns the
+# file-encoding, separator and decimal-char the file looks like it uses, with
+# the configured values kept whenever they fit the sample, and its header.
+def sniff_csv(sample, truncated, separator, decimal_char, encoding):
+    encoding = sniff_encoding(sample, truncated, encoding)
+    text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(
+        sample, final=not truncated)
+    lines = _split_lines(text.lstrip('\ufeff'), truncated)[:SNIFFED_LINES]
+    separator = sniff_separator(lines, separator)
+    rows = _parse_rows(lines, separator)
+    return {
+        'file-encoding': encoding,
+        'separator': separator,
+        'decimal-char': sniff_decimal_char(rows[1:], separator, decimal_char),
+        'header': rows[0] if rows else []
+    }
+
+
+# returns the configured encoding if the sample decodes with it, otherwise the
+# encoding of its byte order mark or the first fallback encoding that decodes it.
+# Raises LookupError if the configured encoding does not exist.
+def sniff_encoding(sample, truncated, encoding):
+    codecs.lookup(encoding)
+    for byte_order_mark, bom_encoding in BYTE_ORDER_MARKS:
+        if sample.startswith(byte_order_mark):
+            if codecs.lookup(encoding).name.startswith(bom_encoding):
+                return encoding
+            return bom_encoding
+
+    for candidate in (encoding, ) + FALLBACK_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(candidate)().decode(
+                sample, final=not truncated)
+            return candidate
+        except UnicodeDecodeError:
+            continue
+
+
+# returns the configured separator if it splits the header, otherwise the
+# separator found by csv.Sniffer, if any. Regex separators are not checked.
+def sniff_separator(lines, separator):
+    if len(separator) != 1 or not lines:
+        return separator
+    if len(_parse_rows(lines[:1], separator)[0]) > 1:
+        return separator
+    try:
+        return csv.Sniffer().sniff('\n'.join(lines),
+                                   delimiters=SNIFFED_SEPARATORS).delimiter
+    except csv.Error:
+        return separator
+
+
+# Returns the decimal char of the numbers of the sample if all of them use the
+# same one, otherwise the configured decimal char. Numbers cannot use a comma
+# as decimal char when it is also the separator.
+def sniff_decimal_char(rows, separator, decimal_char):
+    if separator == ',':
+        return decimal_char
+
+    comma_decimals = dot_decimals = 0
+    for row in rows:
+        for value in row:
+            value = value.strip()
+            if COMMA_DECIMAL_REGEX.match(value):
+                comma_decimals += 1
+            elif DOT_DECIMAL_REGEX.match(value):
+                dot_decimals += 1
+    if comma_decimals and not dot_decimals:
+        return ','
+    if dot_decimals and not comma_decimals:
+        return '.'
+    return decimal_char
+
+
+# splits the text in lines, dropping the last one when it may be incomplete
+def _split_lines(text, truncated):
+    lines = text.splitlines()
+    if truncated and len(lines) > 1:
+        lines = lines[:-1]
+    return [line for line in lines if line.strip()]
+
+
+def _parse_rows(lines, separator):
+    if len(separator) != 1:
+        return [re.split(separator, line) for line in lines]
+    return list(csv.reader(io.StringIO('\n'.join(lines)),
+                           delimiter=separator))
@@ -52,12 +52,17 @@ def setup_logging():
         level=LOG_LEVEL)
 
 
-# creates s3 event notifications on s3 raw bucket
+# suffixes of the csv files, plain or compressed, loaded by csv_to_parquet
+INPUT_SUFFIXES = ('.csv', '.csv.gz', '.csv.zst', '.csv.bz2', '.zip')
+
+
+# creates s3 event notifications on s3 raw bucket, one per accepted suffix
 def add_notification(LambdaArn, Bucket):
     bucket_notification = s3.BucketNotification(Bucket)
     bucket_notification.put(
         NotificationConfiguration={
             'LambdaFunctionConfigurations': [{
+                'Id': f'csv_to_analytics{suffix}',
                 'LambdaFunctionArn': LambdaArn,
                 'Events': ['s3:ObjectCreated:*'],
                 'Filter': {
@@ -67,11 +72,11 @@ def add_notification(LambdaArn, Bucket):
                             'Value': 'csv_to_analytics/'
                         }, {
                             'Name': 'suffix',
-                            'Value': '.csv'
+                            'Value': suffix
                         }]
                     }
                 }
-            }]
+            } for suffix in INPUT_SUFFIXES]
         })
     logging.info('Put event notification request completed.')
 
@@ -0,0 +1,85 @@
+'''
+    About: Shared fixtures of the tests of the csv_to_parquet lambda.
+           The lambda modules and the local fakes of benchmarks/fakes.py are
+           imported from their directories, as the lambda and the benchmarks
+           do.
+'''
+
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(TESTS_DIR, '..', 'lambdas', 'csv_to_parquet')
+BENCHMARKS_DIR = os.path.join(TESTS_DIR, '..', 'benchmarks')
+sys.path.insert(0, LAMBDA_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import fakes  # noqa: E402
+import main  # noqa: E402
+
+RAW_BUCKET = 'raw'
+ANALYTICS_BUCKET = 'analytics'
+GLUE_DATABASE = 'db'
+# globals of main.py replaced by fakes.install or by the tests
+PATCHED_GLOBALS = ('EXECUTION_MODE', 'TARGET_S3_BUCKET', 'TARGET_GLUE_DATABASE',
+                   'SNS_TOPIC_NAME', 'boto3', 'pa_fs', 'BOTO3_SESSION',
+                   'GLUE_CATALOG', 'NOTIFIER', 'SNS_TOPIC_ARN',
+                   'DOWNLOAD_CONCURRENCY', 'MAX_WORKERS',
+                   'NOTIFICATION_WINDOW_SECONDS', 'MANIFEST_BACKEND',
+                   'MANIFEST_PATH', 'MANIFEST', 'MANIFEST_MAX_OUTPUT_FILES')
+
+
+# main.py on cloud mode with s3, sns and glue replaced by the local fakes.
+# Returns the local s3 and the fake clients. Every global is restored after
+# the test.
+@pytest.fixture
+def cloud_lambda(tmp_path):
+    saved_globals = {name: getattr(main, name) for name in PATCHED_GLOBALS}
+    local_s3 = fakes.LocalS3(str(tmp_path / 's3'))
+    clients = fakes.install(main, local_s3)
+    main.EXECUTION_MODE = 'cloud'
+    main.TARGET_S3_BUCKET = ANALYTICS_BUCKET
+    main.TARGET_GLUE_DATABASE = GLUE_DATABASE
+    main.SNS_TOPIC_NAME = 'csv_to_parquet'
+    main.NOTIFICATION_WINDOW_SECONDS = '0'
+    main.MANIFEST_BACKEND = 'none'
+    main.MANIFEST = None
+    yield local_s3, clients
+    for name, value in saved_globals.items():
+        setattr(main, name, value)
+    main.ARROW_FILESYSTEMS.clear()
+    main.BOTO3_CLIENTS.clear()
+    main.BOTO3_CLIENTS_STATS.clear()
+    main.WRITER_PROFILES.clear()
+    main.CATEGORICAL_COLUMNS.clear()
+
+
+# context of a lambda invocation, whose arn gives the sns topic arn
+@pytest.fixture
+def lambda_context():
+    return type(
+        'Context', (), {
+            'invoked_function_arn':
+            'arn:aws:lambda:us-east-1:000000000000:function:csv_to_parquet'
+        })
+
+
+# adds a csv file with the given content to the raw bucket of the local s3
+def put_csv(local_s3, key, content, metadata=None):
+    csv_path = os.path.join(local_s3.root_dir, '..', key.replace('/', '_'))
+    with open(csv_path, 'w') as csv_file:
+        csv_file.write(content)
+    local_s3.put_file(RAW_BUCKET, key, csv_path, metadata)
+    return key
+
+
+# paths of the parquet files of a table on the analytics bucket
+def list_parquet_files(local_s3, table_name):
+    table_dir = local_s3.path(ANALYTICS_BUCKET,
+                              f'databases/{GLUE_DATABASE}/{table_name}')
+    return sorted(
+        os.path.join(directory, file_name)
+        for directory, _, file_names in os.walk(table_dir)
+        for file_name in file_names if file_name.endswith('.parquet'))
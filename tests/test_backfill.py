@@ -0,0 +1,11 @@
+import pytest
+
+import backfill
+
+
+@pytest.mark.parametrize('dest_path, table_name', [
+    ('s3://analytics/databases/db/tbl_weather/', 'tbl_weather'),
+    ('/data/weather/', 'tbl_weather'),
+])
+def test_the_table_is_named_after_the_dataset_directory(dest_path, table_name):
+    assert backfill.get_table_name(dest_path) == table_name
@@ -0,0 +1,115 @@
+import pyarrow.parquet as pq
+import pytest
+
+import fakes
+import main
+from conftest import RAW_BUCKET, list_parquet_files, put_csv
+
+S3_OBJECT_META = {'categorical-threshold': '0.5', 'output-mode': 'append'}
+
+
+def _build_csv(rows):
+    # the site column repeats on the first rows and is unique afterwards
+    lines = ['site,country,value']
+    for row in range(rows):
+        site = f'site {row % 2}' if row < 10 else f'site {row}'
+        lines.append(f'{site},scotland,{row}')
+    return '\n'.join(lines) + '\n'
+
+
+def test_chunks_reuse_the_columns_picked_from_the_first_chunk():
+    first_chunk = main.pd.DataFrame({
+        'site': ['a', 'a', 'b', 'b'],
+        'country': ['x', 'x', 'x', 'x']
+    })
+    second_chunk = main.pd.DataFrame({
+        'site': ['c', 'd', 'e', 'f'],
+        'country': ['x', 'x', 'x', 'x']
+    })
+
+    first_chunk = main.str_columns_to_categorical(first_chunk,
+                                                  's3://raw/a/file.csv',
+                                                  S3_OBJECT_META)
+    second_chunk = main.str_columns_to_categorical(second_chunk,
+                                                   's3://raw/a/file.csv',
+                                                   S3_OBJECT_META)
+
+    assert list(first_chunk.dtypes) == ['category', 'category']
+    assert list(second_chunk.dtypes) == ['category', 'category']
+
+
+def test_partition_and_non_categorical_cols_are_never_converted():
+    dataframe = main.pd.DataFrame({
+        'Site': ['a', 'a'],
+        'Country': ['x', 'x'],
+        'Region': ['y', 'y']
+    })
+
+    dataframe = main.str_columns_to_categorical(
+        dataframe, 's3://raw/a/file.csv',
+        dict(S3_OBJECT_META, **{
+            'partition-cols': 'country',
+            'non-categorical-cols': 'Region'
+        }))
+
+    assert [
+        isinstance(dtype, main.pd.CategoricalDtype)
+        for dtype in dataframe.dtypes
+    ] == [True, False, False]
+
+
+def test_tables_with_the_same_header_pick_their_own_columns():
+    low_cardinality = main.pd.DataFrame({'site': ['a', 'a', 'a', 'a']})
+    high_cardinality = main.pd.DataFrame({'site': ['a', 'b', 'c', 'd']})
+
+    low_cardinality = main.str_columns_to_categorical(
+        low_cardinality, 's3://raw/csv_to_analytics/low/file.csv',
+        S3_OBJECT_META)
+    high_cardinality = main.str_columns_to_categorical(
+        high_cardinality, 's3://raw/csv_to_analytics/high/file.csv',
+        S3_OBJECT_META)
+
+    assert isinstance(low_cardinality['site'].dtype,
+                      main.pd.CategoricalDtype)
+    assert not isinstance(high_cardinality['site'].dtype,
+                          main.pd.CategoricalDtype)
+
+
+def test_the_least_recently_used_tables_are_dropped(monkeypatch):
+    monkeypatch.setattr(main, 'CATEGORICAL_COLUMNS_CACHE_SIZE', '2')
+    dataframe = main.pd.DataFrame({'site': ['a', 'a']})
+    for table in ('first', 'second', 'first', 'third'):
+        main.str_columns_to_categorical(
+            dataframe.copy(), f's3://raw/csv_to_analytics/{table}/file.csv',
+            S3_OBJECT_META)
+
+    assert [key[0] for key in main.CATEGORICAL_COLUMNS] == [
+        'tbl_first', 'tbl_third'
+    ]
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'pyarrow'])
+def test_every_file_of_a_table_has_the_same_schema(cloud_lambda,
+                                                   lambda_context, engine):
+    local_s3, _ = cloud_lambda
+    metadata = dict(S3_OBJECT_META, engine=engine)
+    if engine == 'pandas':
+        metadata['chunk-size'] = '10'
+    keys = [
+        put_csv(local_s3, f'csv_to_analytics/sites/sites_{index}.csv',
+                _build_csv(30), metadata) for index in range(2)
+    ]
+
+    results = main.handler(fakes.build_event(local_s3, RAW_BUCKET, keys),
+                           lambda_context)
+
+    assert [result['status'] for result in results] == ['SUCCESS', 'SUCCESS']
+    schemas = [
+        pq.read_schema(path)
+        for path in list_parquet_files(local_s3, 'tbl_sites')
+    ]
+    assert len(schemas) >= 2
+    assert all(schema.equals(schemas[0]) for schema in schemas)
+    table = pq.read_table(list_parquet_files(local_s3, 'tbl_sites')[0])
+    assert main.pa.types.is_dictionary(table.schema.field('country').type)
+    assert set(table.column('country').to_pylist()) == {'SCOTLAND'}
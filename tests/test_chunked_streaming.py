@@ -0,0 +1,97 @@
+'''
+    About: Peak memory of the chunked mode (chunk-size metadata).
+           A synthetic csv file is loaded by the handler on its own python
+           process, streamed from the local s3, and its peak RSS is compared
+           with the one of a small file of a few chunks. Set CHUNKED_RSS_TEST_MB to load a
+           bigger file, e.g. 4096 for a 4 GB one.
+'''
+
+import json
+import os
+import subprocess
+import sys
+
+from conftest import BENCHMARKS_DIR, LAMBDA_DIR
+
+LARGE_FILE_MB = int(os.getenv('CHUNKED_RSS_TEST_MB', '256'))
+SMALL_FILE_MB = 16
+CHUNK_SIZE = 50000
+# growth of the peak RSS allowed from the small to the large file
+MAX_RSS_GROWTH_MB = 64
+
+# loads the csv file with the handler, on cloud mode with the local fakes,
+# and prints the results and the peak RSS
+LOAD_SCRIPT = '''
+import json, resource, sys
+import fakes, main
+csv_path, s3_root, chunk_size = sys.argv[1], sys.argv[2], sys.argv[3]
+main.EXECUTION_MODE = 'cloud'
+main.TARGET_S3_BUCKET = 'analytics'
+main.TARGET_GLUE_DATABASE = 'db'
+main.DOWNLOAD_CONCURRENCY = '0'
+main.NOTIFICATION_WINDOW_SECONDS = '0'
+local_s3 = fakes.LocalS3(s3_root)
+key = 'csv_to_analytics/synthetic/synthetic.csv'
+local_s3.put_file('raw', key, csv_path, {
+    'chunk-size': chunk_size,
+    'partition-cols': 'event_date',
+    'custom-cast': '{"event_date": "date"}'
+})
+fakes.install(main, local_s3)
+context = type('Context', (), {
+    'invoked_function_arn': 'arn:aws:lambda:us-east-1:0:function:f'})
+results = main.handler(fakes.build_event(local_s3, 'raw', [key]), context)
+print(json.dumps({
+    'results': results,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+}))
+'''
+
+
+def test_chunked_mode_peak_rss_does_not_grow_with_file_size(tmp_path):
+    small = _load(tmp_path, 'small', SMALL_FILE_MB)
+    large = _load(tmp_path, 'large', LARGE_FILE_MB)
+
+    assert large['results'][0]['status'] == 'SUCCESS'
+    assert large['results'][0]['loaded_rows'] > small['results'][0][
+        'loaded_rows'] * LARGE_FILE_MB // SMALL_FILE_MB // 2
+    assert large['peak_rss_mb'] - small['peak_rss_mb'] < MAX_RSS_GROWTH_MB, (
+        f'Peak RSS grew from {small["peak_rss_mb"]:.0f} MB to {large["peak_rss_mb"]:.0f} MB for a {LARGE_FILE_MB} MB file.'
+    )
+
+
+def _load(tmp_path, name, size_mb):
+    csv_path = str(tmp_path / f'{name}.csv')
+    _write_csv(csv_path, size_mb * 1024 * 1024)
+    output = subprocess.run(
+        [
+            sys.executable, '-c', LOAD_SCRIPT, csv_path,
+            str(tmp_path / f'{name}_s3'),
+            str(CHUNK_SIZE)
+        ],
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        env=dict(os.environ,
+                 PYTHONPATH=os.pathsep.join([LAMBDA_DIR, BENCHMARKS_DIR]),
+                 LOG_LEVEL='WARNING',
+                 STAGE_METRICS='false')).stdout
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    print(f'{size_mb} MB file: peak RSS {result["peak_rss_mb"]:.0f} MB')
+    return result
+
+
+# writes a csv file of about size bytes, one block of rows at a time
+def _write_csv(csv_path, size):
+    with open(csv_path, 'w') as csv_file:
+        csv_file.write('id,site_name,event_date,value,comment\n')
+        row_id = 0
+        while csv_file.tell() < size:
+            rows = []
+            for _ in range(10000):
+                rows.append(
+                    f'{row_id},site {row_id % 97},2020-01-0{row_id % 3 + 1},{row_id * 0.5},'
+                    f'{"" if row_id % 10 == 0 else f"comment {row_id % 1013}"}\n'
+                )
+                row_id += 1
+            csv_file.write(''.join(rows))
@@ -0,0 +1,19 @@
+import cold_start
+
+HEAVY_MODULES = ('pandas', 'numpy', 'pyarrow', 'boto3', 'botocore',
+                 'awswrangler')
+
+
+def test_lambda_import_is_within_the_cold_start_budget():
+    # the fastest of a few imports, so a busy machine does not fail the test
+    measures = [
+        cold_start.measure_import_times(cold_start.DEFAULT_LAMBDA_DIR, 'main')
+        for _ in range(3)
+    ]
+    total_ms = min(import_times['main'] for import_times in measures)
+
+    assert total_ms <= cold_start.DEFAULT_BUDGET_MS
+    assert not [
+        module_name for module_name in measures[0]
+        if module_name.split('.')[0] in HEAVY_MODULES
+    ]
@@ -0,0 +1,112 @@
+import os
+import types
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import compaction
+
+
+def _write_files(partition_dir, tables):
+    os.makedirs(partition_dir, exist_ok=True)
+    for index, table in enumerate(tables):
+        pq.write_table(table, os.path.join(partition_dir,
+                                           f'file_{index}.parquet'))
+
+
+def _small_table(first_id, rows=10):
+    return pa.table({
+        'id': pa.array(range(first_id, first_id + rows), pa.int64()),
+        'name': pa.array([f'name {row}' for row in range(rows)])
+    })
+
+
+def _parquet_files(directory):
+    return sorted(file_name for file_name in os.listdir(directory)
+                  if file_name.endswith('.parquet'))
+
+
+def test_small_files_of_each_partition_are_compacted(tmp_path):
+    table_dir = tmp_path / 'tbl_sites'
+    _write_files(table_dir / 'country=A',
+                 [_small_table(first_id) for first_id in range(0, 50, 10)])
+    _write_files(table_dir / 'country=B', [_small_table(0)])
+
+    results = compaction.handler({
+        'path': str(tmp_path),
+        'tables': ['tbl_sites']
+    }, None)
+
+    assert [(result['status'], result['compacted_files'])
+            for result in results] == [('SUCCESS', 5)]
+    compacted_files = _parquet_files(table_dir / 'country=A')
+    assert len(compacted_files) == 1
+    assert compacted_files[0].endswith('.compacted.snappy.parquet')
+    table = pq.read_table(table_dir / 'country=A' / compacted_files[0])
+    assert sorted(table.column('id').to_pylist()) == list(range(50))
+    assert _parquet_files(table_dir / 'country=B') == ['file_0.parquet']
+
+
+def test_every_table_of_the_database_is_compacted(tmp_path):
+    for table_name in ('tbl_a', 'tbl_b'):
+        _write_files(tmp_path / table_name, [_small_table(0), _small_table(10)])
+
+    results = compaction.handler({'path': str(tmp_path)}, None)
+
+    assert [result['partition'].rsplit('/', 1)[1]
+            for result in results] == ['tbl_a', 'tbl_b']
+
+
+def test_output_files_are_split_at_the_target_size(tmp_path):
+    partition_dir = tmp_path / 'tbl_sites'
+    _write_files(partition_dir,
+                 [_small_table(first_id) for first_id in range(0, 40, 10)])
+    file_size = os.path.getsize(partition_dir / 'file_0.parquet')
+
+    results = compaction.compact_table(str(partition_dir),
+                                       target_file_size=file_size * 2)
+
+    assert len(results[0]['output_files']) == 2
+    assert results[0]['compacted_files'] == 4
+
+
+def test_large_files_and_files_of_another_schema_are_left_untouched(tmp_path):
+    partition_dir = tmp_path / 'tbl_sites'
+    other_schema = pa.table({'id': pa.array(['x'])})
+    _write_files(partition_dir,
+                 [_small_table(0),
+                  _small_table(10), other_schema,
+                  _small_table(20, rows=5000)])
+    large_file_size = os.path.getsize(partition_dir / 'file_3.parquet')
+
+    results = compaction.compact_table(str(partition_dir),
+                                       target_file_size=large_file_size)
+
+    assert results[0]['compacted_files'] == 2
+    assert [
+        file_name for file_name in _parquet_files(partition_dir)
+        if file_name.startswith('file_')
+    ] == ['file_2.parquet', 'file_3.parquet']
+
+
+def test_compaction_is_discarded_when_the_partition_changes(
+        tmp_path, monkeypatch):
+    partition_dir = tmp_path / 'tbl_sites'
+    _write_files(partition_dir, [_small_table(0), _small_table(10)])
+
+    # the partition is overwritten by a load while it is compacted
+    def read_table(path, **kwargs):
+        table = pq.read_table(path, **kwargs)
+        if path.endswith('file_1.parquet'):
+            os.remove(partition_dir / 'file_0.parquet')
+        return table
+
+    monkeypatch.setattr(
+        compaction, 'pq',
+        types.SimpleNamespace(read_table=read_table,
+                              ParquetWriter=pq.ParquetWriter))
+
+    results = compaction.compact_table(str(partition_dir))
+
+    assert results[0]['status'] == 'CONFLICT'
+    assert _parquet_files(partition_dir) == ['file_1.parquet']
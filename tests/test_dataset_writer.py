@@ -0,0 +1,120 @@
+import os
+
+import pyarrow as pa
+import pyarrow.fs as pa_fs
+import pyarrow.parquet as pq
+import pytest
+
+import dataset_writer
+import main
+from conftest import ANALYTICS_BUCKET, GLUE_DATABASE, list_parquet_files
+
+WRITER_PROFILE = {'compression': 'snappy'}
+TABLE_NAME = 'tbl_sites'
+
+
+def _sites_table(countries, first_id=0):
+    return pa.table({
+        'id': pa.array(range(first_id, first_id + len(countries)), pa.int64()),
+        'country': pa.array(countries, pa.string())
+    })
+
+
+def _save(table, output_mode, partition_cols=('country', )):
+    return main._save_to_s3_as_parquet(table=table,
+                                       table_name=TABLE_NAME,
+                                       partition_cols=list(partition_cols),
+                                       compression='snappy',
+                                       source_file_path='s3://raw/a/sites.csv',
+                                       s3_object_meta={},
+                                       output_mode=output_mode)
+
+
+def _partition_files(local_s3):
+    table_dir = local_s3.path(ANALYTICS_BUCKET,
+                              f'databases/{GLUE_DATABASE}/{TABLE_NAME}')
+    return {
+        os.path.relpath(os.path.dirname(path), table_dir)
+        for path in list_parquet_files(local_s3, TABLE_NAME)
+    }
+
+
+def _glue_partitions(clients):
+    return sorted(clients['glue'].partitions[(GLUE_DATABASE, TABLE_NAME)])
+
+
+def test_overwrite_replaces_the_whole_dataset(cloud_lambda):
+    local_s3, clients = cloud_lambda
+    _save(_sites_table(['A', 'B']), 'overwrite_partitions')
+
+    paths = _save(_sites_table(['C']), 'overwrite')
+
+    assert _partition_files(local_s3) == {'country=C'}
+    assert len(paths) == 1
+    assert _glue_partitions(clients) == [('C', )]
+
+
+def test_overwrite_partitions_only_replaces_the_written_partitions(
+        cloud_lambda):
+    local_s3, clients = cloud_lambda
+    _save(_sites_table(['A', 'B']), 'overwrite_partitions')
+    _save(_sites_table(['B', 'C'], first_id=10), 'overwrite_partitions')
+
+    assert _partition_files(local_s3) == {
+        'country=A', 'country=B', 'country=C'
+    }
+    assert len(list_parquet_files(local_s3, TABLE_NAME)) == 3
+    assert _glue_partitions(clients) == [('A', ), ('B', ), ('C', )]
+
+
+def test_append_keeps_the_existing_files(cloud_lambda):
+    local_s3, clients = cloud_lambda
+    _save(_sites_table(['A', 'B']), 'append')
+    _save(_sites_table(['B'], first_id=10), 'append')
+
+    assert len(list_parquet_files(local_s3, TABLE_NAME)) == 3
+    assert _glue_partitions(clients) == [('A', ), ('B', )]
+
+
+def test_overwrite_partitions_without_partitions_replaces_the_dataset(
+        cloud_lambda):
+    local_s3, _ = cloud_lambda
+    _save(_sites_table(['A']), 'overwrite_partitions', partition_cols=())
+    _save(_sites_table(['B']), 'overwrite_partitions', partition_cols=())
+
+    paths = list_parquet_files(local_s3, TABLE_NAME)
+    assert len(paths) == 1
+    assert pq.read_table(paths[0]).column('country').to_pylist() == ['B']
+
+
+def test_partition_columns_are_written_as_directories(tmp_path):
+    table = _sites_table(['A', None, 'A'])
+
+    paths, partitions_values = dataset_writer.write_dataset(
+        table=table,
+        filesystem=pa_fs.LocalFileSystem(),
+        root_path=str(tmp_path),
+        partition_cols=['country'],
+        writer_profile=WRITER_PROFILE,
+        output_mode='append',
+        max_workers=2)
+
+    assert partitions_values == {
+        'country=A': ['A'],
+        'country=__HIVE_DEFAULT_PARTITION__': ['__HIVE_DEFAULT_PARTITION__']
+    }
+    assert all(path.endswith('.snappy.parquet') for path in paths)
+    written = pq.read_table(tmp_path / paths[0])
+    assert written.column_names == ['id']
+    assert written.column('id').to_pylist() == [0, 2]
+
+
+def test_invalid_output_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError, match='Invalid output mode'):
+        dataset_writer.write_dataset(table=_sites_table(['A']),
+                                     filesystem=pa_fs.LocalFileSystem(),
+                                     root_path=str(tmp_path),
+                                     partition_cols=[],
+                                     writer_profile=WRITER_PROFILE,
+                                     output_mode='upsert',
+                                     max_workers=1)
@@ -0,0 +1,63 @@
+import os
+import sys
+
+import pytest
+
+import download
+import fakes
+import instrumentation
+from conftest import RAW_BUCKET
+
+KEY = 'csv_to_analytics/sites/sites.csv'
+
+
+def _put_object(local_s3, tmp_path, size):
+    content = bytes(index % 251 for index in range(size))
+    source_path = tmp_path / 'source.csv'
+    source_path.write_bytes(content)
+    local_s3.put_file(RAW_BUCKET, KEY, str(source_path))
+    return content
+
+
+@pytest.mark.parametrize('pwrite', [True, False])
+def test_parts_are_written_at_their_offset(tmp_path, monkeypatch, pwrite):
+    local_s3 = fakes.LocalS3(str(tmp_path / 's3'))
+    content = _put_object(local_s3, tmp_path, 10 * 1000 + 7)
+    if not pwrite:
+        # windows has no os.pwrite
+        monkeypatch.delattr(os, 'pwrite')
+    client = fakes.FakeS3Client(local_s3)
+    local_path = str(tmp_path / 'download.csv')
+
+    download.download_object(client, RAW_BUCKET, KEY, len(content),
+                             local_path, part_size=1000, max_concurrency=4)
+
+    with open(local_path, 'rb') as local_file:
+        assert local_file.read() == content
+    assert len(client.calls) == 11
+
+
+def test_incomplete_parts_fail(tmp_path):
+    local_s3 = fakes.LocalS3(str(tmp_path / 's3'))
+    content = _put_object(local_s3, tmp_path, 2500)
+
+    with pytest.raises(IOError, match='Incomplete part 2000-2999'):
+        download.download_object(fakes.FakeS3Client(local_s3), RAW_BUCKET,
+                                 KEY, len(content) + 500,
+                                 str(tmp_path / 'download.csv'),
+                                 part_size=1000, max_concurrency=2)
+
+
+def test_metrics_are_written_without_the_resource_module(monkeypatch):
+    # windows has no resource module
+    monkeypatch.setitem(sys.modules, 'resource', None)
+    metrics = instrumentation.FileMetrics('s3://raw/a/sites.csv', 'tbl_sites')
+
+    with metrics.measure('read_csv'):
+        pass
+    document = metrics.to_emf({})
+
+    assert instrumentation.get_peak_rss_mb() is None
+    assert 'peak_rss_mb' not in document
+    assert 'peak_rss_mb' not in document['stages']['read_csv']
+    assert document['read_csv.wall_ms'] >= 0
@@ -0,0 +1,73 @@
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import fakes
+import main
+from conftest import RAW_BUCKET, list_parquet_files, put_csv
+
+# an iso date, ints with and without nulls, timestamps, times, booleans, an
+# empty column and the custom-cast data types
+PARITY_CSV = '\n'.join([
+    'Day,Id,Count,Created At,Opens,Active,Empty,Rate,Name,Cast Date,Cast Int',
+    '2020-01-01,1,10,2020-01-01 10:00:00,10:00,True,,1.5,ana,2020-05-01,7',
+    '2020-01-02,,11,2020-01-01T11:00:00,11:30,False,,2,bob,2020-05-02,',
+    '2020-01-03,3,12,2020-01-02 12:00:00,12:00,true,,,,2020-05-03,9',
+    '2020-01-04,4,13,,,,,0.5,dan,,10',
+]) + '\n'
+CUSTOM_CAST = '{"Cast Date": "date", "Cast Int": "int"}'
+
+
+def _load(local_s3, lambda_context, engine):
+    key = put_csv(local_s3, f'csv_to_analytics/parity_{engine}/file.csv',
+                  PARITY_CSV, {
+                      'engine': engine,
+                      'custom-cast': CUSTOM_CAST
+                  })
+    results = main.handler(fakes.build_event(local_s3, RAW_BUCKET, [key]),
+                           lambda_context)
+    assert [result['status'] for result in results] == ['SUCCESS']
+    paths = list_parquet_files(local_s3, f'tbl_parity_{engine}')
+    # the parquet schema is the one read by athena. The arrow schema saved
+    # with it differs between pandas versions (large_string on pandas 3) and
+    # in the index width of dictionary columns.
+    parquet_schema = [(column.name, column.physical_type,
+                       str(column.logical_type))
+                      for column in pq.ParquetFile(paths[0]).schema]
+    table = pq.read_table(paths[0])
+    return parquet_schema, table.to_pylist()
+
+
+@pytest.mark.parametrize('categorical_threshold', ['0', '0.9'])
+def test_both_engines_write_the_same_schema_and_values(
+        cloud_lambda, lambda_context, monkeypatch, categorical_threshold):
+    local_s3, clients = cloud_lambda
+    monkeypatch.setattr(main, 'CATEGORICAL_THRESHOLD', categorical_threshold)
+
+    pandas_schema, pandas_rows = _load(local_s3, lambda_context, 'pandas')
+    arrow_schema, arrow_rows = _load(local_s3, lambda_context, 'pyarrow')
+
+    assert arrow_schema == pandas_schema
+    for row in pandas_rows + arrow_rows:
+        del row['dl_creation_date'], row['dl_source_file']
+    assert arrow_rows == pandas_rows
+    glue_columns = [
+        clients['glue'].tables[(
+            'db', f'tbl_parity_{engine}')]['StorageDescriptor']['Columns']
+        for engine in ('pandas', 'pyarrow')
+    ]
+    assert glue_columns[1] == glue_columns[0]
+
+
+def test_etl_metadata_is_added_to_every_row_of_the_table():
+    table = pa.table({'id': [1, 2, 3]})
+
+    table = main.add_etl_metadata_to_table(table, 's3://raw/a/file.csv')
+
+    assert table.schema.field('dl_creation_date').type == pa.date32()
+    assert table.column('dl_creation_date').to_pylist() == [date.today()] * 3
+    assert table.column('dl_source_file').to_pylist() == [
+        's3://raw/a/file.csv'
+    ] * 3
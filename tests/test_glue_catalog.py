@@ -0,0 +1,171 @@
+import pytest
+
+import fakes
+import glue_catalog
+
+DATABASE = 'db'
+TABLE_NAME = 'tbl_sites'
+PATH = 's3://analytics/databases/db/tbl_sites/'
+PARTITIONS_TYPES = {'country': 'string'}
+
+
+def _catalog(client):
+    return glue_catalog.GlueCatalog(client, DATABASE, snapshot_ttl_seconds=300)
+
+
+def _columns(client):
+    table = client.get_table(DatabaseName=DATABASE, Name=TABLE_NAME)['Table']
+    return [column['Name'] for column in table['StorageDescriptor']['Columns']]
+
+
+def _partitions_values(countries):
+    return {f'{PATH}country={country}/': [country] for country in countries}
+
+
+def test_new_columns_keep_the_columns_added_by_another_container():
+    client = fakes.FakeGlueClient()
+    catalog = _catalog(client)
+    other_catalog = _catalog(client)
+    catalog.sync_table(TABLE_NAME, PATH, {'id': 'bigint'}, PARTITIONS_TYPES,
+                       'snappy')
+    other_catalog.sync_table(TABLE_NAME, PATH, {
+        'id': 'bigint',
+        'name': 'string'
+    }, PARTITIONS_TYPES, 'snappy')
+
+    # the snapshot of catalog does not have the name column
+    catalog.sync_table(TABLE_NAME, PATH, {
+        'id': 'bigint',
+        'value': 'double'
+    }, PARTITIONS_TYPES, 'snappy')
+
+    assert _columns(client) == ['id', 'name', 'value']
+    assert catalog.get_snapshot(TABLE_NAME)['columns_types'] == {
+        'id': 'bigint',
+        'name': 'string',
+        'value': 'double'
+    }
+
+
+class RacingGlueClient(fakes.FakeGlueClient):
+
+    # another container adds a column between the first get_table and
+    # update_table of the catalog
+    def update_table(self, DatabaseName, TableInput, VersionId=None,
+                     **kwargs):
+        if not self.raced:
+            self.raced = True
+            table = dict(self.tables[(DatabaseName, TableInput['Name'])])
+            table['StorageDescriptor'] = dict(
+                table['StorageDescriptor'],
+                Columns=table['StorageDescriptor']['Columns'] + [{
+                    'Name': 'name',
+                    'Type': 'string'
+                }])
+            super().update_table(DatabaseName, table)
+        return super().update_table(DatabaseName, TableInput, VersionId,
+                                    **kwargs)
+
+
+def test_columns_are_added_again_when_the_table_changed_meanwhile():
+    client = RacingGlueClient()
+    client.raced = True
+    catalog = _catalog(client)
+    catalog.sync_table(TABLE_NAME, PATH, {'id': 'bigint'}, PARTITIONS_TYPES,
+                       'snappy')
+    client.raced = False
+
+    catalog.sync_table(TABLE_NAME, PATH, {
+        'id': 'bigint',
+        'value': 'double'
+    }, PARTITIONS_TYPES, 'snappy')
+
+    assert _columns(client) == ['id', 'name', 'value']
+    assert [call[0] for call in client.calls].count('update_table') == 3
+
+
+def test_unchanged_columns_do_not_update_the_table():
+    client = fakes.FakeGlueClient()
+    catalog = _catalog(client)
+    catalog.sync_table(TABLE_NAME, PATH, {'id': 'bigint'}, PARTITIONS_TYPES,
+                       'snappy')
+
+    catalog.sync_table(TABLE_NAME, PATH, {'id': 'bigint'}, PARTITIONS_TYPES,
+                       'snappy')
+
+    assert [call[0] for call in client.calls] == ['get_table', 'create_table']
+
+
+def test_new_partitions_are_registered_in_batches():
+    client = fakes.FakeGlueClient()
+    catalog = _catalog(client)
+    catalog.sync_table(TABLE_NAME, PATH, {'id': 'bigint'}, PARTITIONS_TYPES,
+                       'snappy')
+
+    sent = catalog.add_partitions(
+        TABLE_NAME, _partitions_values(str(index) for index in range(250)),
+        'snappy')
+    sent_again = catalog.add_partitions(TABLE_NAME, _partitions_values(['1']),
+                                        'snappy')
+
+    assert (sent, sent_again) == (250, 0)
+    assert [
+        call[2] for call in client.calls
+        if call[0] == 'batch_create_partition'
+    ] == [100, 100, 50]
+    assert len(client.partitions[(DATABASE, TABLE_NAME)]) == 250
+
+
+def test_partitions_registered_by_another_container_are_ignored():
+    client = fakes.FakeGlueClient()
+    catalog = _catalog(client)
+    other_catalog = _catalog(client)
+    catalog.sync_table(TABLE_NAME, PATH, {'id': 'bigint'}, PARTITIONS_TYPES,
+                       'snappy')
+    other_catalog.add_partitions(TABLE_NAME, _partitions_values(['A']),
+                                 'snappy')
+
+    # existing partitions are not read from glue, so A is sent again
+    sent = catalog.add_partitions(TABLE_NAME, _partitions_values(['A', 'B']),
+                                  'snappy')
+
+    assert sent == 2
+    partitions = sorted(client.partitions[(DATABASE, TABLE_NAME)])
+    assert partitions == [('A', ), ('B', )]
+
+
+def test_failed_partitions_raise():
+    client = fakes.FakeGlueClient()
+    catalog = _catalog(client)
+    catalog.sync_table(TABLE_NAME, PATH, {'id': 'bigint'}, PARTITIONS_TYPES,
+                       'snappy')
+    client.batch_create_partition = lambda **kwargs: {
+        'Errors': [{
+            'PartitionValues': ['A'],
+            'ErrorDetail': {
+                'ErrorCode': 'InternalServiceException'
+            }
+        }]
+    }
+
+    with pytest.raises(RuntimeError, match='Failed to create partitions'):
+        catalog.add_partitions(TABLE_NAME, _partitions_values(['A']),
+                               'snappy')
+
+
+def test_overwrite_recreates_the_table_without_its_partitions():
+    client = fakes.FakeGlueClient()
+    catalog = _catalog(client)
+    catalog.sync_table(TABLE_NAME, PATH, {'id': 'bigint'}, PARTITIONS_TYPES,
+                       'snappy')
+    catalog.add_partitions(TABLE_NAME, _partitions_values(['A']), 'snappy')
+
+    catalog.sync_table(TABLE_NAME,
+                       PATH, {'name': 'string'},
+                       PARTITIONS_TYPES,
+                       'snappy',
+                       overwrite=True)
+
+    assert _columns(client) == ['name']
+    assert client.partitions[(DATABASE, TABLE_NAME)] == {}
+    assert catalog.get_snapshot(TABLE_NAME)['partitions'] == set()
@@ -0,0 +1,136 @@
+import json
+import time
+
+import pyarrow.parquet as pq
+import pytest
+
+import fakes
+import main
+from conftest import RAW_BUCKET, list_parquet_files, put_csv
+
+GOOD_CSV = 'id,name\n1,a\n2,b\n'
+BAD_CSV = 'id,name\nx,a\n'
+METADATA = {'custom-cast': '{"id": "int"}'}
+
+
+def _put_event_files(local_s3):
+    keys = [
+        put_csv(local_s3, 'csv_to_analytics/good/good.csv', GOOD_CSV,
+                METADATA),
+        put_csv(local_s3, 'csv_to_analytics/bad/bad.csv', BAD_CSV, METADATA)
+    ]
+    return fakes.build_event(local_s3, RAW_BUCKET, keys)
+
+
+def test_failed_files_are_notified_without_failing_the_invocation(
+        cloud_lambda, lambda_context):
+    local_s3, clients = cloud_lambda
+    event = _put_event_files(local_s3)
+
+    results = main.handler(event, lambda_context)
+
+    assert [result['status'] for result in results] == ['SUCCESS', 'FAILED']
+    assert [
+        message['Subject'] for message in clients['sns'].messages
+    ] == ['SUCCESS - good.csv - Csv to parquet succeeded.',
+          'ERROR - bad.csv - Csv to parquet failed.']
+
+
+def test_retried_event_only_loads_the_failed_files(cloud_lambda,
+                                                   lambda_context, tmp_path):
+    local_s3, _ = cloud_lambda
+    main.MANIFEST_BACKEND = 'json'
+    main.MANIFEST_PATH = str(tmp_path / 'manifest.json')
+    event = _put_event_files(local_s3)
+
+    with pytest.raises(RuntimeError, match='1 of 2 files failed to load'):
+        main.handler(event, lambda_context)
+    good_files = list_parquet_files(local_s3, 'tbl_good')
+
+    put_csv(local_s3, 'csv_to_analytics/bad/bad.csv', GOOD_CSV, METADATA)
+    event = fakes.build_event(local_s3, RAW_BUCKET, [
+        'csv_to_analytics/good/good.csv', 'csv_to_analytics/bad/bad.csv'
+    ])
+    results = main.handler(event, lambda_context)
+
+    assert [result['status'] for result in results] == ['SKIPPED', 'SUCCESS']
+    assert list_parquet_files(local_s3, 'tbl_good') == good_files
+    assert len(list_parquet_files(local_s3, 'tbl_bad')) == 1
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'pyarrow'])
+def test_streamed_files_are_read_with_the_s3_client(cloud_lambda,
+                                                    lambda_context, engine):
+    local_s3, clients = cloud_lambda
+    main.DOWNLOAD_CONCURRENCY = '0'
+    key = put_csv(local_s3, 'csv_to_analytics/good/good.csv', GOOD_CSV,
+                  dict(METADATA, engine=engine))
+
+    results = main.handler(fakes.build_event(local_s3, RAW_BUCKET, [key]),
+                           lambda_context)
+
+    assert results[0]['loaded_rows'] == 2
+    assert ('get_object', key, None) in clients['s3'].calls
+
+
+def test_files_of_the_same_partition_are_loaded_one_after_the_other(
+        cloud_lambda, lambda_context, monkeypatch):
+    local_s3, _ = cloud_lambda
+    main.MAX_WORKERS = '4'
+    metadata = dict(METADATA, **{'partition-cols': 'day'})
+    keys = [
+        put_csv(local_s3, f'csv_to_analytics/sites/{name}.csv',
+                f'id,name,day\n{row},{name},1\n', metadata)
+        for row, name in enumerate(['first', 'second'])
+    ]
+    loading = []
+    overlaps = []
+    process_s3_object = main.process_s3_object
+
+    def tracked_process_s3_object(s3_object, event):
+        overlaps.append(bool(loading))
+        loading.append(s3_object)
+        time.sleep(0.1)
+        try:
+            return process_s3_object(s3_object, event)
+        finally:
+            loading.remove(s3_object)
+
+    monkeypatch.setattr(main, 'process_s3_object', tracked_process_s3_object)
+
+    results = main.handler(fakes.build_event(local_s3, RAW_BUCKET, keys),
+                           lambda_context)
+
+    assert [result['status'] for result in results] == ['SUCCESS', 'SUCCESS']
+    assert overlaps == [False, False]
+    # the second file overwrote the partition written by the first one
+    parquet_files = list_parquet_files(local_s3, 'tbl_sites')
+    assert len(parquet_files) == 1
+    assert pq.read_table(parquet_files[0]).column('name').to_pylist() == [
+        'SECOND'
+    ]
+
+
+def test_manifest_records_list_a_bounded_number_of_output_files(
+        cloud_lambda, lambda_context, tmp_path):
+    local_s3, _ = cloud_lambda
+    main.MANIFEST_BACKEND = 'json'
+    main.MANIFEST_PATH = str(tmp_path / 'manifest.json')
+    main.MANIFEST_MAX_OUTPUT_FILES = '2'
+    key = put_csv(local_s3, 'csv_to_analytics/sites/sites.csv',
+                  'id,day\n1,1\n2,2\n3,3\n',
+                  dict(METADATA, **{'partition-cols': 'day'}))
+    event = fakes.build_event(local_s3, RAW_BUCKET, [key])
+
+    main.handler(event, lambda_context)
+    results = main.handler(event, lambda_context)
+
+    assert [result['status'] for result in results] == ['SKIPPED']
+    with open(main.MANIFEST_PATH) as manifest_file:
+        record, = json.load(manifest_file).values()
+    assert record['output_files_count'] == 3
+    assert len(record['output_files']) == 2
+    assert {
+        local_s3.local_path(path)
+        for path in record['output_files']
+    } < set(list_parquet_files(local_s3, 'tbl_sites'))
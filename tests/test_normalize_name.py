@@ -0,0 +1,42 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize('name, normalized_name', [
+    ('CamelCase', 'camel_case'),
+    ('camelCaseName', 'camel_case_name'),
+    ('HTTPServer', 'http_server'),
+    ('getHTTPResponseCode', 'get_http_response_code'),
+    ('Site Name', 'site_name'),
+    ('site.name', 'site_name'),
+    ('site-name', 'site_name'),
+    ('Temp. Max', 'temp_max'),
+    ('Already_Snake', 'already_snake'),
+    ('Col 1', 'col_1'),
+    ('ID', 'id'),
+])
+def test_normalize_name(name, normalized_name):
+    assert main._normalize_name(name) == normalized_name
+
+
+def test_normalize_names_keeps_the_order_of_the_columns():
+    assert main.normalize_names(['Site Name', 'eventDate', 'value']) == [
+        'site_name', 'event_date', 'value'
+    ]
+
+
+def test_normalize_names_rejects_collisions():
+    with pytest.raises(ValueError) as error:
+        main.normalize_names(['Site Name', 'site-name', 'siteName', 'value'])
+
+    assert "'site_name': ['Site Name', 'site-name', 'siteName']" in str(
+        error.value)
+
+
+def test_normalize_column_name_renames_the_dataframe_columns():
+    dataframe = main.pd.DataFrame({'Site Name': ['a'], 'eventDate': ['b']})
+
+    dataframe = main.normalize_column_name(dataframe)
+
+    assert list(dataframe.columns) == ['site_name', 'event_date']
@@ -0,0 +1,97 @@
+import time
+
+import fakes
+import notifications
+
+TOPIC_ARN = 'arn:aws:sns:eu-west-1:123456789012:csv-to-parquet'
+
+
+# sns client of the boto3 versions older than 1.20, without publish_batch
+class SnsClientWithoutPublishBatch:
+
+    def __init__(self):
+        self.client = fakes.FakeSnsClient()
+
+    def publish(self, **kwargs):
+        return self.client.publish(**kwargs)
+
+
+class FailingSnsClient(fakes.FakeSnsClient):
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        raise RuntimeError('Throttling')
+
+
+def _notify_successes(notifier, count):
+    for index in range(count):
+        notifier.notify_success(f's3://raw/csv_to_analytics/sites/{index}.csv',
+                                'tbl_sites')
+
+
+def test_notifications_are_published_in_batches_on_flush():
+    client = fakes.FakeSnsClient()
+    notifier = notifications.SnsNotifier(client, TOPIC_ARN, window_seconds=0)
+
+    _notify_successes(notifier, 25)
+    published_before_flush = len(client.messages)
+    notifier.flush()
+
+    assert published_before_flush == 0
+    assert client.requests == 3
+    assert len(client.messages) == 25
+    assert client.messages[0][
+        'Subject'] == 'SUCCESS - 0.csv - Csv to parquet succeeded.'
+
+
+def test_errors_of_a_table_with_the_same_message_are_sent_once():
+    client = fakes.FakeSnsClient()
+    notifier = notifications.SnsNotifier(client, TOPIC_ARN, window_seconds=0)
+
+    for file_name in ('a.csv', 'b.csv', 'a.csv', 'c.csv'):
+        notifier.notify_error(f's3://raw/csv_to_analytics/sites/{file_name}',
+                              'tbl_sites', 'Invalid custom-cast metadata.')
+    notifier.notify_error('s3://raw/csv_to_analytics/sites/d.csv',
+                          'tbl_sites', 'Partition column missing.')
+    notifier.flush()
+
+    assert [message['Subject'] for message in client.messages] == [
+        'ERROR - tbl_sites - 3 files failed to load.',
+        'ERROR - d.csv - Csv to parquet failed.'
+    ]
+    assert client.messages[0]['Message'].count('.csv') == 3
+    assert 'Invalid custom-cast metadata.' in client.messages[0]['Message']
+
+
+def test_each_message_is_published_alone_without_publish_batch():
+    client = SnsClientWithoutPublishBatch()
+    notifier = notifications.SnsNotifier(client, TOPIC_ARN, window_seconds=0)
+
+    _notify_successes(notifier, 3)
+    notifier.flush()
+
+    assert client.client.requests == 3
+    assert len(client.client.messages) == 3
+
+
+def test_failed_publish_does_not_raise():
+    client = FailingSnsClient()
+    notifier = notifications.SnsNotifier(client, TOPIC_ARN, window_seconds=0)
+
+    _notify_successes(notifier, 1)
+    notifier.flush()
+
+    assert client.messages == []
+
+
+def test_notifications_are_published_by_the_background_thread():
+    client = fakes.FakeSnsClient()
+    notifier = notifications.SnsNotifier(client,
+                                         TOPIC_ARN,
+                                         window_seconds=0.05)
+
+    _notify_successes(notifier, 2)
+    deadline = time.monotonic() + 5
+    while len(client.messages) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert len(client.messages) == 2
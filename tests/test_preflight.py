@@ -0,0 +1,107 @@
+import bz2
+import gzip
+import io
+import zipfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import compressed_input
+import fakes
+import main
+from conftest import RAW_BUCKET, list_parquet_files, put_csv
+
+SEMICOLON_CSV = 'id;name\n1;a\n2;b\n'
+PREFLIGHT_RANGE = 'bytes=0-16383'
+CSV_CONTENT = b''.join(b'%d,site %d,%f\n' % (row, row % 7, row * 1.5)
+                       for row in range(20000))
+
+
+def _load(local_s3, lambda_context, key):
+    results = main.handler(fakes.build_event(local_s3, RAW_BUCKET, [key]),
+                           lambda_context)
+    return [result['status'] for result in results]
+
+
+def _get_object_ranges(clients):
+    return [call[2] for call in clients['s3'].calls if call[0] == 'get_object']
+
+
+def test_files_are_read_with_their_metadata_by_default(
+        cloud_lambda, lambda_context):
+    local_s3, clients = cloud_lambda
+    key = put_csv(local_s3, 'csv_to_analytics/sites/sites.csv',
+                  SEMICOLON_CSV)
+
+    statuses = _load(local_s3, lambda_context, key)
+
+    assert statuses == ['SUCCESS']
+    assert PREFLIGHT_RANGE not in _get_object_ranges(clients)
+    table = pq.read_table(list_parquet_files(local_s3, 'tbl_sites')[0])
+    assert table.column('id_name').to_pylist() == ['1;A', '2;B']
+
+
+def test_reject_fails_a_file_that_does_not_match_its_metadata(
+        cloud_lambda, lambda_context):
+    local_s3, _ = cloud_lambda
+    key = put_csv(local_s3, 'csv_to_analytics/sites/sites.csv',
+                  SEMICOLON_CSV, {'preflight': 'reject'})
+
+    assert _load(local_s3, lambda_context, key) == ['FAILED']
+    assert list_parquet_files(local_s3, 'tbl_sites') == []
+
+
+def test_correct_sniffs_a_compressed_file_from_the_range_get(
+        cloud_lambda, lambda_context, tmp_path):
+    local_s3, clients = cloud_lambda
+    gzip_path = tmp_path / 'sites.csv.gz'
+    gzip_path.write_bytes(gzip.compress(SEMICOLON_CSV.encode()))
+    key = 'csv_to_analytics/sites/sites.csv.gz'
+    local_s3.put_file(RAW_BUCKET, key, str(gzip_path), {'preflight': 'correct'})
+
+    statuses = _load(local_s3, lambda_context, key)
+
+    assert statuses == ['SUCCESS']
+    # one range GET for the check and one GET to read the file
+    assert _get_object_ranges(clients) == [PREFLIGHT_RANGE, None]
+    table = pq.read_table(list_parquet_files(local_s3, 'tbl_sites')[0])
+    assert table.column('name').to_pylist() == ['A', 'B']
+
+
+def _zip(content):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr('sites.csv', content)
+    return archive.getvalue()
+
+
+def _zstd(content):
+    sink = pa.BufferOutputStream()
+    stream = pa.CompressedOutputStream(sink, 'zstd')
+    stream.write(content)
+    stream.close()
+    return sink.getvalue().to_pybytes()
+
+
+@pytest.mark.parametrize('compression, compress', [
+    ('gzip', gzip.compress),
+    ('zip', _zip),
+])
+def test_the_head_is_decompressed_from_the_first_bytes(compression, compress):
+    first_bytes = compress(CSV_CONTENT)[:16384]
+
+    head = compressed_input.decompress_head(first_bytes, compression, 16384)
+
+    assert head == CSV_CONTENT[:16384]
+
+
+@pytest.mark.parametrize('compression, compress', [
+    ('zstd', _zstd),
+    ('bz2', bz2.compress),
+])
+def test_incomplete_blocks_are_not_decompressed(compression, compress):
+    first_bytes = compress(CSV_CONTENT)[:16384]
+
+    assert compressed_input.decompress_head(first_bytes, compression,
+                                            16384) is None
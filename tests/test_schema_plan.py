@@ -0,0 +1,102 @@
+import datetime
+
+import pyarrow.parquet as pq
+import pytest
+
+import fakes
+import main
+from conftest import RAW_BUCKET, list_parquet_files, put_csv
+
+CSV = ('Site,Date,Wind Speed,Country\n'
+       'a,2020-04-30,5,SCOTLAND\n'
+       'b,2020-05-02,12,SCOTLAND\n'
+       'c,2020-05-03,15,WALES\n')
+
+
+@pytest.mark.parametrize('metadata', [
+    {
+        'partition-cols': 'country',
+        'select-cols': '["Site", "Date"]'
+    },
+    {
+        'partition-cols': '["Country"]',
+        'drop-cols': 'Country'
+    },
+])
+def test_partition_cols_must_be_loaded(metadata):
+    with pytest.raises(ValueError, match=r"partition columns \['country'\]"):
+        main.compile_schema_plan(None, metadata['partition-cols'],
+                                 metadata.get('select-cols'),
+                                 metadata.get('drop-cols'))
+
+
+def test_partition_cols_selected_by_their_csv_name():
+    schema_plan = main.compile_schema_plan(None, 'wind_speed',
+                                           '["Site", "Wind Speed"]')
+
+    assert schema_plan.usecols('Wind Speed')
+    assert not schema_plan.usecols('Country')
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'pyarrow'])
+def test_row_filter_columns_are_read_and_dropped_after_filtering(
+        cloud_lambda, lambda_context, engine):
+    local_s3, _ = cloud_lambda
+    key = put_csv(
+        local_s3, 'csv_to_analytics/wind/wind.csv', CSV, {
+            'engine': engine,
+            'select-cols': '["Site", "Wind Speed"]',
+            'row-filter': '[("Country", "==", "SCOTLAND"), ("Date", ">", "2020-05-01")]',
+            'custom-cast': '{"Date": "date"}'
+        })
+
+    results = main.handler(fakes.build_event(local_s3, RAW_BUCKET, [key]),
+                           lambda_context)
+
+    assert results[0]['status'] == 'SUCCESS'
+    table = pq.read_table(list_parquet_files(local_s3, 'tbl_wind')[0])
+    assert table.column_names == [
+        'site', 'wind_speed', 'dl_creation_date', 'dl_source_file'
+    ]
+    assert table.column('site').to_pylist() == ['B']
+
+
+def test_pyarrow_row_filter_casts_string_values_to_the_column_type():
+    table = main.pa.table({
+        'date': main.pa.array(
+            [datetime.date(2020, 4, 30),
+             datetime.date(2020, 5, 2)]),
+        'speed': main.pa.array([5.0, 12.5])
+    })
+    s3_object_meta = {
+        'row-filter':
+        '[("date", ">", "2020-05-01"), ("speed", "in", ["12.5", "13"])]'
+    }
+
+    table = main.filter_table_rows(table, 's3://raw/wind.csv', s3_object_meta)
+
+    assert table.column('speed').to_pylist() == [12.5]
+
+
+def test_pyarrow_reads_only_the_selected_and_filter_columns(
+        cloud_lambda, monkeypatch):
+    local_s3, _ = cloud_lambda
+    key = put_csv(local_s3, 'csv_to_analytics/wind/wind.csv', CSV)
+    s3_object_meta = {
+        'drop-cols': '["Date", "Country"]',
+        'row-filter': '[("Country", "==", "WALES")]'
+    }
+    convert_options = []
+    read_csv = main.pa_csv.read_csv
+
+    def spy_read_csv(source, **kwargs):
+        convert_options.append(kwargs['convert_options'])
+        return read_csv(source, **kwargs)
+
+    monkeypatch.setattr(main.pa_csv, 'read_csv', spy_read_csv)
+    table = main.read_csv_arrow(f's3://{RAW_BUCKET}/{key}', {}, s3_object_meta)
+
+    assert convert_options[0].include_columns == [
+        'Site', 'Wind Speed', 'Country'
+    ]
+    assert table.column_names == ['Site', 'Wind Speed', 'Country']
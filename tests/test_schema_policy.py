@@ -0,0 +1,133 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import fakes
+import glue_catalog
+import main
+from conftest import RAW_BUCKET, list_parquet_files, put_csv
+
+TABLE_NAME = 'tbl_sites'
+TABLE_TYPES = {'id': 'bigint', 'value': 'double', 'name': 'string'}
+
+
+def _catalog():
+    catalog = glue_catalog.GlueCatalog(fakes.FakeGlueClient(), 'db',
+                                       snapshot_ttl_seconds=300)
+    catalog.sync_table(TABLE_NAME, 's3://analytics/databases/db/tbl_sites/',
+                       TABLE_TYPES, {}, 'snappy')
+    return catalog
+
+
+def _check_schema(columns_types, policy):
+    return _catalog().check_schema(TABLE_NAME, columns_types, {}, policy)
+
+
+@pytest.mark.parametrize('file_type, table_type, safe', [
+    ('tinyint', 'bigint', True),
+    ('int', 'bigint', True),
+    ('bigint', 'int', False),
+    ('bigint', 'double', True),
+    ('float', 'double', True),
+    ('double', 'bigint', False),
+    ('double', 'int', False),
+    ('string', 'bigint', False),
+    ('bigint', 'string', False),
+])
+def test_safe_casts(file_type, table_type, safe):
+    assert glue_catalog.is_safe_cast(file_type, table_type) == safe
+
+
+def test_reject_fails_on_any_difference():
+    with pytest.raises(ValueError) as error:
+        _check_schema({'id': 'int', 'value': 'double', 'extra': 'string'},
+                      'reject')
+
+    assert 'column id is int but bigint on the table' in str(error.value)
+    assert 'new column extra' in str(error.value)
+    assert 'missing column name' in str(error.value)
+
+
+def test_add_columns_casts_the_safe_numeric_changes():
+    casts, dropped_columns = _check_schema(
+        {
+            'id': 'int',
+            'value': 'bigint',
+            'extra': 'string'
+        }, 'add-columns')
+
+    assert casts == {'id': 'bigint', 'value': 'double'}
+    assert dropped_columns == []
+
+
+def test_add_columns_fails_on_the_other_changes():
+    with pytest.raises(ValueError,
+                       match='column name is bigint but string on the table'):
+        _check_schema({'id': 'int', 'name': 'bigint'}, 'add-columns')
+
+
+def test_add_columns_fails_on_double_to_bigint():
+    with pytest.raises(ValueError,
+                       match='column id is double but bigint on the table'):
+        _check_schema({'id': 'double'}, 'add-columns')
+
+
+def test_coerce_casts_double_to_bigint():
+    casts, _ = _check_schema({'id': 'double'}, 'coerce')
+
+    assert casts == {'id': 'bigint'}
+
+
+def test_coerce_casts_every_change_and_drops_the_new_columns():
+    casts, dropped_columns = _check_schema(
+        {
+            'id': 'string',
+            'name': 'bigint',
+            'extra': 'string'
+        }, 'coerce')
+
+    assert casts == {'id': 'bigint', 'name': 'string'}
+    assert dropped_columns == ['extra']
+
+
+def test_add_columns_loads_a_file_with_a_safe_numeric_change(
+        cloud_lambda, lambda_context):
+    local_s3, clients = cloud_lambda
+    metadata = {'output-mode': 'append', 'schema-policy': 'add-columns'}
+    results = []
+    for key, content in (('first.csv', 'id,value\n1,1.5\n'),
+                         ('second.csv', 'id,value,name\n2,2,b\n')):
+        key = put_csv(local_s3, f'csv_to_analytics/sites/{key}', content,
+                      metadata)
+        results += main.handler(
+            fakes.build_event(local_s3, RAW_BUCKET, [key]), lambda_context)
+
+    assert [result['status'] for result in results] == ['SUCCESS', 'SUCCESS']
+    schemas = [
+        pq.read_schema(path)
+        for path in list_parquet_files(local_s3, TABLE_NAME)
+    ]
+    assert all(schema.field('value').type == pa.float64()
+               for schema in schemas)
+    table = clients['glue'].tables[('db', TABLE_NAME)]
+    assert {
+        'Name': 'name',
+        'Type': 'string'
+    } in table['StorageDescriptor']['Columns']
+
+
+def test_add_columns_fails_a_fractional_value_before_writing(
+        cloud_lambda, lambda_context):
+    local_s3, _ = cloud_lambda
+    metadata = {'output-mode': 'append', 'schema-policy': 'add-columns'}
+    results = []
+    for key, content in (('first.csv', 'id,value\n1,1.5\n'),
+                         ('second.csv', 'id,value\n2.5,2.5\n')):
+        key = put_csv(local_s3, f'csv_to_analytics/sites/{key}', content,
+                      metadata)
+        results += main.handler(
+            fakes.build_event(local_s3, RAW_BUCKET, [key]), lambda_context)
+
+    assert [result['status'] for result in results] == ['SUCCESS', 'FAILED']
+    assert 'column id is double but bigint' in results[1]['error']
+    assert len(list_parquet_files(local_s3, TABLE_NAME)) == 1
@@ -0,0 +1,53 @@
+import gzip
+
+import pytest
+
+import fakes
+import main
+from conftest import RAW_BUCKET, put_csv
+
+GOOD_CSV = 'id,name\n' + ''.join(f'{row},name {row}\n' for row in range(10))
+# the second chunk of 5 rows has a value that is not an int
+BAD_CHUNK_CSV = GOOD_CSV.replace('7,name 7', 'x,name 7')
+METADATA = {'custom-cast': '{"id": "int"}'}
+
+
+def _load(local_s3, lambda_context, key):
+    results = main.handler(fakes.build_event(local_s3, RAW_BUCKET, [key]),
+                           lambda_context)
+    return [result['status'] for result in results]
+
+
+@pytest.mark.parametrize('content, metadata, status', [
+    (GOOD_CSV, {}, 'SUCCESS'),
+    (GOOD_CSV, {'engine': 'pyarrow'}, 'SUCCESS'),
+    (GOOD_CSV, {'chunk-size': '5'}, 'SUCCESS'),
+    (BAD_CHUNK_CSV, {'chunk-size': '5'}, 'FAILED'),
+    (BAD_CHUNK_CSV, {}, 'FAILED'),
+    (BAD_CHUNK_CSV, {'engine': 'pyarrow'}, 'FAILED'),
+])
+def test_s3_bodies_are_closed(cloud_lambda, lambda_context, content, metadata,
+                              status):
+    local_s3, clients = cloud_lambda
+    key = put_csv(local_s3, 'csv_to_analytics/sites/sites.csv', content,
+                  dict(METADATA, **metadata))
+
+    assert _load(local_s3, lambda_context, key) == [status]
+    assert clients['s3'].bodies
+    assert all(body.closed for body in clients['s3'].bodies)
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'pyarrow'])
+def test_s3_bodies_of_compressed_files_are_closed(cloud_lambda,
+                                                  lambda_context, tmp_path,
+                                                  engine):
+    local_s3, clients = cloud_lambda
+    gzip_path = tmp_path / 'sites.csv.gz'
+    gzip_path.write_bytes(gzip.compress(GOOD_CSV.encode()))
+    key = 'csv_to_analytics/sites/sites.csv.gz'
+    local_s3.put_file(RAW_BUCKET, key, str(gzip_path),
+                      dict(METADATA, engine=engine))
+
+    assert _load(local_s3, lambda_context, key) == ['SUCCESS']
+    assert clients['s3'].bodies
+    assert all(body.closed for body in clients['s3'].bodies)
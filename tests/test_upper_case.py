@@ -0,0 +1,66 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import main
+
+# ascii, expanded by str.upper (ß, the fi ligature), with a title case
+# letter (ǅ) and missing values
+VALUES = ['abc', 'straße', 'ﬁx', 'ǆemal', 'ÿ', None]
+EXPECTED = ['ABC', 'STRASSE', 'FIX', 'ǄEMAL', 'Ÿ', None]
+
+
+# missing values are NaN, None or pd.NA depending on the dtype
+def _to_list(df_column):
+    return [
+        None if pd.isna(value) else value
+        for value in df_column.astype(object).tolist()
+    ]
+
+
+def test_utf8_upper_gives_the_values_of_str_upper():
+    values = pa.array(VALUES)
+
+    assert main.utf8_upper(values).to_pylist() == EXPECTED
+    assert main.utf8_upper(pa.chunked_array(
+        [values[:2], values[2:]])).to_pylist() == EXPECTED
+
+
+def test_string_columns_are_upper_cased_like_str_upper():
+    dataframe = pd.DataFrame({
+        'text': pd.Series(VALUES[:-1] + [float('nan')], dtype=object),
+        'mixed': pd.Series(['abc', 1, None, 'ß', 2.5, 'x'], dtype=object),
+        'number': [1, 2, 3, 4, 5, 6],
+        'category': pd.Series(VALUES, dtype='category')
+    })
+    expected_mixed = _to_list(dataframe['mixed'].str.upper())
+
+    dataframe = main.normalize_str_columns(dataframe, {})
+
+    assert _to_list(dataframe['text']) == EXPECTED
+    assert _to_list(dataframe['mixed']) == expected_mixed
+    assert _to_list(dataframe['category']) == EXPECTED
+    assert dataframe['number'].tolist() == [1, 2, 3, 4, 5, 6]
+
+
+def test_string_columns_are_kept_without_output_str_upper():
+    dataframe = pd.DataFrame({'text': pd.Series(VALUES, dtype=object)})
+
+    dataframe = main.normalize_str_columns(dataframe,
+                                           {'output-str-upper': 'false'})
+
+    assert _to_list(dataframe['text']) == VALUES
+
+
+@pytest.mark.parametrize('dictionary', [False, True])
+def test_arrow_string_columns_are_upper_cased_like_str_upper(dictionary):
+    column = pa.array(VALUES)
+    if dictionary:
+        column = column.dictionary_encode()
+    table = pa.table({'text': column, 'number': pa.array(range(6))})
+
+    table = main.str_columns_to_upper_arrow(table, {})
+
+    assert table.column('text').to_pylist() == EXPECTED
+    assert table.column('text').type == column.type
+    assert table.column('number').to_pylist() == list(range(6))